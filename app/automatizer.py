@@ -4,15 +4,35 @@ import sys
 # Ajouter le chemin racine
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from app.services import data_loader, db_initializer
+from app.services import data_loader, db_initializer, feed_updater, gtfs_downloader
 
-def run():
+def run(full=False, browser=False, extract=False):
     try:
-        # Chargement des données
-        data_loader.load_data_from_web()
+        # Chargement des données : téléchargement HTTP direct (conditionnel), ou navigateur avec --browser
+        status = data_loader.load_data_from_web(browser=browser, extract=extract or browser)
+        if status is None:
+            print("❌ Téléchargement des données impossible ; la base précédente reste active.")
+            sys.exit(1)
 
-        # Initialisation de la base de données
-        db_initializer.init_db()
+        # Fichiers GTFS lus directement dans l'archive, sans extraction (sauf --extract ou --browser)
+        archive = None if extract or browser else data_loader.ZIP_PATH
+
+        # Archive inchangée et déjà chargée : ni décompression ni comparaison des fichiers
+        archive_hash = gtfs_downloader.archive_sha256(archive) if archive else None
+        if (not full and status == gtfs_downloader.UNCHANGED and archive_hash is not None
+                and db_initializer.read_archive_hash() == archive_hash):
+            print("✅ Flux GTFS inchangé : la base est déjà à jour.")
+            return
+
+        # Mise à jour de la base : incrémentale par défaut, reconstruction complète avec --full
+        # (la base en service est conservée en cas d'échec)
+        if full:
+            updated = db_initializer.init_db(archive=archive)
+        else:
+            updated = feed_updater.update_db(archive=archive)
+        if not updated:
+            print("❌ Nouvelle base non mise en service ; la base précédente reste active.")
+            sys.exit(1)
 
         # Confirmation de l'initialisation
         print("✅ Base de données initialisée et données chargées avec succès.")
@@ -22,4 +42,5 @@ def run():
         sys.exit(1)
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    args = sys.argv[1:]
+    run(full="--full" in args, browser="--browser" in args, extract="--extract" in args)
\ No newline at end of file
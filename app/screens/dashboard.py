@@ -1,5 +1,7 @@
 # fichier : app/screens/dashboard.py
 
+import sqlite3
+
 import matplotlib.pyplot as plt
 import pandas as pd
 import streamlit as st
@@ -7,12 +9,17 @@ import seaborn as sns
 import altair as alt
 
 from app.services.db_connector import get_connection
+from app.services.export_service import FORMATS, available_formats, download_link, export_query
 
 def run():
     st.title("📊 Tableau de bord - Analyse de la mobilité")
 
     # --- Connexion ---
-    conn = get_connection()
+    try:
+        conn = get_connection()
+    except sqlite3.Error as e:
+        st.error(f"❌ Base de données indisponible : {e}")
+        return
 
     # --- Récupération des lignes disponibles pour filtre ---
     all_routes = pd.read_sql("SELECT DISTINCT route_long_name FROM routes ORDER BY route_long_name", conn)
@@ -26,32 +33,24 @@ def run():
     with col2:
         hour_end = st.selectbox("⏰ Heure de fin", list(range(0, 24)), index=20)
 
-    # --- Requête conditionnelle selon filtre ---
-    query = f"""
-        SELECT 
-            s.stop_name,
-            st.departure_time,
-            r.route_long_name,
-            r.route_type,
-            t.service_id
-        FROM stop_times st
-        JOIN stops s ON st.stop_id = s.stop_id
-        JOIN trips t ON t.trip_id = st.trip_id
-        JOIN routes r ON r.route_id = t.route_id
-        WHERE st.departure_time IS NOT NULL
-    """
-
-    params = []
+    # --- Filtres appliqués en SQL sur le cube analytique (agrégé à l'ingestion) ---
+    where = "WHERE hour BETWEEN ? AND ?"
+    params = [hour_start, hour_end]
     if route_filter != "Toutes":
-        query += " AND r.route_long_name = ?"
+        where += " AND route_long_name = ?"
         params.append(route_filter)
 
-    df = pd.read_sql(query, conn, params=params)
-    conn.close()
+    def cube_query(select, group_by="", order_by=""):
+        return pd.read_sql(f"SELECT {select} FROM analytics_cube {where} {group_by} {order_by}", conn, params=params)
 
-    # --- Transformation horaire ---
-    df['hour'] = df['departure_time'].str[:2].astype(int)
-    df = df[(df['hour'] >= hour_start) & (df['hour'] <= hour_end)]
+    totals = cube_query(
+        "COUNT(DISTINCT stop_name) AS stops, COUNT(DISTINCT route_long_name) AS routes, "
+        "COALESCE(SUM(departures), 0) AS departures"
+    ).iloc[0]
+    top_stops = cube_query("stop_name, SUM(departures) AS nb", "GROUP BY stop_name", "ORDER BY nb DESC LIMIT 10")
+    hour_distribution = cube_query("hour, SUM(departures) AS départs", "GROUP BY hour", "ORDER BY hour")
+    type_counts = cube_query("route_type, SUM(departures) AS nb", "GROUP BY route_type", "ORDER BY nb DESC")
+    conn.close()
 
     # --- Statistiques dynamiques ---
     st.subheader("📃 Statistiques filtrées")
@@ -67,21 +66,19 @@ def run():
             <h4>🚦 Départs</h4><p style='font-size: 24px;'>{}</p>
         </div>
     </div>
-    """.format(df['stop_name'].nunique(), df['route_long_name'].nunique(), len(df)), unsafe_allow_html=True)
+    """.format(totals['stops'], totals['routes'], totals['departures']), unsafe_allow_html=True)
 
     # --- Affichage graphique en colonnes ---
     col1, col2 = st.columns(2)
 
     with col1:
         st.subheader("📍 Top 10 des arrêts les plus desservis")
-        top_stops = df['stop_name'].value_counts().head(10).reset_index()
         top_stops.columns = ["Nom de l'arrêt", "Nombre de passages"]
         st.dataframe(top_stops, use_container_width=True)
 
         st.subheader("⏱️ Histogramme des départs (heures)")
-        hist = df['hour'].value_counts().sort_index()
         fig1, ax1 = plt.subplots(figsize=(6, 4))
-        ax1.bar(hist.index, hist.values, color="skyblue")
+        ax1.bar(hour_distribution['hour'], hour_distribution['départs'], color="skyblue")
         ax1.set_xlabel("Heure")
         ax1.set_ylabel("Nombre de départs")
         ax1.set_title("Fréquence des départs par heure")
@@ -93,8 +90,6 @@ def run():
             0: "Tram", 1: "Métro", 2: "Train", 3: "Bus",
             4: "Ferry", 5: "Téléphérique", 6: "Funiculaire", 7: "Trolleybus"
         }
-        type_counts = df['route_type'].value_counts().reset_index()
-        type_counts.columns = ['route_type', 'nb']
         type_counts['label'] = type_counts['route_type'].map(route_type_map)
 
         fig2, ax2 = plt.subplots(figsize=(6, 4))
@@ -104,7 +99,6 @@ def run():
         st.pyplot(fig2)
 
         st.subheader("📈 Tendances horaires - Altair")
-        hour_distribution = df.groupby('hour').size().reset_index(name='départs')
         chart = alt.Chart(hour_distribution).mark_area(opacity=0.6, color="#FF8C00").encode(
             x='hour:O',
             y='départs:Q',
@@ -112,8 +106,13 @@ def run():
         ).properties(height=300)
         st.altair_chart(chart, use_container_width=True)
 
-    # --- Export CSV ---
+    # --- Export (flux par blocs vers un fichier temporaire compressé) ---
     st.subheader("📥 Exporter les données filtrées")
-    if st.button("📄 Télécharger en CSV"):
-        csv = df.to_csv(index=False).encode("utf-8")
-        st.download_button("📎 Télécharger CSV", data=csv, file_name="stats_mobilite_filtrees.csv", mime="text/csv")
+    export_format = st.selectbox("Format", available_formats(), format_func=lambda f: FORMATS[f]["label"])
+    if st.button("📄 Préparer l'export"):
+        path = export_query(
+            f"SELECT route_long_name, route_type, stop_name, hour, departures FROM analytics_cube {where} ORDER BY hour",
+            params, export_format, basename="stats_mobilite_filtrees",
+            dtypes={"route_type": "Int64", "hour": "Int64", "departures": "Int64"})
+        # Lien vers le fichier servi statiquement : l'export n'est pas relu en mémoire
+        st.markdown(download_link(path, f"stats_mobilite_filtrees.{export_format}"), unsafe_allow_html=True)
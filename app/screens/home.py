@@ -1,9 +1,8 @@
 # fichier : app/screens/accueil.py
 
 import streamlit as st
-import os
-import pandas as pd
-from app.services.db_connector import get_connection
+from app.services.db_connector import get_feed_summary
+from app.services.event_log import get_event_log
 
 def run():
     st.title("🏙️ Accueil - Optimisation de la Mobilité Urbaine")
@@ -15,13 +14,15 @@ def run():
 
     st.markdown("## 📊 Statistiques en temps réel")
 
-    # Chargement rapide des stats clés depuis la base
-    conn = get_connection()
-    stops = pd.read_sql("SELECT COUNT(*) AS n FROM stops", conn).iloc[0]["n"]
-    trips = pd.read_sql("SELECT COUNT(*) AS n FROM trips", conn).iloc[0]["n"]
-    routes = pd.read_sql("SELECT COUNT(*) AS n FROM routes", conn).iloc[0]["n"]
-    transfers = pd.read_sql("SELECT COUNT(*) AS n FROM transfers", conn).iloc[0]["n"]
-    conn.close()
+    # Stats clés : une seule ligne de `feed_summary` (écrite à l'ingestion)
+    summary = get_feed_summary() or {}
+    stops = summary.get("stops", 0)
+    trips = summary.get("trips", 0)
+    routes = summary.get("routes", 0)
+    transfers = summary.get("transfers", 0)
+    # Cumul CO2 pré-agrégé par le journal des itinéraires
+    emissions = get_event_log().totals()
+    total_co2 = emissions["co2_total_g"]
 
     animation_css = """
         <style>
@@ -79,13 +80,7 @@ def run():
     # Total des commissions CO2 générées dans l'application
     st.markdown("## 🌱 Impact Environnemental")
     col = st.columns(1)[0]
-    # Récupérer les données de CO2 économisé depuis le fichier data/commissions_log.csv
-    if not os.path.exists("data/emission_log.csv"):
-        total_co2 = 0
-    else:
-        emissions_df = pd.read_csv("data/emission_log.csv", header=0)
-        total_co2 = emissions_df['co2_total'].sum() / 2 if 'co2_total' in emissions_df.columns else 0
-
+    if emissions["itineraries"]:
         with col:
             st.markdown(f"""
                 <div class="stat-card" style="background-color:#4CAF50;padding:20px;border-radius:10px;text-align:center">
@@ -96,13 +91,7 @@ def run():
 
     st.markdown("---")
     col = st.columns(2)[0]
-    # Récupérer les données de CO2 économisé depuis le fichier data/commissions_log.csv
-    if not os.path.exists("data/emission_log.csv"):
-        total_co2 = 0
-    else:
-        emissions_df = pd.read_csv("data/emission_log.csv", header=0)
-        total_co2 = emissions_df['co2_total'].sum() / 2 if 'co2_total' in emissions_df.columns else 0
-
+    if emissions["itineraries"]:
         with col:
             st.markdown(f"""
                 <div class="stat-card" style="background-color:#e9e93a;padding:20px;border-radius:10px;text-align:center">
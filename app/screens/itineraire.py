@@ -1,6 +1,6 @@
 import logging
 import os
-import pickle
+import sqlite3
 from datetime import datetime, timedelta
 
 import folium
@@ -8,12 +8,18 @@ import pandas as pd
 import streamlit as st
 from streamlit_folium import st_folium
 
-from app.services.db_connector import get_connection
-from app.services.graph_builder import build_graph
-from app.services.route_finder import find_best_path
+from app.services.connection_scan import ConnectionTimetable, csa_profile_query
+from app.services.contraction import hierarchy_dir, open_hierarchy
+from app.services.db_connector import get_connection, get_feed_hash
+from app.services.event_log import get_event_log, new_result_id
+from app.services.graph_builder import load_transit_graph, resolve_graph_artifact
+from app.services.raptor import RaptorTimetable, journey_to_schedule, raptor_query
+from app.services.route_finder import CostOverlay, find_best_path
 from app.services.schedule_estimator import estimate_schedule
+from app.services.service_calendar import day_type_of
+from app.services.transit_graph import current_version
 from app.utils import calculate_co2, get_weather
-from app.services.congestion_handler import predict_congested_stops, should_avoid_congestion
+from app.services.congestion_handler import predict_congested_stops
 
 # === Logging config ===
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -23,22 +29,58 @@ logger = logging.getLogger(__name__)
 BASE_DIR = os.path.dirname(__file__)
 DATA_DIR = os.path.join(BASE_DIR, "../../data")
 DB_PATH = os.path.join(DATA_DIR, "databases/mobility.db")
-GRAPH_PATH = os.path.join(DATA_DIR, "graphe_transport.pkl")
+
+# === Moteurs de calcul ===
+ENGINE_TIMETABLE = "Horaires réels (RAPTOR)"
+ENGINE_GRAPH = "Graphe (temps moyens)"
+
+
+def store_result(schedule, start_name, end_name, selected_time, avoid_congestion):
+    total_duration_min = (schedule[-1]['arrival_dt'] - schedule[0]['departure_dt']).seconds // 60
+
+    st.session_state['itineraire_result'] = {
+        "result_id": new_result_id(),
+        "schedule": schedule,
+        "start_name": start_name,
+        "end_name": end_name,
+        "departure_time": selected_time,
+        "arrival_time": schedule[-1]['arrival_dt'].strftime('%H:%M'),
+        "duration": total_duration_min,
+        "congestion_avoidance": avoid_congestion
+    }
+    # Journal des itinéraires : un événement par itinéraire calculé (et non par réaffichage)
+    get_event_log().log_itinerary(st.session_state['itineraire_result'], calculate_co2(schedule))
 
 
 def run():
     st.title("🗺️ Recherche d'Itinéraire")
 
+    @st.cache_resource
+    def open_transit_graph(directory):
+        # Tableaux projetés en mémoire : partagés entre sessions (et entre processus via le cache disque)
+        return load_transit_graph(directory)
+
+    @st.cache_resource
+    def get_hierarchy(directory, version, _G):
+        # Hiérarchie de contraction précalculée hors ligne (`python -m app.services.contraction`) ;
+        # None si absente ou construite pour un autre graphe : la recherche A* est alors utilisée
+        return open_hierarchy(directory, _G)
+
+    @st.cache_resource
+    def get_raptor_timetable(feed_hash):
+        # Reconstruit uniquement lorsqu'un nouveau flux GTFS est chargé
+        return RaptorTimetable.from_db()
+
+    @st.cache_resource
+    def get_connection_timetable(feed_hash):
+        return ConnectionTimetable.from_db()
+
     @st.cache_data
-    def load_data_from_db():
+    def get_stop_details():
         conn = get_connection()
-        stops = pd.read_sql("SELECT * FROM stops", conn)
-        stop_times = pd.read_sql("SELECT * FROM stop_times", conn)
-        trips = pd.read_sql("SELECT * FROM trips", conn)
-        routes = pd.read_sql("SELECT * FROM routes", conn)
-        transfers = pd.read_sql("SELECT * FROM transfers", conn)
+        df = pd.read_sql("SELECT stop_id, stop_name, stop_lat, stop_lon FROM stops", conn)
         conn.close()
-        return stops, stop_times, trips, routes, transfers
+        return df.drop_duplicates("stop_id").set_index("stop_id").to_dict("index")
 
     @st.cache_data
     def get_stops():
@@ -47,7 +89,11 @@ def run():
         conn.close()
         return df
 
-    stops_df = get_stops()
+    try:
+        stops_df = get_stops()
+    except sqlite3.Error as e:
+        st.error(f"❌ Base de données indisponible : {e}")
+        return
     stop_names = stops_df['stop_name'].sort_values().unique()
 
     col1, col2 = st.columns(2)
@@ -67,35 +113,61 @@ def run():
 
     logger.info(f"Itinéraire demandé : {start_name} ({start_id}) → {end_name} ({end_id}) à {selected_time}")
 
+    engine = st.radio(
+        "🧮 Moteur de calcul",
+        [ENGINE_TIMETABLE, ENGINE_GRAPH],
+        horizontal=True,
+        help="Les horaires réels tiennent compte de la date, de l'heure et des attentes en station.",
+    )
     avoid_congestion = st.checkbox("⚠️ Privilégier un itinéraire sans congestion (si possible)", value=True)
 
-    if st.button("🔀 Itinéraire optimisé (avec correspondances)"):
-        stops, stop_times, trips, routes, transfers = load_data_from_db()
-        if os.path.exists(GRAPH_PATH):
-            with open(GRAPH_PATH, "rb") as f:
-                G, name_to_id, id_to_name = pickle.load(f)
-        else:
-            G, name_to_id, id_to_name = build_graph(stops, stop_times, trips, routes, transfers)
+    clicked = st.button("🔀 Itinéraire optimisé (avec correspondances)")
+
+    if clicked and engine == ENGINE_TIMETABLE:
+        departure_dt = datetime.combine(selected_date, selected_time)
+        journeys = raptor_query(get_raptor_timetable(get_feed_hash()), start_id, end_id, departure_dt)
+        if not journeys:
+            st.error("❌ Aucun départ trouvé pour cette date et cette heure.")
+            return
+        if avoid_congestion:
+            st.caption("ℹ️ L'évitement des congestions s'applique au moteur « Graphe ».")
+
+        # Le plus rapide des trajets Pareto-optimaux (arrivée / correspondances)
+        schedule = journey_to_schedule(journeys[-1], get_stop_details())
+        store_result(schedule, start_name, end_name, selected_time, avoid_congestion=False)
+
+        # Tableau des départs possibles dans l'heure (requête profil CSA)
+        st.session_state['itineraire_result']["departures"] = csa_profile_query(
+            get_connection_timetable(get_feed_hash()), start_id, end_id,
+            departure_dt, departure_dt + timedelta(hours=1))
+
+    if clicked and engine == ENGINE_GRAPH:
+        # Artefact associé au flux chargé (l'ancien reste servi pendant une reconstruction)
+        graph_dir = resolve_graph_artifact()
+        loaded = open_transit_graph(graph_dir)
+        if loaded is None:
+            open_transit_graph.clear()
+            st.error("❌ Graphe de transport indisponible.")
+            return
+        G, name_to_id, id_to_name = loaded
 
         if start_id not in G.nodes or end_id not in G.nodes:
             st.warning("🚫 Départ ou arrivée non trouvés dans le graphe.")
             return
 
-        congested_stops = predict_congested_stops()
+        overlay = None
 
         if avoid_congestion:
             st.info("⚠️ Analyse des congestions en cours...")
 
+            # Lecture indexée de l'agrégat stop_hour_traffic pour l'heure et le type de jour demandés
+            congested_stops = predict_congested_stops(hour=selected_time.hour, day_type=day_type_of(selected_date))
             congested_stops = [n for n in congested_stops if n not in (start_id, end_id)]
 
-            penalized = 0
-            for u, v, data in list(G.edges(data=True)):
-                if u in congested_stops or v in congested_stops:
-                    G[u][v]["weight"] *= 2  # pénalisation légère
-                    G[u][v]["congestion_penalty"] = True
-                    penalized += 1
+            # Pénalisation légère appliquée pendant la recherche : le graphe partagé n'est ni copié ni modifié
+            overlay = CostOverlay.from_stops(congested_stops, factor=2)
 
-            logger.info(f"Pénalisation appliquée à {penalized} arêtes congestionnées.")
+            logger.info(f"Pénalisation appliquée aux arêtes de {len(overlay.stop_factors)} arrêts congestionnés.")
 
         if start_id not in G.nodes:
             st.error(f"⛔ Le point de départ sélectionné ({start_id}) n’est pas dans le graphe.")
@@ -104,24 +176,20 @@ def run():
             st.error(f"⛔ Le point d’arrivée sélectionné ({end_id}) n’est pas dans le graphe.")
             return
 
-        path = find_best_path(G, start_id, end_id)
+        # Sans pénalité, la hiérarchie de contraction (si précalculée) répond au même coût qu'A*
+        hierarchy = None
+        if overlay is None:
+            hierarchy = get_hierarchy(graph_dir, current_version(hierarchy_dir(graph_dir)), G)
+        method = "ch" if hierarchy is not None else "astar"
+        path = find_best_path(G, start_id, end_id, method=method, hierarchy=hierarchy, overlay=overlay)
         if not path:
             st.error("❌ Aucun chemin trouvé dans le graphe.")
             return
 
         departure_dt = datetime.combine(selected_date, selected_time)
-        schedule = estimate_schedule(path, departure_dt, stop_times, trips, routes, G)
-        total_duration_min = (schedule[-1]['arrival_dt'] - schedule[0]['departure_dt']).seconds // 60
-
-        st.session_state['itineraire_result'] = {
-            "schedule": schedule,
-            "start_name": start_name,
-            "end_name": end_name,
-            "departure_time": selected_time,
-            "arrival_time": schedule[-1]['arrival_dt'].strftime('%H:%M'),
-            "duration": total_duration_min,
-            "congestion_avoidance": avoid_congestion
-        }
+        # Horaires lus tronçon par tronçon (requêtes indexées) : stop_times n'est jamais chargé en entier
+        schedule = estimate_schedule(path, departure_dt, G)
+        store_result(schedule, start_name, end_name, selected_time, avoid_congestion)
 
     if "itineraire_result" in st.session_state:
         result = st.session_state["itineraire_result"]
@@ -142,14 +210,6 @@ def run():
             st.markdown(f"**☀️ Météo prévue à l’arrivée** : {weather_text}")
             if "pluie" in weather_text.lower():
                 st.info("🌧️ **Pluie prévue à l’arrivée** — prévoyez un parapluie ! ☔️")
-        # Enrigistrer le résultat de l'itinéraire dans data/emission_log.csv
-        if not os.path.exists("data/emission_log.csv"):
-            with open("data/emission_log.csv", "w") as f:
-                f.write("datetime,departure_time,arrival_time,duration,co2_total,start_name,end_name,congestion_avoidance\n")
-        with open("data/emission_log.csv", "a") as f:
-            f.write(f"{datetime.now().isoformat()},{result['departure_time']},{result['arrival_time']},"
-                    f"{result['duration']},{co2_total},{result['start_name']},{result['end_name']},"
-                    f"{result['congestion_avoidance']}\n")
 
         st.markdown(f"""
         - 🟢 **Départ** : {result['start_name']} à {schedule[0]['departure_dt'].strftime('%H:%M')}
@@ -168,6 +228,14 @@ def run():
         } for s in schedule])
         st.dataframe(df)
 
+        if result.get("departures"):
+            st.markdown("### 🕐 Départs possibles dans l'heure")
+            st.dataframe(pd.DataFrame([{
+                "Départ": d['departure'].strftime("%H:%M"),
+                "Arrivée": d['arrival'].strftime("%H:%M"),
+                "Durée (min)": d['duration_min']
+            } for d in result["departures"]]))
+
         st.markdown("### 🗺️ Trajet sur la carte")
         coords = [(s['lat'], s['lon']) for s in schedule if s['lat'] and s['lon']]
         if not coords:
@@ -1,67 +1,55 @@
 # fichier : app/screens/admin_congestion_map.py
 
-import pandas as pd
 import folium
 import streamlit as st
 from folium.plugins import HeatMap
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import LabelEncoder
 
-from app.services.db_connector import get_connection
+from app.services.export_service import FORMATS, available_formats, download_link, export_frames
+from app.services.heatmap_builder import heatmap_version, open_heatmap_artifact
+
+DAY_TYPE_LABELS = {"weekday": "Semaine", "saturday": "Samedi", "sunday": "Dimanche"}
 
 
 def run():
     st.title("📍 Carte des risques de congestion")
 
-    # --- Chargement des données ---
-    conn = get_connection()
-    stop_times = pd.read_sql("SELECT * FROM stop_times", conn)
-    stops = pd.read_sql("SELECT * FROM stops", conn)
-    trips = pd.read_sql("SELECT * FROM trips", conn)
-    conn.close()
-
-    # Préparation des données
-    stop_times = stop_times.dropna(subset=["departure_time"])
-    stop_times = stop_times.merge(trips[["trip_id", "route_id"]], on="trip_id", how="left")
-
-    # Extraction heure
-    stop_times["hour"] = stop_times["departure_time"].str[:2].astype(int)
+    @st.cache_resource(max_entries=1)
+    def get_heatmap(version):
+        # Tableaux projetés en mémoire, produits hors ligne par `python -m app.services.heatmap_builder` ;
+        # `version` (date de construction) rouvre l'artefact lorsqu'il a été régénéré
+        return open_heatmap_artifact()
 
-    # Comptage du trafic
-    traffic_df = stop_times.groupby(["stop_id", "hour"]).size().reset_index(name="traffic")
-    data = traffic_df.merge(stops[["stop_id", "stop_lat", "stop_lon"]], on="stop_id", how="left")
-    data = data.dropna()
+    heatmap = get_heatmap(heatmap_version())
+    if heatmap is None:
+        get_heatmap.clear()
+        st.warning("⚠️ Carte de chaleur non générée. Lance `python -m app.services.heatmap_builder`.")
+        return
 
-    # Modèle IA (Random Forest)
-    features = data[["hour"]]
-    target = data["traffic"]
-    model = RandomForestRegressor(n_estimators=100, random_state=42)
-    model.fit(features, target)
+    col1, col2 = st.columns(2)
+    with col1:
+        day_type = st.selectbox("📅 Type de jour", heatmap.day_types, format_func=lambda d: DAY_TYPE_LABELS.get(d, d))
+    with col2:
+        start_hour, end_hour = st.slider("🕒 Heures", 0, 23, (8, 10))
 
-    # Prédiction du trafic futur (exemple 8h à 10h)
-    future_hours = pd.DataFrame({"hour": list(range(8, 11))})
-    predicted_data = pd.DataFrame()
-    for hour in future_hours["hour"]:
-        subset = data[data["hour"] == hour].copy()
-        subset["predicted_traffic"] = model.predict(subset[["hour"]])
-        predicted_data = pd.concat([predicted_data, subset])
+    # Seules les tranches horaires affichées sont lues
+    predicted_data = heatmap.hours_frame(day_type, range(start_hour, end_hour + 1))
 
     st.subheader("🗺️ Carte prédictive des congestions")
 
     m = folium.Map(location=[48.85, 2.35], zoom_start=11)
 
-    heat_data = [
-        [row["stop_lat"], row["stop_lon"], row["predicted_traffic"]]
-        for _, row in predicted_data.iterrows()
-    ]
-    HeatMap(heat_data, radius=12, blur=15, min_opacity=0.3, max_val=predicted_data["predicted_traffic"].max()).add_to(m)
+    heat_data = predicted_data[["stop_lat", "stop_lon", "predicted_traffic"]].to_numpy().tolist()
+    HeatMap(heat_data, radius=12, blur=15, min_opacity=0.3, max_val=heatmap.max_traffic(day_type)).add_to(m)
 
     st.markdown("Zones en rouge = fort trafic prévu")
     st.components.v1.html(m.get_root().render(), height=600, scrolling=False)
 
-    # Option d’export CSV
+    # Option d’export (écrit heure par heure dans un fichier temporaire compressé)
     st.subheader("📤 Exporter les prédictions")
-    if st.button("💾 Télécharger en CSV"):
-        csv = predicted_data.to_csv(index=False).encode("utf-8")
-        st.download_button("📎 Export CSV", data=csv, file_name="previsions_congestion.csv", mime="text/csv")
+    export_format = st.selectbox("Format", available_formats(), format_func=lambda f: FORMATS[f]["label"])
+    if st.button("💾 Préparer l'export"):
+        hours = range(start_hour, end_hour + 1)
+        path = export_frames((heatmap.hours_frame(day_type, [hour]) for hour in hours), export_format,
+                             basename="previsions_congestion")
+        # Lien vers le fichier servi statiquement : l'export n'est pas relu en mémoire
+        st.markdown(download_link(path, f"previsions_congestion.{export_format}"), unsafe_allow_html=True)
@@ -0,0 +1,292 @@
+# fichier : app/services/bulk_loader.py
+
+import csv
+import io
+import logging
+import os
+import sqlite3
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+# === Configuration du logging ===
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# === Schémas GTFS typés : {table: ({colonne: type}, clé primaire)} ===
+# Les colonnes présentes dans un fichier mais absentes du schéma sont créées en TEXT ;
+# la clé n'est appliquée que si toutes ses colonnes sont présentes. Elle est créée après
+# le chargement, sous forme d'index unique (construit en une passe triée plutôt que ligne à ligne).
+GTFS_SCHEMAS = {
+    "agency": ({
+        "agency_id": "TEXT", "agency_name": "TEXT", "agency_url": "TEXT", "agency_timezone": "TEXT",
+        "agency_lang": "TEXT", "agency_phone": "TEXT", "agency_email": "TEXT", "agency_fare_url": "TEXT",
+    }, ("agency_id",)),
+    "calendar": ({
+        "service_id": "TEXT", "monday": "INTEGER", "tuesday": "INTEGER", "wednesday": "INTEGER",
+        "thursday": "INTEGER", "friday": "INTEGER", "saturday": "INTEGER", "sunday": "INTEGER",
+        "start_date": "INTEGER", "end_date": "INTEGER",
+    }, ("service_id",)),
+    "calendar_dates": ({
+        "service_id": "TEXT", "date": "INTEGER", "exception_type": "INTEGER",
+    }, ("service_id", "date")),
+    "routes": ({
+        "route_id": "TEXT", "agency_id": "TEXT", "route_short_name": "TEXT", "route_long_name": "TEXT",
+        "route_desc": "TEXT", "route_type": "INTEGER", "route_url": "TEXT", "route_color": "TEXT",
+        "route_text_color": "TEXT", "route_sort_order": "INTEGER",
+    }, ("route_id",)),
+    "stops": ({
+        "stop_id": "TEXT", "stop_code": "TEXT", "stop_name": "TEXT", "stop_desc": "TEXT",
+        "stop_lat": "REAL", "stop_lon": "REAL", "zone_id": "TEXT", "stop_url": "TEXT",
+        "location_type": "INTEGER", "parent_station": "TEXT", "stop_timezone": "TEXT",
+        "wheelchair_boarding": "INTEGER", "level_id": "TEXT", "platform_code": "TEXT",
+    }, ("stop_id",)),
+    "trips": ({
+        "route_id": "TEXT", "service_id": "TEXT", "trip_id": "TEXT", "trip_headsign": "TEXT",
+        "trip_short_name": "TEXT", "direction_id": "INTEGER", "block_id": "TEXT", "shape_id": "TEXT",
+        "wheelchair_accessible": "INTEGER", "bikes_allowed": "INTEGER",
+    }, ("trip_id",)),
+    "stop_times": ({
+        "trip_id": "TEXT", "arrival_time": "TEXT", "departure_time": "TEXT", "stop_id": "TEXT",
+        "stop_sequence": "INTEGER", "stop_headsign": "TEXT", "pickup_type": "INTEGER",
+        "drop_off_type": "INTEGER", "shape_dist_traveled": "REAL", "timepoint": "INTEGER",
+        "local_zone_id": "TEXT",
+    }, ("trip_id", "stop_sequence")),
+    "transfers": ({
+        "from_stop_id": "TEXT", "to_stop_id": "TEXT", "transfer_type": "INTEGER", "min_transfer_time": "INTEGER",
+    }, ()),
+    "pathways": ({
+        "pathway_id": "TEXT", "from_stop_id": "TEXT", "to_stop_id": "TEXT", "pathway_mode": "INTEGER",
+        "is_bidirectional": "INTEGER", "length": "REAL", "traversal_time": "INTEGER",
+    }, ("pathway_id",)),
+}
+
+# === Colonnes dérivées, calculées par SQLite à l'insertion : {table: [(colonne, type, source, expression)]} ===
+# Les horaires GTFS "H:MM:SS" peuvent dépasser 24:00:00 (courses après minuit, rattachées au jour
+# de service) : les secondes et l'heure sont conservées telles quelles, sans modulo.
+# CAST(... AS INTEGER) lit le nombre en tête de chaîne : les heures sur un ou deux chiffres sont
+# lues sans recherche du séparateur. `{t}` est remplacé par la valeur source (NULL si vide).
+GTFS_SECONDS_SQL = (
+    "CAST({t} AS INTEGER) * 3600"
+    " + CAST(substr({t}, -5) AS INTEGER) * 60"
+    " + CAST(substr({t}, -2) AS INTEGER)"
+)
+GTFS_HOUR_SQL = "CAST({t} AS INTEGER)"
+DERIVED_COLUMNS = {
+    "stop_times": [
+        ("arrival_secs", "INTEGER", "arrival_time", GTFS_SECONDS_SQL),
+        ("departure_secs", "INTEGER", "departure_time", GTFS_SECONDS_SQL),
+        ("departure_hour", "INTEGER", "departure_time", GTFS_HOUR_SQL),
+    ],
+}
+
+# Fichiers au-delà de cette taille : lus en flux dans le processus principal
+SMALL_FILE_BYTES = 32 * 1024 * 1024
+PARSE_WORKERS = min(4, os.cpu_count() or 1)
+
+BULK_PRAGMAS = {
+    "journal_mode": "MEMORY",  # OFF empêcherait l'annulation d'une instruction en échec
+    "synchronous": "OFF",
+    "locking_mode": "EXCLUSIVE",
+    "temp_store": "MEMORY",
+    "cache_size": -512_000,  # 512 Mo
+}
+RESTORED_PRAGMAS = {
+    "journal_mode": "DELETE",
+    "synchronous": "FULL",
+    "locking_mode": "NORMAL",
+}
+
+
+# === Sources : fichiers du datalake ou membres de l'archive GTFS, lus sans extraction ===
+# Un membre d'archive est désigné par "<archive.zip>!/<membre>" : le chemin reste une chaîne
+# (transmissible aux processus de travail) et son nom de base est celui du fichier GTFS.
+ZIP_MEMBER_SEP = "!/"
+
+
+def zip_member(zip_path, member):
+    return f"{zip_path}{ZIP_MEMBER_SEP}{member}"
+
+
+def _split_source(path):
+    zip_path, sep, member = path.partition(ZIP_MEMBER_SEP)
+    return (zip_path, member) if sep else (path, None)
+
+
+@contextmanager
+def open_source(path, binary=False):
+    """
+    Ouvre un fichier source en lecture (texte UTF-8, BOM ignoré, ou octets si `binary`).
+    Un membre d'archive est décompressé en flux, sans écriture sur disque.
+    """
+    zip_path, member = _split_source(path)
+    if member is None:
+        with open(path, "rb") if binary else open(path, encoding="utf-8-sig", newline="") as f:
+            yield f
+        return
+    with zipfile.ZipFile(zip_path) as archive, archive.open(member) as raw:
+        yield raw if binary else io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+
+
+def source_size(path):
+    """Taille (décompressée) d'un fichier source, en octets."""
+    zip_path, member = _split_source(path)
+    if member is None:
+        return os.path.getsize(path)
+    with zipfile.ZipFile(zip_path) as archive:
+        return archive.getinfo(member).file_size
+
+
+def set_pragmas(conn, pragmas):
+    for pragma, value in pragmas.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+
+
+def table_columns(table_name, header):
+    """Définition `(colonne, type)` de chaque colonne du fichier, et la clé primaire applicable."""
+    types, primary_key = GTFS_SCHEMAS.get(table_name, ({}, ()))
+    columns = [(name, types.get(name, "TEXT")) for name in header]
+    if not all(name in header for name in primary_key):
+        primary_key = ()
+    return columns, primary_key
+
+
+def derived_columns(table_name, header):
+    """Colonnes dérivées de `table_name` dont la colonne source figure dans `header`."""
+    return [column for column in DERIVED_COLUMNS.get(table_name, []) if column[2] in header]
+
+
+def create_table(conn, table_name, header):
+    columns, _ = table_columns(table_name, header)
+    columns += [(name, sql_type) for name, sql_type, _, _ in derived_columns(table_name, header)]
+    definition = [f'"{name}" {sql_type}' for name, sql_type in columns]
+    conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+    conn.execute(f'CREATE TABLE "{table_name}" ({", ".join(definition)})')
+
+
+def create_primary_key(conn, table_name, header):
+    """
+    Index unique `pk_<table>` sur la clé du schéma. En cas de doublons dans le fichier, seule
+    la première occurrence est conservée. Retourne le nombre de lignes supprimées.
+    """
+    _, primary_key = table_columns(table_name, header)
+    if not primary_key:
+        return 0
+    key = ", ".join(f'"{name}"' for name in primary_key)
+    index = f'CREATE UNIQUE INDEX "pk_{table_name}" ON "{table_name}" ({key})'
+    try:
+        conn.execute(index)
+        return 0
+    except sqlite3.IntegrityError:
+        removed = conn.execute(
+            f'DELETE FROM "{table_name}" WHERE rowid NOT IN '
+            f'(SELECT MIN(rowid) FROM "{table_name}" GROUP BY {key})'
+        ).rowcount
+        conn.execute(index)
+        return removed
+
+
+def read_rows(f, sep=","):
+    """
+    En-tête et itérateur des lignes d'un fichier CSV texte, telles que lues par `csv.reader`
+    (les valeurs vides sont converties en NULL à l'insertion, cf. `insert_rows`).
+    """
+    reader = csv.reader(f, delimiter=sep)
+    header = [name.strip() for name in next(reader, [])]
+    width = len(header)
+    rows = (row if len(row) == width else (row + [""] * width)[:width] for row in reader if row)
+    return header, rows
+
+
+def parse_file(file_path, sep=","):
+    """Lecture complète d'un petit fichier (exécutée dans un processus de travail)."""
+    with open_source(file_path) as f:
+        header, rows = read_rows(f, sep)
+        return header, list(rows)
+
+
+def insert_statement(table_name, header, conflict=""):
+    """
+    Requête d'insertion d'une ligne de `header` (`conflict` : "OR IGNORE", "OR REPLACE"...),
+    colonnes dérivées comprises.
+    """
+    # NULLIF dans la requête : la conversion '' → NULL se fait dans SQLite, pas ligne à ligne en Python
+    values = [f"NULLIF(?{i}, '')" for i in range(1, len(header) + 1)]
+    names = list(header)
+    for name, _, source, expression in derived_columns(table_name, header):
+        names.append(name)
+        values.append(expression.format(t=values[header.index(source)]))
+    placeholders = ", ".join(values)
+    columns = ", ".join(f'"{name}"' for name in names)
+    verb = f"INSERT {conflict}" if conflict else "INSERT"
+    return f'{verb} INTO "{table_name}" ({columns}) VALUES ({placeholders})'
+
+
+def insert_rows(conn, table_name, header, rows):
+    """
+    Insère `rows` (itérable consommé en flux par `executemany`) puis pose la clé primaire,
+    le tout dans une seule transaction. Retourne le nombre de lignes conservées.
+    """
+    conn.execute("BEGIN")
+    total = conn.executemany(insert_statement(table_name, header), rows).rowcount
+    removed = create_primary_key(conn, table_name, header)
+    conn.execute("COMMIT")
+
+    if removed:
+        logger.warning(f"⚠️ `{table_name}` : {removed} lignes en double sur la clé primaire ignorées.")
+    return total - removed
+
+
+def load_table(conn, table_name, header, rows):
+    create_table(conn, table_name, header)
+    return insert_rows(conn, table_name, header, rows)
+
+
+def bulk_load(conn, sources, workers=PARSE_WORKERS):
+    """
+    Charge `sources` ({table: (chemin, séparateur)}, chemin de fichier ou membre d'archive, cf.
+    `zip_member`) en mode chargement massif : journal en mémoire et synchronisation désactivée
+    le temps du chargement, schémas typés, insertions en flux (les membres d'archive sont
+    décompressés à la volée, directement vers les insertions).
+    Les petits fichiers sont analysés en parallèle dans des processus de travail pendant
+    que les gros sont lus en flux. Les index secondaires sont à créer après l'appel.
+    Retourne `{table: nombre de lignes}` pour les tables chargées.
+    """
+    set_pragmas(conn, BULK_PRAGMAS)
+    loaded = {}
+    small = {t: s for t, s in sources.items() if source_size(s[0]) <= SMALL_FILE_BYTES}
+    large = {t: s for t, s in sources.items() if t not in small}
+
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {t: pool.submit(parse_file, path, sep) for t, (path, sep) in small.items()}
+
+            for table_name, (path, sep) in large.items():
+                started = time.time()
+                try:
+                    with open_source(path) as f:
+                        header, rows = read_rows(f, sep)
+                        loaded[table_name] = load_table(conn, table_name, header, rows)
+                    logger.info(f"✅ Table `{table_name}` chargée ({loaded[table_name]} lignes, "
+                                f"{time.time() - started:.1f} s).")
+                except Exception as e:
+                    _rollback(conn)
+                    logger.error(f"❌ Erreur lors du chargement de `{path}` : {e}")
+
+            for table_name, future in futures.items():
+                try:
+                    header, rows = future.result()
+                    loaded[table_name] = load_table(conn, table_name, header, rows)
+                    logger.info(f"✅ Table `{table_name}` chargée ({loaded[table_name]} lignes).")
+                except Exception as e:
+                    _rollback(conn)
+                    logger.error(f"❌ Erreur lors du chargement de `{sources[table_name][0]}` : {e}")
+    finally:
+        set_pragmas(conn, RESTORED_PRAGMAS)
+    return loaded
+
+
+def _rollback(conn):
+    if conn.in_transaction:
+        conn.execute("ROLLBACK")
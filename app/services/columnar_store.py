@@ -0,0 +1,240 @@
+# fichier : app/services/columnar_store.py
+
+import csv
+import logging
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from app.services.bulk_loader import (
+    GTFS_HOUR_SQL, GTFS_SECONDS_SQL, derived_columns, open_source, table_columns
+)
+from app.services.feed_hashes import table_hash
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except ImportError:  # Datalake colonnaire optionnel : les lectures passent alors par SQLite
+    pa = pc = pacsv = pq = None
+
+# === Configuration du logging ===
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# === Datalake colonnaire : une copie Parquet typée de chaque fichier GTFS ===
+# Chaque fichier porte l'empreinte de contenu de sa table (cf. feed_hashes.table_hash) : il n'est
+# converti qu'une fois par version du fichier, et n'est lu que s'il correspond à la base en service.
+COLUMNAR_DIR = os.path.join(os.path.dirname(__file__), "../../data/datalake/columnar")
+HASH_KEY = b"urbanmobidf.table_hash"
+CSV_BLOCK_BYTES = 16 * 1024 * 1024  # taille des blocs lus (et des groupes de lignes écrits)
+
+# Types Arrow des types SQLite des schémas GTFS ; les textes sont encodés par dictionnaire
+# (identifiants et libellés très répétés : stop_id, trip_id, route_id...)
+ARROW_TYPES = {} if pa is None else {
+    "TEXT": pa.dictionary(pa.int32(), pa.string()),
+    "INTEGER": pa.int64(),
+    "REAL": pa.float64(),
+}
+
+
+def available():
+    """Datalake colonnaire utilisable dans l'environnement (requiert pyarrow)."""
+    return pq is not None
+
+
+def columnar_path(table_name):
+    return os.path.join(COLUMNAR_DIR, f"{table_name}.parquet")
+
+
+# === Colonnes dérivées (mêmes valeurs que les expressions SQL de bulk_loader) ===
+def _gtfs_text(column):
+    return pc.utf8_trim_whitespace(column.cast(pa.string()))
+
+
+def _gtfs_seconds(column):
+    text = _gtfs_text(column)
+    hours = pc.cast(pc.utf8_slice_codeunits(text, 0, -6), pa.int64())
+    minutes = pc.cast(pc.utf8_slice_codeunits(text, -5, -3), pa.int64())
+    seconds = pc.cast(pc.utf8_slice_codeunits(text, -2, 2 ** 31 - 1), pa.int64())
+    return pc.add(pc.add(pc.multiply(hours, 3600), pc.multiply(minutes, 60)), seconds)
+
+
+def _gtfs_hour(column):
+    return pc.cast(pc.utf8_slice_codeunits(_gtfs_text(column), 0, -6), pa.int64())
+
+
+DERIVED_KERNELS = {GTFS_SECONDS_SQL: _gtfs_seconds, GTFS_HOUR_SQL: _gtfs_hour}
+
+
+# === Conversion CSV → Parquet ===
+def _write_parquet(table_name, file_path, sep, header, typed, metadata, target):
+    column_types = {
+        name: ARROW_TYPES[sql_type if typed else "TEXT"]
+        for name, sql_type in table_columns(table_name, header)[0]
+    }
+    # Colonnes dérivées omises d'un fichier non conforme : les lecteurs se replient sur la base
+    derived = [
+        (name, DERIVED_KERNELS[expression], source)
+        for name, _, source, expression in derived_columns(table_name, header)
+    ] if typed else []
+
+    rows = 0
+    with open_source(file_path, binary=True) as f:
+        reader = pacsv.open_csv(
+            f,
+            read_options=pacsv.ReadOptions(block_size=CSV_BLOCK_BYTES),
+            parse_options=pacsv.ParseOptions(delimiter=sep),
+            convert_options=pacsv.ConvertOptions(
+                column_types=column_types, null_values=[""],
+                strings_can_be_null=True, quoted_strings_can_be_null=True,
+            ),
+        )
+        schema = reader.schema
+        for name, _, _ in derived:
+            schema = schema.append(pa.field(name, pa.int64()))
+
+        with pq.ParquetWriter(target, schema.with_metadata(metadata)) as writer:
+            for batch in reader:
+                columns = batch.columns + [kernel(batch.column(source)) for _, kernel, source in derived]
+                writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema))
+                rows += batch.num_rows
+    return rows
+
+
+def convert_file(table_name, file_path, sep=",", content_hash=""):
+    """
+    Convertit un fichier GTFS en Parquet (types des schémas de bulk_loader, textes encodés par
+    dictionnaire, colonnes dérivées comprises), lu et écrit par blocs. Le fichier est remplacé
+    atomiquement : les lecteurs en cours gardent l'ancienne version projetée en mémoire.
+    Un fichier dont une valeur ne respecte pas le schéma est converti entièrement en texte,
+    sans colonnes dérivées.
+    Retourne le nombre de lignes converties.
+    """
+    with open_source(file_path) as f:
+        header = next(csv.reader(f, delimiter=sep), [])
+    os.makedirs(COLUMNAR_DIR, exist_ok=True)
+    target = columnar_path(table_name)
+    partial = target + ".partial"
+    metadata = {HASH_KEY: content_hash.encode("utf-8")}
+    try:
+        try:
+            rows = _write_parquet(table_name, file_path, sep, header, True, metadata, partial)
+        except pa.ArrowInvalid as e:
+            logger.warning(f"⚠️ `{table_name}` non conforme au schéma ({e}) : conversion en texte.")
+            rows = _write_parquet(table_name, file_path, sep, header, False, metadata, partial)
+        os.replace(partial, target)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return rows
+
+
+def columnar_hash(table_name):
+    """Empreinte de contenu enregistrée dans la version Parquet de `table_name` (None si absente)."""
+    path = columnar_path(table_name)
+    if pq is None or not os.path.exists(path):
+        return None
+    try:
+        value = (pq.read_schema(path, memory_map=True).metadata or {}).get(HASH_KEY)
+    except (OSError, pa.ArrowException):
+        return None
+    return value.decode("utf-8") if value else None
+
+
+def convert_sources(sources, entity_hashes):
+    """
+    Met à jour le datalake colonnaire : convertit les fichiers de `sources` ({table: (chemin,
+    séparateur)}) dont la version Parquet ne porte pas l'empreinte issue de `entity_hashes`
+    (cf. `compute_entity_hashes`). Un échec de conversion ne fait que désactiver la lecture
+    colonnaire de la table. Retourne {table: lignes converties}.
+    """
+    if pq is None:
+        logger.info("pyarrow absent : datalake colonnaire non mis à jour.")
+        return {}
+    converted = {}
+    for table_name, (file_path, sep) in sources.items():
+        header, hashes = entity_hashes[table_name]
+        expected = table_hash(header, hashes)
+        if columnar_hash(table_name) == expected:
+            continue
+        started = time.time()
+        try:
+            converted[table_name] = convert_file(table_name, file_path, sep, expected)
+        except (OSError, pa.ArrowException) as e:
+            logger.warning(f"⚠️ Conversion colonnaire de `{table_name}` impossible : {e}")
+            continue
+        logger.info(f"🧱 `{table_name}` converti en Parquet ({converted[table_name]} lignes, "
+                    f"{time.time() - started:.1f} s).")
+    return converted
+
+
+# === Lecture ===
+def _database_hash(conn, table_name):
+    try:
+        row = conn.execute("SELECT value FROM feed_meta WHERE key = ?", (f"table_hash:{table_name}",)).fetchone()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+
+def is_current(conn, table_name, columns=None):
+    """
+    Vrai si la version Parquet de `table_name` a le même contenu que la table de la base `conn`
+    (et comporte les colonnes `columns`).
+    """
+    stored = columnar_hash(table_name)
+    if stored is None or stored != _database_hash(conn, table_name):
+        return False
+    if columns:
+        try:
+            names = pq.read_schema(columnar_path(table_name), memory_map=True).names
+        except (OSError, pa.ArrowException):
+            return False
+        return all(name in names for name in columns)
+    return True
+
+
+def read_table(table_name, columns=None):
+    """Table Arrow des seules colonnes `columns`, lue par projection mémoire (mmap) du fichier Parquet."""
+    return pq.read_table(columnar_path(table_name), columns=columns, memory_map=True)
+
+
+def to_frame(table):
+    """DataFrame d'une table Arrow ; les colonnes encodées par dictionnaire sont rendues en texte."""
+    schema = pa.schema([
+        pa.field(field.name, field.type.value_type if pa.types.is_dictionary(field.type) else field.type)
+        for field in table.schema
+    ])
+    return table.cast(schema).to_pandas()
+
+
+def _select(table_name, columns):
+    names = ", ".join(f'"{name}"' for name in columns) if columns else "*"
+    return f'SELECT {names} FROM "{table_name}"'
+
+
+def read_columns(conn, table_name, columns=None):
+    """
+    Colonnes `columns` (toutes si None) de `table_name` : depuis le datalake colonnaire s'il
+    correspond à la base `conn`, sinon par une requête SQL sur la base.
+    """
+    if is_current(conn, table_name, columns):
+        try:
+            return to_frame(read_table(table_name, columns))
+        except (OSError, pa.ArrowException) as e:
+            logger.warning(f"⚠️ Lecture colonnaire de `{table_name}` impossible ({e}) : lecture SQL.")
+    return pd.read_sql(_select(table_name, columns), conn)
+
+
+def iter_columns(conn, table_name, columns=None, chunk_size=100_000):
+    """Comme `read_columns`, par blocs d'au plus `chunk_size` lignes (mémoire bornée)."""
+    if is_current(conn, table_name, columns):
+        parquet = pq.ParquetFile(columnar_path(table_name), memory_map=True)
+        for batch in parquet.iter_batches(batch_size=chunk_size, columns=columns):
+            yield to_frame(pa.Table.from_batches([batch]))
+        return
+    yield from pd.read_sql(_select(table_name, columns), conn, chunksize=chunk_size)
@@ -1,55 +1,261 @@
 # fichier : app/services/congestion_handler.py
 
+import json
+import logging
+import numpy as np
 import pandas as pd
 import os
 import pickle
+import sqlite3
+import threading
+import time
 
 from collections import Counter
 from datetime import datetime
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.preprocessing import LabelEncoder
 
-from app.services.db_connector import get_connection
+from app.services.bulk_loader import GTFS_HOUR_SQL
+from app.services.columnar_store import iter_columns, read_columns
+from app.services.db_connector import get_connection, get_feed_hash
+from app.services.service_calendar import ALL_DAYS, service_weekdays
+
+logger = logging.getLogger(__name__)
 
 CONGESTION_ANALYSIS_PATH = os.path.join(os.path.dirname(__file__), "../../data/congestion_model.pkl")
 CONGESTION_LOG_PATH = os.path.join(os.path.dirname(__file__), "../../data/congestion_suggestions.csv")
+CONGESTION_AUDIT_PATH = os.path.join(os.path.dirname(__file__), "../../data/congested_stops_audit.csv")
+CONGESTION_AUDIT_INTERVAL = 15 * 60  # secondes entre deux entrées d'audit pour une même requête
+# Seuils de passages : sur la journée, et par heure pour les requêtes filtrées par heure
+DAILY_CONGESTION_THRESHOLD = 200
+HOURLY_CONGESTION_THRESHOLD = 20
+INF = float("inf")
 
 
-def train_congestion_model():
-    conn = get_connection()
-    stop_times = pd.read_sql("SELECT stop_id, departure_time FROM stop_times", conn)
-    stops = pd.read_sql("SELECT stop_id, stop_name, stop_lat, stop_lon FROM stops", conn)
-    conn.close()
+# === Entraînement : agrégation en flux de stop_times puis forêt aléatoire parallèle ===
+TRAINING_FEATURES = ["stop_id_enc", "hour", "weekday"]
+TRAINING_CHUNK_SIZE = 500_000
+# Au-delà, les agrégats partiels sont fusionnés pour borner la mémoire
+TRAINING_COMPACT_EVERY = 8
+TRAINING_PARAMS = {
+    "n_estimators": 100,
+    "max_samples": 200_000,   # lignes tirées par arbre (budget d'entraînement)
+    "min_samples_leaf": 2,
+    "n_jobs": -1,
+    "random_state": 42,
+}
+
+
+def _trip_weekdays(conn):
+    """Jours de semaine de circulation de chaque course : DataFrame (trip_id, weekday)."""
+    trips = read_columns(conn, "trips", ["trip_id", "service_id"]).astype(str)
+    calendar = pd.read_sql("SELECT * FROM calendar", conn) if _has_table(conn, "calendar") else None
+    calendar_dates = pd.read_sql("SELECT * FROM calendar_dates", conn) if _has_table(conn, "calendar_dates") else None
+    weekdays = service_weekdays(calendar, calendar_dates)
+    if weekdays.empty:
+        # Flux sans calendrier : on considère que toutes les courses circulent tous les jours
+        weekdays = pd.DataFrame({"service_id": np.repeat(trips["service_id"].unique(), 7),
+                                 "weekday": np.tile(np.arange(7), trips["service_id"].nunique())})
+    return trips.merge(weekdays, on="service_id")[["trip_id", "weekday"]]
+
+
+def _has_table(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is not None
+
+
+def _compact(partials):
+    return [pd.concat(partials).groupby(level=[0, 1, 2]).sum()]
 
-    stop_times = stop_times.dropna(subset=['departure_time'])
-    stop_times['hour'] = stop_times['departure_time'].str.slice(0, 2).astype(int)
-    traffic = stop_times.groupby(['stop_id', 'hour']).size().reset_index(name="traffic")
 
-    traffic = traffic.merge(stops, on="stop_id", how="left")
+def build_traffic_features(conn, chunk_size=TRAINING_CHUNK_SIZE):
+    """
+    Matrice stop × heure × jour de semaine → nombre de passages, construite en lisant les
+    colonnes utiles de stop_times par blocs : la mémoire est bornée par le nombre de clés distinctes.
+    Les horaires GTFS > 24 h sont reportés sur le jour suivant.
+    """
+    trip_weekdays = _trip_weekdays(conn)
+    partials = []
+    # Heure GTFS entière calculée à l'ingestion (peut dépasser 23), lue en colonnes si possible
+    columns = ["trip_id", "stop_id", "departure_hour"]
+    for chunk in iter_columns(conn, "stop_times", columns, chunk_size):
+        chunk = chunk.dropna(subset=["departure_hour"])
+        chunk["trip_id"] = chunk["trip_id"].astype(str)
+        chunk = chunk.merge(trip_weekdays, on="trip_id")
+        raw_hour = chunk["departure_hour"].astype(int)
+        chunk["hour"] = raw_hour % 24
+        chunk["weekday"] = (chunk["weekday"] + raw_hour // 24) % 7
+        partials.append(chunk.groupby(["stop_id", "hour", "weekday"]).size())
+        if len(partials) >= TRAINING_COMPACT_EVERY:
+            partials = _compact(partials)
+
+    if not partials:
+        return pd.DataFrame(columns=["stop_id", "hour", "weekday", "traffic"])
+    return _compact(partials)[0].rename("traffic").reset_index()
+
+
+def train_congestion_model(chunk_size=TRAINING_CHUNK_SIZE, **params):
+    """
+    Entraîne le modèle de congestion (trafic par arrêt, heure et jour de semaine) et l'enregistre
+    avec ses métadonnées : empreinte du flux, schéma des variables, paramètres et durées.
+    `params` surcharge TRAINING_PARAMS (n_estimators, max_samples, n_jobs, random_state...).
+    """
+    started = time.time()
+    conn = get_connection()
+    traffic = build_traffic_features(conn, chunk_size)
+    conn.close()
+    feature_seconds = time.time() - started
 
+    traffic["stop_id"] = traffic["stop_id"].astype(str)
     le = LabelEncoder()
     traffic['stop_id_enc'] = le.fit_transform(traffic['stop_id'])
 
-    model = RandomForestRegressor()
-    model.fit(traffic[['stop_id_enc', 'hour']], traffic['traffic'])
+    params = {**TRAINING_PARAMS, **params}
+    if params.get("max_samples") is not None and params["max_samples"] >= len(traffic):
+        params["max_samples"] = None
+    model = RandomForestRegressor(**params)
+    fit_started = time.time()
+    model.fit(traffic[TRAINING_FEATURES], traffic['traffic'])
+    fit_seconds = time.time() - fit_started
 
+    metadata = {
+        "feed_hash": get_feed_hash(),
+        "features": TRAINING_FEATURES,
+        "target": "traffic",
+        "rows": len(traffic),
+        "stops": len(le.classes_),
+        "params": params,
+        "trained_at": datetime.now().isoformat(),
+        "timing": {"features_s": round(feature_seconds, 2), "fit_s": round(fit_seconds, 2),
+                   "total_s": round(time.time() - started, 2)},
+    }
     with open(CONGESTION_ANALYSIS_PATH, "wb") as f:
-        pickle.dump((model, le), f)
+        pickle.dump({"model": model, "encoder": le, "metadata": metadata}, f)
+    with open(os.path.splitext(CONGESTION_ANALYSIS_PATH)[0] + ".json", "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
 
     return model, le
 
 
-def predict_congestion(stop_id, hour):
-    if not os.path.exists(CONGESTION_ANALYSIS_PATH):
+# === Modèle partagé par le processus (rechargé seulement si le fichier change) ===
+LEGACY_FEATURES = ["stop_id_enc", "hour"]
+TABLE_HOURS = 24
+CONGESTION_SCORE_THRESHOLD = 150  # seuil à ajuster
+
+_model_lock = threading.Lock()
+_model_handle = {"signature": None, "model": None, "encoder": None, "metadata": None, "tables": {}}
+
+
+def _model_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
         return None
+    return stat.st_mtime_ns, stat.st_size
 
-    with open(CONGESTION_ANALYSIS_PATH, "rb") as f:
-        model, le = pickle.load(f)
 
-    if stop_id not in le.classes_:
-        return 0
-    stop_encoded = le.transform([stop_id])[0]
-    return model.predict([[stop_encoded, hour]])[0]
+def load_congestion_model():
+    """
+    Retourne `(model, label_encoder)` partagés par tout le processus, ou None si aucun modèle.
+    Le fichier n'est relu que si sa date de modification (ou sa taille) a changé.
+    """
+    signature = _model_signature(CONGESTION_ANALYSIS_PATH)
+    with _model_lock:
+        if signature is None:
+            _model_handle.update(signature=None, model=None, encoder=None, metadata=None, tables={})
+            return None
+        if signature != _model_handle["signature"]:
+            with open(CONGESTION_ANALYSIS_PATH, "rb") as f:
+                saved = pickle.load(f)
+            if isinstance(saved, dict):
+                model, le, metadata = saved["model"], saved["encoder"], saved.get("metadata", {})
+            else:
+                # Ancien format : tuple (modèle, encodeur) sans métadonnées
+                (model, le) = saved
+                metadata = {"features": list(getattr(model, "feature_names_in_", LEGACY_FEATURES))}
+            _model_handle.update(signature=signature, model=model, encoder=le, metadata=metadata, tables={})
+        return _model_handle["model"], _model_handle["encoder"]
+
+
+def congestion_model_metadata():
+    """Métadonnées du modèle courant (empreinte du flux, variables, durées), ou None."""
+    if load_congestion_model() is None:
+        return None
+    return _model_handle["metadata"]
+
+
+def encode_stops(le, stop_ids):
+    """Codes du LabelEncoder pour `stop_ids` (vectorisé) ; -1 pour un arrêt inconnu du modèle."""
+    classes = le.classes_
+    stop_ids = np.asarray(stop_ids).astype(classes.dtype)
+    positions = np.searchsorted(classes, stop_ids)
+    positions = np.minimum(positions, len(classes) - 1)
+    return np.where(classes[positions] == stop_ids, positions, -1)
+
+
+def _predict(model, features, codes, hours, weekdays):
+    columns = {"stop_id_enc": codes, "hour": hours, "weekday": weekdays}
+    return model.predict(pd.DataFrame({name: columns[name] for name in features}, columns=features))
+
+
+def prediction_table(weekday=None):
+    """
+    Table précalculée des prédictions : tableau (nombre d'arrêts connus × 24) indexé par
+    le code du LabelEncoder et l'heure, pour un jour de semaine (modèles qui l'utilisent).
+    Calculée en un seul `predict` par version du modèle et par jour.
+    """
+    loaded = load_congestion_model()
+    if loaded is None:
+        return None
+    model, le = loaded
+    features = _model_handle["metadata"].get("features", LEGACY_FEATURES)
+    key = weekday if "weekday" in features else None
+    with _model_lock:
+        table = _model_handle["tables"].get(key)
+        if table is None or _model_handle["model"] is not model:
+            n = len(le.classes_)
+            codes = np.repeat(np.arange(n), TABLE_HOURS)
+            hours = np.tile(np.arange(TABLE_HOURS), n)
+            table = _predict(model, features, codes, hours, np.full(len(codes), key or 0)).reshape(n, TABLE_HOURS)
+            if _model_handle["model"] is model:
+                _model_handle["tables"][key] = table
+    return table
+
+
+def predict_congestion_batch(stop_ids, hours, weekday=None, use_table=True):
+    """
+    Prédictions de trafic pour des tableaux `stop_ids` et `hours` (une heure scalaire est diffusée).
+    weekday : jour de semaine (0 = lundi) pour les modèles qui l'utilisent ; aujourd'hui par défaut.
+    Retourne un tableau NumPy (0 pour un arrêt inconnu), ou None si aucun modèle n'est entraîné.
+    Les heures 0-23 sont lues dans la table précalculée, les autres prédites en un seul appel.
+    """
+    loaded = load_congestion_model()
+    if loaded is None:
+        return None
+    model, le = loaded
+    features = _model_handle["metadata"].get("features", LEGACY_FEATURES)
+    if weekday is None:
+        weekday = datetime.now().weekday()
+
+    codes = encode_stops(le, stop_ids)
+    hours = np.broadcast_to(np.asarray(hours, dtype=np.int64), codes.shape)
+    scores = np.zeros(codes.shape, dtype=np.float64)
+    known = codes >= 0
+
+    in_table = known & (hours >= 0) & (hours < TABLE_HOURS) if use_table else np.zeros_like(known)
+    if in_table.any():
+        scores[in_table] = prediction_table(weekday)[codes[in_table], hours[in_table]]
+    remaining = known & ~in_table
+    if remaining.any():
+        scores[remaining] = _predict(model, features, codes[remaining], hours[remaining],
+                                     np.full(int(remaining.sum()), weekday))
+    return scores
+
+
+def predict_congestion(stop_id, hour, weekday=None):
+    scores = predict_congestion_batch([stop_id], [hour], weekday)
+    if scores is None:
+        return None
+    return scores[0]
 
 
 def should_avoid_congestion(path, dt):
@@ -57,15 +263,12 @@ def should_avoid_congestion(path, dt):
     Analyse un chemin et détecte s’il traverse des zones à risque à l’heure prévue.
     Retourne une liste des arrêts à éviter.
     """
-    hour = dt.hour
-    problematic_stops = []
-
-    for stop_id in path:
-        congestion_score = predict_congestion(stop_id, hour)
-        if congestion_score and congestion_score > 150:  # seuil à ajuster
-            problematic_stops.append(stop_id)
-
-    return problematic_stops
+    if not path:
+        return []
+    scores = predict_congestion_batch(path, dt.hour, dt.weekday())
+    if scores is None:
+        return []
+    return [stop_id for stop_id, score in zip(path, scores) if score > CONGESTION_SCORE_THRESHOLD]
 
 
 def log_admin_suggestion(schedule, congested_stops):
@@ -92,31 +295,109 @@ def log_admin_suggestion(schedule, congested_stops):
     else:
         df.to_csv(CONGESTION_LOG_PATH, index=False)
 
-def predict_congested_stops(threshold=200):
-    """
-    Prédit les arrêts congestionnés à partir du volume de passages enregistrés.
-    Retourne une liste des stop_id à éviter si > seuil (par défaut : 100 passages).
-    """
-    conn = get_connection()
+def _traffic_query(threshold, hour, day_type):
+    if hour is None:
+        query = """
+            SELECT stop_id
+            FROM stop_hour_traffic
+            WHERE day_type = ?
+            GROUP BY stop_id
+            HAVING SUM(departures) > ?
+        """
+        return query, (day_type, threshold)
     query = """
+        SELECT stop_id
+        FROM stop_hour_traffic
+        WHERE day_type = ? AND hour = ? AND departures > ?
+    """
+    return query, (day_type, int(hour) % 24, threshold)
+
+
+def _legacy_traffic_query(threshold, hour):
+    hour_filter = ""
+    params = (threshold,)
+    if hour is not None:
+        hour_filter = f"AND {GTFS_HOUR_SQL.format(t='trim(departure_time)')} % 24 = ?"
+        params = (int(hour) % 24, threshold)
+    query = f"""
         SELECT stop_id
         FROM stop_times
-        WHERE departure_time IS NOT NULL
+        WHERE departure_time IS NOT NULL {hour_filter}
+        GROUP BY stop_id
+        HAVING COUNT(*) > ?
     """
-    df = pd.read_sql(query, conn)
-    conn.close()
+    return query, params
+
+
+def predict_congested_stops(threshold=None, hour=None, day_type=ALL_DAYS, audit=None):
+    """
+    Prédit les arrêts congestionnés à partir du volume de passages enregistrés.
+    Retourne une liste des stop_id à éviter si > seuil.
+
+    Lecture indexée de l'agrégat `stop_hour_traffic` construit à l'ingestion :
+    - hour : heure demandée (0-23) ; le seuil (HOURLY_CONGESTION_THRESHOLD par défaut) porte
+             alors sur les passages de cette heure. Sans heure : passages sur toute la journée
+             (DAILY_CONGESTION_THRESHOLD par défaut).
+    - day_type : "weekday", "saturday", "sunday" ou "all" (tous services confondus).
+    - audit : journalise le résultat dans CONGESTION_AUDIT_PATH (au plus une fois par
+              CONGESTION_AUDIT_INTERVAL secondes) ; par défaut piloté par CONGESTION_AUDIT=1.
+    Sur une base antérieure à l'agrégat, les passages sont comptés sur stop_times (sans
+    distinction de type de jour). Retourne une liste vide si la base est inaccessible.
+    """
+    if threshold is None:
+        threshold = DAILY_CONGESTION_THRESHOLD if hour is None else HOURLY_CONGESTION_THRESHOLD
 
-    stop_counts = df['stop_id'].value_counts()
-    congested_stops = stop_counts[stop_counts > threshold].index.tolist()
+    try:
+        conn = get_connection()
+    except sqlite3.Error as e:
+        logger.error(f"Prédiction de congestion impossible : {e}")
+        return []
+    try:
+        if _has_table(conn, "stop_hour_traffic"):
+            query, params = _traffic_query(threshold, hour, day_type)
+        else:
+            # Base antérieure à l'agrégat : comptage direct sur stop_times, tous services confondus
+            logger.warning("Agrégat `stop_hour_traffic` absent : comptage des passages sur stop_times.")
+            query, params = _legacy_traffic_query(threshold, hour)
+        congested_stops = [row[0] for row in conn.execute(query, params)]
+    except sqlite3.Error as e:
+        logger.error(f"Erreur lors de la prédiction des arrêts congestionnés : {e}")
+        return []
+    finally:
+        conn.close()
 
-    # Optionnel : sauvegarde pour suivi
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    save_path = os.path.join("data", f"congested_stops_{timestamp}.csv")
-    pd.DataFrame({'stop_id': congested_stops}).to_csv(save_path, index=False)
+    if audit is None:
+        audit = os.getenv("CONGESTION_AUDIT") == "1"
+    if audit:
+        audit_congested_stops(congested_stops, hour, day_type)
 
     return congested_stops
 
-def should_avoid_congestion():
+
+# === Journal d'audit optionnel (remplace les exports CSV à chaque requête) ===
+_last_audit = {}
+_audit_lock = threading.Lock()
+
+
+def audit_congested_stops(congested_stops, hour=None, day_type=ALL_DAYS):
+    """Ajoute une ligne par arrêt à CONGESTION_AUDIT_PATH, au plus une fois par intervalle et par (heure, type de jour)."""
+    key = (hour, day_type)
+    now = time.monotonic()
+    with _audit_lock:
+        if now - _last_audit.get(key, -INF) < CONGESTION_AUDIT_INTERVAL:
+            return False
+        _last_audit[key] = now
+
+    df = pd.DataFrame({
+        "datetime": datetime.now().isoformat(),
+        "hour": hour,
+        "day_type": day_type,
+        "stop_id": congested_stops,
+    })
+    df.to_csv(CONGESTION_AUDIT_PATH, mode="a", header=not os.path.exists(CONGESTION_AUDIT_PATH), index=False)
+    return True
+
+def congestion_avoidance_toggle():
     """
     Décide si l'utilisateur/admin souhaite éviter les zones congestionnées.
     Peut être piloté depuis l'interface Streamlit.
@@ -0,0 +1,325 @@
+# fichier : app/services/connection_scan.py
+
+import bisect
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.services.columnar_store import read_columns
+from app.services.db_connector import get_connection
+from app.services.graph_builder import stop_time_seconds
+from app.services.service_calendar import ServiceCalendar
+from app.services.timetable_inputs import build_footpaths, read_optional_table
+
+logger = logging.getLogger(__name__)
+
+INF = float("inf")
+DAY = 86400
+# Durée maximale d'un trajet prise en compte au-delà de la fenêtre de départ (requêtes profil)
+MAX_JOURNEY_SECONDS = 4 * 3600
+SCAN_BLOCK = 65536
+
+
+class ConnectionTimetable:
+    """
+    Tableau de connexions élémentaires (arrêt A → arrêt B par une course) trié par heure de départ,
+    pour l'algorithme Connection Scan (CSA).
+
+    Le tableau de base est partagé entre requêtes ; pour chaque jour de service, une vue filtrée
+    (services actifs du jour + courses de la veille après minuit) est calculée puis mise en cache.
+    """
+
+    def __init__(self, stop_ids, dep_stops, arr_stops, dep_times, arr_times, trips, trip_ids, trip_services,
+                 footpaths, calendar, max_cached_days=4):
+        self.stop_ids = stop_ids
+        self.stop_index = {stop_id: i for i, stop_id in enumerate(stop_ids)}
+        self.dep_stops = dep_stops
+        self.arr_stops = arr_stops
+        self.dep_times = dep_times
+        self.arr_times = arr_times
+        self.trips = trips
+        self.trip_ids = trip_ids
+        self.trip_services = trip_services
+        self.footpaths = footpaths
+        self.calendar = calendar
+        self.max_cached_days = max_cached_days
+        self._day_views = {}
+
+        # Correspondances entrantes (pour les requêtes profil, parcourues à rebours)
+        self.incoming_footpaths = [[] for _ in stop_ids]
+        for i, paths in enumerate(footpaths):
+            for j, duration in paths:
+                self.incoming_footpaths[j].append((i, duration))
+
+    # === Construction ===
+    @classmethod
+    def build(cls, stop_times, trips, calendar=None, calendar_dates=None, transfers=None):
+        st = stop_times[['trip_id', 'stop_id', 'stop_sequence']].copy()
+        st['trip_id'] = st['trip_id'].astype(str)
+        st['stop_id'] = st['stop_id'].astype(str)
+        arrivals = stop_time_seconds(stop_times, 'arrival')
+        departures = stop_time_seconds(stop_times, 'departure')
+        st['arrival_secs'] = arrivals.fillna(departures).fillna(0).astype('int64')
+        st['departure_secs'] = departures.fillna(arrivals).fillna(0).astype('int64')
+        st = st.sort_values(['trip_id', 'stop_sequence'], kind='stable')
+
+        stop_ids, stop_codes = np.unique(st['stop_id'].to_numpy(dtype=str), return_inverse=True)
+        trip_ids, trip_codes = np.unique(st['trip_id'].to_numpy(dtype=str), return_inverse=True)
+        stop_codes = stop_codes.astype(np.int32)
+        trip_codes = trip_codes.astype(np.int32)
+        dep = st['departure_secs'].to_numpy(dtype=np.int32)
+        arr = st['arrival_secs'].to_numpy(dtype=np.int32)
+
+        # Connexion = deux arrêts consécutifs d'une même course
+        same_trip = trip_codes[:-1] == trip_codes[1:]
+        valid = same_trip & (arr[1:] >= dep[:-1])
+        order = np.argsort(dep[:-1][valid], kind='stable')
+
+        trip_table = trips.assign(trip_id=trips['trip_id'].astype(str)).drop_duplicates('trip_id').set_index('trip_id')
+        services = trip_table['service_id'].reindex(trip_ids).astype(str)
+        service_ids = sorted(services.unique())
+        service_index = {service_id: i for i, service_id in enumerate(service_ids)}
+
+        stop_position = {stop_id: i for i, stop_id in enumerate(stop_ids.tolist())}
+        footpaths = build_footpaths(transfers, stop_position)
+
+        timetable = cls(
+            stop_ids=stop_ids.tolist(),
+            dep_stops=stop_codes[:-1][valid][order],
+            arr_stops=stop_codes[1:][valid][order],
+            dep_times=dep[:-1][valid][order],
+            arr_times=arr[1:][valid][order],
+            trips=trip_codes[:-1][valid][order],
+            trip_ids=trip_ids.tolist(),
+            trip_services=services.map(service_index).to_numpy(dtype=np.int32),
+            footpaths=footpaths,
+            calendar=ServiceCalendar(service_ids, calendar, calendar_dates),
+        )
+        logger.info(f"🔀 CSA : {len(timetable.dep_times)} connexions, {len(trip_ids)} courses.")
+        return timetable
+
+    @classmethod
+    def from_db(cls):
+        """Construit le tableau de connexions depuis les tables de la base (ou le datalake colonnaire)."""
+        conn = get_connection()
+        try:
+            stop_times = read_columns(
+                conn, "stop_times", ["trip_id", "stop_id", "stop_sequence", "arrival_secs", "departure_secs"])
+            trips = read_columns(conn, "trips", ["trip_id", "service_id"])
+            calendar = read_optional_table(conn, "calendar")
+            calendar_dates = read_optional_table(conn, "calendar_dates")
+            transfers = read_optional_table(conn, "transfers")
+        finally:
+            conn.close()
+        return cls.build(stop_times, trips, calendar, calendar_dates, transfers)
+
+    # === Vue d'un jour de service ===
+    def day_view(self, day):
+        """
+        Connexions circulant le jour `day`, triées par départ (secondes depuis minuit du jour).
+        Les courses de la veille encore en circulation après minuit sont incluses (décalées de -24 h) ;
+        leurs identifiants de course sont décalés pour les distinguer.
+        """
+        if day in self._day_views:
+            return self._day_views[day]
+
+        n_trips = len(self.trip_services)
+        today = self.calendar.mask(day)[self.trip_services[self.trips]]
+        yesterday = self.calendar.mask(day - timedelta(days=1))[self.trip_services[self.trips]]
+        yesterday &= self.dep_times >= DAY
+
+        dep = np.concatenate([self.dep_times[today], self.dep_times[yesterday] - DAY])
+        order = np.argsort(dep, kind='stable')
+        view = {
+            "dep_times": dep[order],
+            "arr_times": np.concatenate([self.arr_times[today], self.arr_times[yesterday] - DAY])[order],
+            "dep_stops": np.concatenate([self.dep_stops[today], self.dep_stops[yesterday]])[order],
+            "arr_stops": np.concatenate([self.arr_stops[today], self.arr_stops[yesterday]])[order],
+            "trips": np.concatenate([self.trips[today], self.trips[yesterday] + n_trips])[order],
+        }
+
+        if len(self._day_views) >= self.max_cached_days:
+            self._day_views.pop(next(iter(self._day_views)))
+        self._day_views[day] = view
+        return view
+
+
+def _blocks(view, start, end):
+    """Parcourt les connexions [start, end) par blocs convertis en listes Python (boucle rapide)."""
+    for block_start in range(start, end, SCAN_BLOCK):
+        block_end = min(block_start + SCAN_BLOCK, end)
+        columns = (view[name][block_start:block_end].tolist()
+                   for name in ("dep_times", "arr_times", "dep_stops", "arr_stops", "trips"))
+        yield block_start, zip(*columns)
+
+
+def csa_query(timetable, origin, destination, departure_dt):
+    """
+    Arrivée au plus tôt de `origin` à `destination` pour un départ à `departure_dt`.
+    Retourne un dict `departure`, `arrival`, `legs` (étapes `trip` ou `walk`) ou None.
+    """
+    tt = timetable
+    source, target = tt.stop_index.get(str(origin)), tt.stop_index.get(str(destination))
+    if source is None or target is None or source == target:
+        return None
+
+    day = departure_dt.date()
+    midnight = datetime.combine(day, datetime.min.time())
+    t0 = int((departure_dt - midnight).total_seconds())
+    view = tt.day_view(day)
+
+    earliest = {source: t0}
+    arrived_by = {}
+    for s, duration in tt.footpaths[source]:
+        earliest[s] = t0 + duration
+        arrived_by[s] = ("walk", source, duration)
+    boarded = {}
+
+    start = int(np.searchsorted(view["dep_times"], t0, side="left"))
+    done = False
+    for offset, block in _blocks(view, start, len(view["dep_times"])):
+        for i, (dep, arr, dep_stop, arr_stop, trip) in enumerate(block, offset):
+            if dep >= earliest.get(target, INF):
+                done = True
+                break
+            if trip not in boarded:
+                if earliest.get(dep_stop, INF) > dep:
+                    continue
+                boarded[trip] = i
+            if arr < earliest.get(arr_stop, INF):
+                earliest[arr_stop] = arr
+                arrived_by[arr_stop] = ("trip", boarded[trip], i)
+                for s, duration in tt.footpaths[arr_stop]:
+                    if arr + duration < earliest.get(s, INF):
+                        earliest[s] = arr + duration
+                        arrived_by[s] = ("walk", arr_stop, duration)
+        if done:
+            break
+
+    if target not in arrived_by:
+        return None
+    return _reconstruct(tt, view, arrived_by, source, target, midnight, departure_dt)
+
+
+def _reconstruct(tt, view, arrived_by, source, target, midnight, departure_dt):
+    legs = []
+    s = target
+    while s != source:
+        label = arrived_by[s]
+        if label[0] == "walk":
+            _, from_stop, duration = label
+            legs.append({"type": "walk", "from_stop": tt.stop_ids[from_stop], "to_stop": tt.stop_ids[s],
+                         "duration": duration})
+            s = from_stop
+            continue
+        _, enter, exit_ = label
+        trip = int(view["trips"][enter])
+        # Connexions de la course entre la montée et la descente
+        indices = [i for i in range(enter, exit_ + 1) if view["trips"][i] == trip]
+        stops = [(tt.stop_ids[view["dep_stops"][i]], midnight + timedelta(seconds=int(view["dep_times"][i])))
+                 for i in indices]
+        legs.append({
+            "type": "trip",
+            "trip_id": tt.trip_ids[trip % len(tt.trip_ids)],
+            "from_stop": stops[0][0],
+            "to_stop": tt.stop_ids[view["arr_stops"][exit_]],
+            "departure": stops[0][1],
+            "arrival": midnight + timedelta(seconds=int(view["arr_times"][exit_])),
+            "stops": [stop for stop, _ in stops] + [tt.stop_ids[view["arr_stops"][exit_]]],
+        })
+        s = view["dep_stops"][enter]
+    legs.reverse()
+
+    clock = departure_dt
+    for leg in legs:
+        if leg["type"] == "walk":
+            leg["departure"] = clock
+            leg["arrival"] = clock + timedelta(seconds=leg["duration"])
+        clock = leg["arrival"]
+
+    return {"departure": legs[0]["departure"], "arrival": legs[-1]["arrival"], "legs": legs}
+
+
+def _profile_insert(deps, arrs, dep, arr):
+    """
+    Insère (départ, arrivée) dans un profil Pareto trié par départ croissant (arrivées croissantes).
+    Retourne False si l'entrée est dominée.
+    """
+    pos = bisect.bisect_left(deps, dep)
+    if pos < len(deps) and arrs[pos] <= arr:
+        return False
+    # Entrées remplacées : même départ (arrivée plus tardive), ou départ antérieur sans arrivée plus tôt
+    last = pos + 1 if pos < len(deps) and deps[pos] == dep else pos
+    first = pos
+    while first > 0 and arrs[first - 1] >= arr:
+        first -= 1
+    deps[first:last] = [dep]
+    arrs[first:last] = [arr]
+    return True
+
+
+def csa_profile_query(timetable, origin, destination, window_start, window_end):
+    """
+    Requête profil : tous les départs intéressants de `origin` entre `window_start` et `window_end`
+    (datetimes du même jour) vers `destination`. Retourne une liste de dicts
+    `departure`, `arrival`, `duration_min`, triée par heure de départ, sans départ dominé
+    (partir plus tard pour arriver au même moment ou plus tôt, y compris après la fenêtre,
+    ou rejoindre la destination à pied par une correspondance directe).
+    """
+    tt = timetable
+    source, target = tt.stop_index.get(str(origin)), tt.stop_index.get(str(destination))
+    if source is None or target is None or source == target:
+        return []
+
+    day = window_start.date()
+    midnight = datetime.combine(day, datetime.min.time())
+    t_start = int((window_start - midnight).total_seconds())
+    t_end = int((window_end - midnight).total_seconds())
+    view = tt.day_view(day)
+
+    # Connexions pouvant contribuer : départ dans [t_start, t_end + durée max]
+    lo = int(np.searchsorted(view["dep_times"], t_start, side="left"))
+    hi = int(np.searchsorted(view["dep_times"], t_end + MAX_JOURNEY_SECONDS, side="right"))
+
+    to_target = {i: duration for i, duration in tt.incoming_footpaths[target]}
+    profiles = {}
+    trip_arrival = {}
+
+    def evaluate(stop, time):
+        profile = profiles.get(stop)
+        if profile is None:
+            return INF
+        pos = bisect.bisect_left(profile[0], time)
+        return profile[1][pos] if pos < len(profile[0]) else INF
+
+    columns = [view[name][lo:hi].tolist() for name in ("dep_times", "arr_times", "dep_stops", "arr_stops", "trips")]
+    for dep, arr, dep_stop, arr_stop, trip in zip(*(reversed(column) for column in columns)):
+        if arr_stop == target:
+            best = arr
+        else:
+            best = arr + to_target[arr_stop] if arr_stop in to_target else INF
+        best = min(best, trip_arrival.get(trip, INF), evaluate(arr_stop, arr))
+        if best == INF:
+            continue
+        trip_arrival[trip] = best
+
+        # Les départs postérieurs à la fenêtre restent dans le profil : ils dominent les départs
+        # de la fenêtre qui arrivent plus tard ; ils sont écartés du résultat
+        deps, arrs = profiles.setdefault(dep_stop, ([], []))
+        if _profile_insert(deps, arrs, dep, best):
+            for stop, duration in tt.incoming_footpaths[dep_stop]:
+                walk_deps, walk_arrs = profiles.setdefault(stop, ([], []))
+                _profile_insert(walk_deps, walk_arrs, dep - duration, best)
+
+    walk = dict(tt.footpaths[source]).get(target, INF)
+    deps, arrs = profiles.get(source, ([], []))
+    return [
+        {
+            "departure": midnight + timedelta(seconds=dep),
+            "arrival": midnight + timedelta(seconds=arr),
+            "duration_min": (arr - dep) // 60,
+        }
+        for dep, arr in zip(deps, arrs)
+        if t_start <= dep <= t_end and arr - dep < walk
+    ]
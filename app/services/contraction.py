@@ -0,0 +1,331 @@
+# fichier : app/services/contraction.py
+
+import heapq
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from app.services.route_finder import edge_costs
+from app.services.transit_graph import (
+    HEADER_FILE, TransitGraph, create_version, current_version, publish_version, read_header
+)
+
+logger = logging.getLogger(__name__)
+
+INF = float("inf")
+CH_FORMAT = "urbanmobidf-contraction-hierarchy"
+CH_FORMAT_VERSION = 3  # 2 : coûts d'arêtes planchés (route_finder.MIN_EDGE_SECONDS) ; 3 : identité du graphe
+CH_ARRAYS = ("ranks", "edge_from", "edge_to", "edge_costs", "edge_middle")
+# Limite de nœuds explorés par recherche de témoin (compromis qualité / temps de prétraitement)
+WITNESS_SETTLE_LIMIT = 60
+
+
+class ContractionHierarchy:
+    """
+    Hiérarchie de contraction (CH) sur les coûts alpha * temps + beta * CO2 d'un `TransitGraph`.
+
+    Les nœuds sont contractés un à un (ordre `ranks`) ; des raccourcis préservent les plus courts
+    chemins. Une requête est un Dijkstra bidirectionnel ne montant que vers des nœuds de rang
+    supérieur, puis les raccourcis sont déroulés (`edge_middle`, -1 pour une arête d'origine).
+    """
+
+    def __init__(self, stop_ids, ranks, edge_from, edge_to, edge_costs, edge_middle, alpha, beta):
+        self.stop_ids = stop_ids
+        self.ranks = ranks
+        self.edge_from = edge_from
+        self.edge_to = edge_to
+        self.edge_costs = edge_costs
+        self.edge_middle = edge_middle
+        self.alpha = alpha
+        self.beta = beta
+        self._index = None
+        self._prepare_query_graphs()
+
+    def _prepare_query_graphs(self):
+        n = len(self.stop_ids)
+        ranks = np.asarray(self.ranks)
+        upward = ranks[self.edge_to] > ranks[self.edge_from]
+
+        # Graphe montant avant : u -> w avec rang(w) > rang(u)
+        # Graphe montant arrière : w <- u avec rang(u) > rang(w), indexé par w
+        self._up = _to_lists(n, self.edge_from[upward], self.edge_to[upward], self.edge_costs[upward])
+        self._down = _to_lists(n, self.edge_to[~upward], self.edge_from[~upward], self.edge_costs[~upward])
+        self._middle = {
+            (u, w): m for u, w, m in zip(self.edge_from.tolist(), self.edge_to.tolist(), self.edge_middle.tolist())
+        }
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = {stop_id: i for i, stop_id in enumerate(self.stop_ids.tolist())}
+        return self._index
+
+    # === Prétraitement ===
+    @classmethod
+    def build(cls, G, alpha=1.0, beta=0.02, settle_limit=WITNESS_SETTLE_LIMIT):
+        """Contracte tous les nœuds de `G` (TransitGraph) pour le modèle de coût (alpha, beta)."""
+        started = time.time()
+        n = G.number_of_nodes()
+        costs = edge_costs(G, alpha, beta).tolist()
+        out_edges = [dict() for _ in range(n)]
+        in_edges = [dict() for _ in range(n)]
+        middle = {}
+        for u, w, c in zip(G.sources.tolist(), G.targets.tolist(), costs):
+            if u != w and c < out_edges[u].get(w, INF):
+                out_edges[u][w] = c
+                in_edges[w][u] = c
+                middle[(u, w)] = -1
+
+        contracted = [False] * n
+        depth = [0] * n
+
+        def shortcuts_for(v, limit):
+            """Raccourcis nécessaires si `v` est contracté : liste de (u, w, coût)."""
+            needed = []
+            targets = {w: c for w, c in out_edges[v].items() if not contracted[w]}
+            if not targets:
+                return needed
+            max_out = max(targets.values())
+            for u, c_in in in_edges[v].items():
+                if contracted[u]:
+                    continue
+                reach = _witness_search(out_edges, contracted, u, v, c_in + max_out, limit)
+                for w, c_out in targets.items():
+                    if w != u and reach.get(w, INF) > c_in + c_out:
+                        needed.append((u, w, c_in + c_out))
+            return needed
+
+        def priority(v):
+            degree = sum(1 for u in in_edges[v] if not contracted[u]) + \
+                sum(1 for w in out_edges[v] if not contracted[w])
+            return len(shortcuts_for(v, settle_limit // 4 or 1)) - degree + depth[v]
+
+        queue = [(priority(v), v) for v in range(n)]
+        heapq.heapify(queue)
+        ranks = np.zeros(n, dtype=np.int32)
+        rank = 0
+        while queue:
+            _, v = heapq.heappop(queue)
+            if contracted[v]:
+                continue
+            # Mise à jour paresseuse : si la priorité a augmenté, on réinsère
+            current = priority(v)
+            if queue and current > queue[0][0]:
+                heapq.heappush(queue, (current, v))
+                continue
+
+            for u, w, c in shortcuts_for(v, settle_limit):
+                if c < out_edges[u].get(w, INF):
+                    out_edges[u][w] = c
+                    in_edges[w][u] = c
+                    middle[(u, w)] = v
+            contracted[v] = True
+            ranks[v] = rank
+            rank += 1
+            for neighbor in list(in_edges[v]) + list(out_edges[v]):
+                depth[neighbor] = max(depth[neighbor], depth[v] + 1)
+
+        edge_from, edge_to, edge_cost, edge_middle = [], [], [], []
+        for u in range(n):
+            for w, c in out_edges[u].items():
+                edge_from.append(u)
+                edge_to.append(w)
+                edge_cost.append(c)
+                edge_middle.append(middle[(u, w)])
+
+        shortcuts = sum(1 for m in edge_middle if m >= 0)
+        logger.info(f"🏔️ Hiérarchie de contraction : {n} nœuds, {shortcuts} raccourcis "
+                    f"({time.time() - started:.1f} s).")
+        return cls(np.asarray(G.stop_ids), ranks,
+                   np.array(edge_from, dtype=np.int32), np.array(edge_to, dtype=np.int32),
+                   np.array(edge_cost, dtype=np.float64), np.array(edge_middle, dtype=np.int32),
+                   alpha, beta)
+
+    # === Requête ===
+    def query(self, start, end):
+        """Plus court chemin `(liste de stop_id, coût)` ; `(None, inf)` si inaccessible."""
+        source, target = self.index.get(str(start)), self.index.get(str(end))
+        if source is None or target is None:
+            return None, INF
+        if source == target:
+            return [str(start)], 0.0
+
+        dists = ({source: 0.0}, {target: 0.0})
+        parents = ({source: None}, {target: None})
+        queues = ([(0.0, source)], [(0.0, target)])
+        graphs = (self._up, self._down)
+        settled = (set(), set())
+        best, meeting = INF, None
+
+        while queues[0] or queues[1]:
+            for side in (0, 1):
+                if not queues[side]:
+                    continue
+                cost, node = heapq.heappop(queues[side])
+                if cost > dists[side].get(node, INF) or node in settled[side]:
+                    continue
+                settled[side].add(node)
+                if cost >= best:
+                    queues[side].clear()
+                    continue
+                if node in dists[1 - side] and cost + dists[1 - side][node] < best:
+                    best, meeting = cost + dists[1 - side][node], node
+                for neighbor, step in graphs[side][node]:
+                    new_cost = cost + step
+                    if new_cost < dists[side].get(neighbor, INF):
+                        dists[side][neighbor] = new_cost
+                        parents[side][neighbor] = node
+                        heapq.heappush(queues[side], (new_cost, neighbor))
+
+        if meeting is None:
+            return None, INF
+
+        # Chemin dans le graphe augmenté, puis déroulement des raccourcis
+        up_path = []
+        node = meeting
+        while node is not None:
+            up_path.append(node)
+            node = parents[0][node]
+        up_path.reverse()
+        node = parents[1][meeting]
+        while node is not None:
+            up_path.append(node)
+            node = parents[1][node]
+
+        path = [up_path[0]]
+        for u, w in zip(up_path[:-1], up_path[1:]):
+            path.extend(self._unpack(u, w))
+        return [str(self.stop_ids[i]) for i in path], best
+
+    def _unpack(self, u, w):
+        """Nœuds de u (exclu) à w (inclus) derrière l'arête ou le raccourci u -> w."""
+        stack, nodes = [(u, w)], []
+        while stack:
+            a, b = stack.pop()
+            m = self._middle[(a, b)]
+            if m < 0:
+                nodes.append(b)
+            else:
+                stack.append((m, b))
+                stack.append((a, m))
+        return nodes
+
+    # === Persistance (à côté de l'artefact du graphe, versions publiées via CURRENT) ===
+    def save(self, directory, graph=None):
+        """
+        Enregistre la hiérarchie ; `graph` (cf. `graph_signature`) identifie le graphe
+        dont elle est issue et est vérifié au chargement.
+        """
+        version_dir = create_version(directory)
+        for name in CH_ARRAYS:
+            np.save(os.path.join(version_dir, f"{name}.npy"), getattr(self, name), allow_pickle=False)
+        with open(os.path.join(version_dir, HEADER_FILE), "w", encoding="utf-8") as f:
+            json.dump({"format": CH_FORMAT, "version": CH_FORMAT_VERSION, "alpha": self.alpha, "beta": self.beta,
+                       "nodes": len(self.stop_ids), "edges": len(self.edge_from), "graph": graph}, f)
+        publish_version(version_dir)
+
+    @classmethod
+    def load(cls, directory, stop_ids, alpha, beta, graph=None):
+        """
+        Ouvre une hiérarchie enregistrée par `save` ; ValueError si elle a été construite pour
+        un autre modèle de coût (alpha, beta) ou un autre graphe (version, flux, taille).
+        """
+        version_dir = current_version(directory)
+        if version_dir is None:
+            raise FileNotFoundError(f"Aucune hiérarchie de contraction enregistrée dans {directory}")
+        with open(os.path.join(version_dir, HEADER_FILE), encoding="utf-8") as f:
+            header = json.load(f)
+        if header.get("format") != CH_FORMAT or header.get("version") != CH_FORMAT_VERSION:
+            raise ValueError(f"Hiérarchie de contraction incompatible : {header.get('format')} v{header.get('version')}")
+        if (header.get("alpha"), header.get("beta")) != (alpha, beta):
+            raise ValueError(f"Hiérarchie de contraction construite pour alpha={header.get('alpha')}, "
+                             f"beta={header.get('beta')}")
+        if header.get("nodes") != len(stop_ids) or (graph is not None and header.get("graph") != graph):
+            raise ValueError("Hiérarchie de contraction construite pour un autre graphe")
+        arrays = {name: np.load(os.path.join(version_dir, f"{name}.npy"), allow_pickle=False) for name in CH_ARRAYS}
+        return cls(stop_ids, alpha=header["alpha"], beta=header["beta"], **arrays)
+
+
+def _to_lists(n, sources, targets, costs):
+    adjacency = [[] for _ in range(n)]
+    for u, w, c in zip(sources.tolist(), targets.tolist(), costs.tolist()):
+        adjacency[u].append((w, c))
+    return adjacency
+
+
+def _witness_search(out_edges, contracted, source, excluded, max_cost, settle_limit):
+    """Dijkstra local depuis `source` sans passer par `excluded` ; retourne les distances trouvées."""
+    dist = {source: 0.0}
+    queue = [(0.0, source)]
+    settled = 0
+    while queue and settled < settle_limit:
+        cost, node = heapq.heappop(queue)
+        if cost > dist[node]:
+            continue
+        if cost > max_cost:
+            break
+        settled += 1
+        for neighbor, step in out_edges[node].items():
+            if neighbor == excluded or contracted[neighbor]:
+                continue
+            new_cost = cost + step
+            if new_cost < dist.get(neighbor, INF):
+                dist[neighbor] = new_cost
+                heapq.heappush(queue, (new_cost, neighbor))
+    return dist
+
+
+def hierarchy_dir(graph_dir, alpha=1.0, beta=0.02):
+    return os.path.join(graph_dir, f"ch_{alpha:g}_{beta:g}")
+
+
+def graph_signature(graph_dir):
+    """
+    Identité du graphe en service dans `graph_dir` : version du format, clé de construction,
+    empreinte du flux et taille. Une hiérarchie n'est réutilisée que pour le même graphe.
+    """
+    version_dir = current_version(graph_dir)
+    if version_dir is None:
+        return None
+    header = read_header(version_dir)
+    metadata = header.get("metadata") or {}
+    return {"version": header["version"], "key": metadata.get("key"), "feed_hash": metadata.get("feed_hash"),
+            "nodes": header["nodes"], "edges": header["edges"]}
+
+
+def open_hierarchy(graph_dir, G, alpha=1.0, beta=0.02):
+    """Hiérarchie précalculée pour le graphe en service et (alpha, beta), ou None (aucun calcul)."""
+    directory = hierarchy_dir(graph_dir, alpha, beta)
+    if current_version(directory) is None:
+        return None
+    try:
+        return ContractionHierarchy.load(directory, np.asarray(G.stop_ids), alpha, beta, graph_signature(graph_dir))
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ {e}")
+        return None
+
+
+def load_or_build_hierarchy(graph_dir, G=None, alpha=1.0, beta=0.02):
+    """
+    Hiérarchie associée à l'artefact de graphe `graph_dir` pour (alpha, beta) :
+    chargée si elle existe pour ce même graphe, sinon calculée puis enregistrée à côté du graphe.
+    """
+    if G is None:
+        G, _ = TransitGraph.load(graph_dir)
+    hierarchy = open_hierarchy(graph_dir, G, alpha, beta)
+    if hierarchy is not None:
+        return hierarchy
+
+    hierarchy = ContractionHierarchy.build(G, alpha, beta)
+    hierarchy.save(hierarchy_dir(graph_dir, alpha, beta), graph=graph_signature(graph_dir))
+    return hierarchy
+
+
+# === Prétraitement hors ligne du graphe courant ===
+if __name__ == "__main__":
+    from app.services.graph_builder import resolve_graph_artifact
+
+    load_or_build_hierarchy(resolve_graph_artifact())
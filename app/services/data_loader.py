@@ -1,14 +1,21 @@
 import logging
 import os
+import sys
 import time
 import zipfile
 
 import pandas as pd
 from dotenv import load_dotenv
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.edge.options import Options as EdgeOptions
-from selenium.webdriver.edge.service import Service as EdgeService
+
+from app.services import columnar_store, gtfs_downloader
+
+try:
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.edge.options import Options as EdgeOptions
+    from selenium.webdriver.edge.service import Service as EdgeService
+except ImportError:  # Navigateur optionnel : le téléchargement direct (gtfs_downloader) suffit
+    webdriver = None
 
 # === Configuration du logging ===
 logging.basicConfig(
@@ -20,12 +27,27 @@ logger = logging.getLogger(__name__)
 # === Dossiers ===
 DATA_DIR = os.path.join(os.path.dirname(__file__), "../../data/archives")
 FILES_DIR = os.path.join(os.path.dirname(__file__), "../../data/datalake")
-
-def load_file(filename, sep=','):
+ZIP_PATH = os.path.join(DATA_DIR, "IDFM-gtfs.zip")
+
+def load_file(filename, sep=',', columns=None):
+    """
+    Charge un fichier GTFS (colonnes `columns` seulement si précisées). La version Parquet du
+    datalake est lue en priorité, par projection mémoire, si elle n'est pas plus ancienne
+    que le fichier texte converti (cf. columnar_store).
+    """
     try:
+        table_name = os.path.splitext(filename)[0]
+        parquet_path = columnar_store.columnar_path(table_name)
+        source_path = os.path.join(FILES_DIR, filename)
+        if (columnar_store.available() and os.path.exists(parquet_path)
+                and (not os.path.exists(source_path)
+                     or os.path.getmtime(parquet_path) >= os.path.getmtime(source_path))):
+            logger.info(f"Chargement du fichier : {parquet_path}")
+            return columnar_store.to_frame(columnar_store.read_table(table_name, columns))
+
         path = os.path.join(DATA_DIR, filename)
         logger.info(f"Chargement du fichier : {path}")
-        return pd.read_csv(path, sep=sep, encoding='utf-8', low_memory=False)
+        return pd.read_csv(path, sep=sep, encoding='utf-8', usecols=columns, low_memory=False)
     except Exception as e:
         logger.error(f"Erreur lors du chargement de {filename} : {e}")
         return pd.DataFrame()
@@ -47,7 +69,51 @@ def load_arrets_lignes(): return load_file("arrets_lignes.csv", sep=';')
 def load_export_trajectoires(): return load_file("export_trajectoires.csv")
 
 # === Téléchargement automatisé ===
-def load_data_from_web():
+def extract_archive(zip_path):
+    logger.info("Décompression du fichier...")
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        zip_ref.extractall(FILES_DIR)
+    logger.info("Décompression terminée.")
+
+
+def load_data_from_web(browser=False, extract=True):
+    """
+    Télécharge l'archive GTFS IDFM par requête HTTP directe (cf. gtfs_downloader) et la
+    décompresse dans le datalake, sauf si elle n'a pas changé depuis la dernière décompression.
+    extract : False pour conserver seulement l'archive, lue ensuite directement par
+              `init_db(archive=...)` / `update_db(archive=...)`.
+    browser : ancien téléchargement via Microsoft Edge (Selenium et identifiants requis).
+    Retourne le résultat du téléchargement (gtfs_downloader.DOWNLOADED ou UNCHANGED),
+    ou None en cas d'échec.
+    """
+    if browser:
+        return gtfs_downloader.DOWNLOADED if load_data_from_browser() else None
+
+    try:
+        status, meta = gtfs_downloader.download_gtfs(dest=ZIP_PATH)
+    except Exception as e:
+        logger.exception(f"Une erreur est survenue pendant le téléchargement des données : {e}")
+        return None
+    if not extract:
+        return status
+
+    # Empreinte de la dernière archive décompressée dans le datalake
+    marker = os.path.join(FILES_DIR, ".archive_sha256")
+    if status == gtfs_downloader.UNCHANGED and os.path.exists(marker):
+        with open(marker, encoding="utf-8") as f:
+            if f.read().strip() == meta.get("sha256"):
+                logger.info("Fichiers du datalake à jour : décompression inutile.")
+                return status
+
+    extract_archive(ZIP_PATH)
+    if meta.get("sha256"):
+        with open(marker, "w", encoding="utf-8") as f:
+            f.write(meta["sha256"])
+    return status
+
+
+def load_data_from_browser():
+    """Ancien téléchargement via Microsoft Edge. Retourne True si l'archive a été téléchargée et décompressée."""
     url = "https://new-connect.iledefrance-mobilites.fr/auth/realms/connect-b2b/protocol/openid-connect/auth?client_id=prim&redirect_uri=https://prim.iledefrance-mobilites.fr/fr/&response_type=code&scope=openid%20email"
     download_url = "https://data.iledefrance-mobilites.fr/explore/dataset/offre-horaires-tc-gtfs-idfm/files/a925e164271e4bca93433756d6a340d1/download/"
     driver = None
@@ -59,6 +125,8 @@ def load_data_from_web():
         password = os.getenv("PASSWORD")
         edge_driver_path = os.getenv("EDGE_DRIVER_PATH")
 
+        if webdriver is None:
+            raise ImportError("Le téléchargement via navigateur nécessite selenium")
         if not email or not password:
             raise ValueError("EMAIL et PASSWORD doivent être définis dans le fichier .env")
         if not edge_driver_path:
@@ -86,7 +154,7 @@ def load_data_from_web():
         driver.find_element(By.CSS_SELECTOR, "input[type='submit']").click()
         time.sleep(5)
 
-        zip_path = os.path.join(DATA_DIR, "IDFM-gtfs.zip")
+        zip_path = ZIP_PATH
         if os.path.exists(zip_path):
             logger.info("Suppression de l'ancien fichier zip...")
             os.remove(zip_path)
@@ -97,15 +165,14 @@ def load_data_from_web():
 
         if os.path.exists(zip_path):
             logger.info(f"Fichier téléchargé avec succès : {zip_path}")
-            logger.info("Décompression du fichier...")
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(FILES_DIR)
-            logger.info("Décompression terminée.")
-        else:
-            logger.warning("Le fichier n'a pas été téléchargé.")
+            extract_archive(zip_path)
+            return True
+        logger.warning("Le fichier n'a pas été téléchargé.")
+        return False
 
     except Exception as e:
         logger.exception(f"Une erreur est survenue pendant le chargement des données : {e}")
+        return False
     finally:
         if driver:
             driver.quit()
@@ -113,4 +180,4 @@ def load_data_from_web():
 
 # === Point d'entrée ===
 if __name__ == "__main__":
-    load_data_from_web()
+    load_data_from_web(browser="--browser" in sys.argv[1:])
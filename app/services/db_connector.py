@@ -1,6 +1,9 @@
+import hashlib
 import logging
 import os
 import sqlite3
+import threading
+from contextlib import contextmanager
 
 # === Configuration du logging ===
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -9,36 +12,267 @@ logger = logging.getLogger(__name__)
 # === Chemin vers la base de données ===
 DB_PATH = os.path.join(os.path.dirname(__file__), "../../data/databases/mobility.db")
 
-def get_connection():
-    """Retourne une connexion SQLite à la base de données."""
+# === Pool de connexions ===
+# Lecture : connexions en lecture seule (URI mode=ro) empruntées à un pool partagé par tous les
+# threads et rendues par `close()` ; au plus READER_POOL_SIZE connexions inactives sont gardées.
+# Le pool ne dépend pas des threads : Streamlit exécute chaque rerun dans un nouveau thread.
+# Écriture : une connexion unique par processus, sérialisée par un verrou.
+# Chaque connexion mémorise l'identité (périphérique, inode) du fichier ouvert : quand
+# db_initializer remplace la base par renommage, elle est rouverte sur le nouveau fichier
+# au prochain emprunt (une connexion en cours d'utilisation garde l'ancienne version).
+READER_POOL_SIZE = 4
+READ_PRAGMAS = {
+    "mmap_size": 256 * 1024 * 1024,  # lecture des pages par projection mémoire
+    "cache_size": -64_000,           # 64 Mo de cache de pages par connexion
+    "temp_store": "MEMORY",
+    "query_only": "ON",
+}
+
+_idle_readers = []
+_readers_lock = threading.Lock()
+_writer = {"conn": None, "key": None}
+_writer_lock = threading.RLock()
+_stats_lock = threading.Lock()
+_stats = {"opened": 0, "reused": 0, "writer_opened": 0, "writer_reused": 0, "replaced": 0}
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Connexion SQLite du pool : `close()` la rend au pool au lieu de la fermer, ce qui garde
+    compatible le code existant (`conn = get_connection() ... conn.close()`).
+    `pool_key` : (chemin, identité du fichier) pour une connexion de lecture, None pour l'écrivain.
+    """
+
+    pool_key = None
+
+    def close(self):
+        self.row_factory = None
+        if self.pool_key is not None:
+            _release_reader(self)
+
+    def really_close(self):
+        super().close()
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def _file_identity(path):
+    """(périphérique, inode) du fichier `path`, ou None s'il n'existe pas."""
     try:
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        logger.info("Connexion à la base de données établie.")
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+def _open_reader(path, key):
+    uri = f"file:{os.path.abspath(path)}?mode=ro"
+    # Connexion empruntée successivement par plusieurs threads (jamais simultanément)
+    conn = sqlite3.connect(uri, uri=True, factory=PooledConnection, check_same_thread=False)
+    for pragma, value in READ_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    conn.pool_key = key
+    logger.debug(f"Connexion en lecture ouverte ({threading.current_thread().name}).")
+    _count("opened")
+    return conn
+
+
+def _release_reader(conn):
+    """Rend une connexion de lecture au pool (fermée si le pool est plein ou la base remplacée)."""
+    current = (DB_PATH, _file_identity(DB_PATH))
+    with _readers_lock:
+        if any(idle is conn for idle in _idle_readers):
+            return
+        keep = conn.pool_key == current and len(_idle_readers) < READER_POOL_SIZE
+        if keep:
+            _idle_readers.append(conn)
+    if not keep:
+        conn.pool_key = None
+        conn.really_close()
+
+
+def get_connection():
+    """
+    Emprunte une connexion SQLite en lecture seule au pool (ouverte si aucune n'est disponible).
+    `close()` sur cette connexion la rend au pool. Pour écrire, utiliser `connection(write=True)`.
+    Lève sqlite3.OperationalError si la base n'existe pas (à créer avec `db_initializer.init_db`).
+    """
+    key = (DB_PATH, _file_identity(DB_PATH))
+    if key[1] is None:
+        raise sqlite3.OperationalError(
+            f"Base de données introuvable : {os.path.abspath(DB_PATH)} "
+            "(à créer avec `python -m app.services.db_initializer`)")
+    stale = []
+    conn = None
+    with _readers_lock:
+        while _idle_readers:
+            candidate = _idle_readers.pop()
+            if candidate.pool_key == key:
+                conn = candidate
+                break
+            stale.append(candidate)
+    for old in stale:
+        # Base remplacée depuis l'ouverture : rouverte sur le nouveau fichier
+        if old.pool_key[0] == DB_PATH:
+            _count("replaced")
+        old.pool_key = None
+        old.really_close()
+    if conn is not None:
+        _count("reused")
         return conn
+    try:
+        return _open_reader(DB_PATH, key)
     except sqlite3.Error as e:
         logger.error(f"Erreur lors de la connexion à la base de données : {e}")
+        raise
+
+
+def _get_writer():
+    key = (DB_PATH, _file_identity(DB_PATH))
+    if _writer["conn"] is not None and _writer["key"] == key:
+        _count("writer_reused")
+        return _writer["conn"]
+    if _writer["conn"] is not None:
+        _writer["conn"].really_close()
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30, factory=PooledConnection)
+    conn.execute("PRAGMA temp_store = MEMORY")
+    # Identité relue après ouverture : le fichier a pu être créé par la connexion
+    _writer.update(conn=conn, key=(DB_PATH, _file_identity(DB_PATH)))
+    _count("writer_opened")
+    return conn
+
+
+@contextmanager
+def connection(write=False):
+    """
+    Contexte d'accès à la base : `with connection() as conn: ...` (lecture, connexion du thread)
+    ou `with connection(write=True) as conn: ...` (écrivain unique : commit en sortie,
+    rollback en cas d'exception).
+    """
+    if not write:
+        conn = get_connection()
+        try:
+            yield conn
+        finally:
+            conn.close()
+        return
+
+    with _writer_lock:
+        conn = _get_writer()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+
+def connection_stats():
+    """Compteurs du pool : connexions ouvertes, réutilisées et rouvertes après remplacement de la base."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def close_connections():
+    """Ferme les connexions de lecture inactives du pool et l'écrivain (tests, fin de traitement)."""
+    with _readers_lock:
+        idle = list(_idle_readers)
+        _idle_readers.clear()
+    for conn in idle:
+        conn.pool_key = None
+        conn.really_close()
+    with _writer_lock:
+        if _writer["conn"] is not None:
+            _writer["conn"].really_close()
+            _writer.update(conn=None, key=None)
+
+
+def _read_feed_hash(conn, tables=None):
+    """Empreinte lue dans `feed_meta` par la connexion `conn` (None si absente, cf. `get_feed_hash`)."""
+    if tables:
+        table_hashes = dict(conn.execute("SELECT key, value FROM feed_meta WHERE key LIKE 'table_hash:%'"))
+        if table_hashes:
+            payload = ";".join(f"{t}={table_hashes.get(f'table_hash:{t}', 'absent')}" for t in sorted(tables))
+            return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    row = conn.execute("SELECT value FROM feed_meta WHERE key = 'feed_hash'").fetchone()
+    return row[0] if row else None
+
+
+def _file_feed_hash():
+    """Empreinte dérivée de l'état du fichier, pour une base sans `feed_meta`."""
+    if not os.path.exists(DB_PATH):
+        return "empty"
+    stat = os.stat(DB_PATH)
+    return f"db-{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def get_feed_hash(tables=None):
+    """
+    Empreinte du flux GTFS actuellement chargé (table `feed_meta` écrite par db_initializer).
+    Pour une base antérieure sans cette table, l'empreinte est dérivée de l'état du fichier.
+    tables : empreinte limitée au contenu de ces tables, pour qu'un artefact dérivé ne soit pas
+             invalidé par la mise à jour d'une table dont il ne dépend pas (repli sur l'empreinte
+             du flux si la base ne porte pas d'empreintes par table).
+    """
+    try:
+        with connection() as conn:
+            feed_hash = _read_feed_hash(conn, tables)
+        if feed_hash:
+            return feed_hash
+    except sqlite3.Error:
+        pass
+    return _file_feed_hash()
+
+
+def get_feed_summary():
+    """
+    Ligne unique de `feed_summary` (comptages du flux, métadonnées) sous forme de dict, lue en
+    lecture seule. None si la base est indisponible ou antérieure à cette table (construite
+    alors par `initialize_db`).
+    """
+    try:
+        with connection() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM feed_summary WHERE id = 1").fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f"Résumé du flux indisponible : {e}")
         return None
+    return dict(row) if row else None
+
 
 def initialize_db():
-    """Crée les index nécessaires à la performance si non existants."""
+    """
+    Met à niveau une base chargée par une version antérieure : colonnes horaires entières de
+    stop_times, index, agrégats (`stop_hour_traffic`, `analytics_cube`) et résumé du flux
+    (`feed_summary`) s'ils manquent.
+    """
     logger.info("Initialisation de la base de données...")
-    conn = get_connection()
-    if conn is None:
+    if not os.path.exists(DB_PATH):
         logger.warning("Annulation : impossible d'établir la connexion à la base.")
         return
     try:
-        cursor = conn.cursor()
-        logger.info("Création des index si nécessaire...")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stop_times_stop_id ON stop_times (stop_id);")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stop_times_trip_id ON stop_times (trip_id);")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stops_stop_name ON stops (stop_name);")
-        conn.commit()
-        logger.info("✅ Index créés avec succès.")
+        with connection(write=True) as conn:
+            from app.services.db_initializer import (
+                add_time_columns, build_analytics_cube, build_stop_hour_traffic, create_indexes, table_exists,
+                write_feed_summary
+            )
+            add_time_columns(conn)
+            create_indexes(conn)
+            if not table_exists(conn, "stop_hour_traffic"):
+                build_stop_hour_traffic(conn)
+            if not table_exists(conn, "analytics_cube"):
+                build_analytics_cube(conn)
+            if not table_exists(conn, "feed_summary"):
+                # Empreinte lue par l'écrivain : sa transaction en cours n'est pas visible des lecteurs
+                feed_hash = _read_feed_hash(conn) if table_exists(conn, "feed_meta") else None
+                write_feed_summary(conn, feed_hash or _file_feed_hash())
     except sqlite3.Error as e:
         logger.error(f"Erreur lors de l'initialisation de la base : {e}")
-    finally:
-        conn.close()
-        logger.info("Connexion à la base de données fermée.")
 
 # === Exemple d’utilisation directe ===
 if __name__ == "__main__":
@@ -2,9 +2,17 @@ import logging
 import os
 import shutil
 import sqlite3
+import zipfile
+from datetime import datetime
 
 import pandas as pd
 
+from app.services import gtfs_downloader
+from app.services.bulk_loader import bulk_load, derived_columns, open_source, zip_member
+from app.services.columnar_store import convert_sources
+from app.services.feed_hashes import compute_entity_hashes, compute_feed_hash, write_entity_hashes
+from app.services.service_calendar import ALL_DAYS, service_day_types
+
 # === Configuration du logging ===
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
@@ -13,6 +21,12 @@ logger = logging.getLogger(__name__)
 BASE_DIR = os.path.dirname(__file__)
 DATA_DIR = os.path.join(BASE_DIR, "../../data")
 DB_PATH = os.path.join(DATA_DIR, "databases/mobility.db")
+# Base de préparation, dans le même dossier que DB_PATH pour que le renommage final soit atomique
+STAGING_DB_PATH = DB_PATH + ".staging"
+
+# Tables sans lesquelles l'application ne peut pas fonctionner : une base où elles manquent
+# (ou sont vides) n'est jamais mise en service
+REQUIRED_TABLES = ("stops", "stop_times", "trips", "routes", "feed_meta", "feed_summary", "feed_entity_hashes")
 
 # === Vérifie si une table existe dans la base ===
 def table_exists(conn, table_name):
@@ -23,14 +37,47 @@ def table_exists(conn, table_name):
     )
     return cursor.fetchone() is not None
 
+# === Colonnes horaires entières de stop_times (base chargée via pandas ou antérieure) ===
+def add_time_columns(conn):
+    """
+    Ajoute et remplit les colonnes dérivées de stop_times (`arrival_secs`, `departure_secs`,
+    `departure_hour`) si elles manquent ; le chargement massif les calcule déjà à l'insertion.
+    """
+    if not table_exists(conn, "stop_times"):
+        return
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(stop_times)")}
+    missing = [column for column in derived_columns("stop_times", list(existing)) if column[0] not in existing]
+    if not missing:
+        return
+    logger.info(f"Ajout des colonnes {', '.join(name for name, *_ in missing)} à `stop_times`...")
+    for name, sql_type, _, _ in missing:
+        conn.execute(f'ALTER TABLE stop_times ADD COLUMN "{name}" {sql_type}')
+    conn.execute("UPDATE stop_times SET " + ", ".join(
+        f'"{name}" = {expression.format(t=source)}' for name, _, source, expression in missing
+    ))
+    conn.commit()
+
+def index_exists(conn, index_name):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='index' AND name=?", (index_name,)
+    ).fetchone() is not None
+
 # === Crée des index utiles après chargement ===
 def create_indexes(conn):
     cursor = conn.cursor()
     try:
         logger.info("Création des index...")
         if table_exists(conn, "stop_times"):
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_stop_times_stop_id ON stop_times (stop_id);")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_stop_times_trip_id ON stop_times (trip_id);")
+            # Fenêtres horaires à un arrêt : parcours d'intervalle sur l'index (préfixe stop_id seul inclus)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_stop_times_stop_departure "
+                           "ON stop_times (stop_id, departure_secs);")
+            # Passages d'une course dans l'ordre ; déjà couvert par la clé du chargement massif
+            if not index_exists(conn, "pk_stop_times"):
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_stop_times_trip_sequence "
+                               "ON stop_times (trip_id, stop_sequence);")
+            # Index à une colonne des versions précédentes, redondants avec les précédents
+            cursor.execute("DROP INDEX IF EXISTS idx_stop_times_stop_id;")
+            cursor.execute("DROP INDEX IF EXISTS idx_stop_times_trip_id;")
         if table_exists(conn, "stops"):
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_stops_stop_name ON stops (stop_name);")
         conn.commit()
@@ -38,6 +85,192 @@ def create_indexes(conn):
     except sqlite3.Error as e:
         logger.error(f"❌ Erreur lors de la création des index : {e}")
 
+# === Arrêts à recalculer lors d'une mise à jour incrémentale (table temporaire de la connexion) ===
+def fill_refresh_stops(conn, stop_ids):
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS refresh_stops (stop_id TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM refresh_stops")
+    conn.executemany("INSERT OR IGNORE INTO refresh_stops (stop_id) VALUES (?)", ((s,) for s in stop_ids))
+
+# === Agrégat de trafic arrêt × heure × type de jour (lu par congestion_handler) ===
+def build_stop_hour_traffic(conn, stop_ids=None):
+    """
+    Construit `stop_hour_traffic (stop_id, hour, day_type, departures)` en une passe sur stop_times.
+    day_type vaut "weekday", "saturday", "sunday" (d'après calendar / calendar_dates) ou "all"
+    (tous les passages, sans filtre de service). Les heures GTFS > 24 sont ramenées sur 0-23.
+    stop_ids : ne recalcule que les lignes de ces arrêts (mise à jour incrémentale du flux).
+    """
+    if not table_exists(conn, "stop_times"):
+        return
+    if stop_ids is not None and not table_exists(conn, "stop_hour_traffic"):
+        stop_ids = None
+    logger.info("Construction de l'agrégat `stop_hour_traffic`"
+                + (f" ({len(stop_ids)} arrêts)..." if stop_ids is not None else "..."))
+
+    # Agrégation par SQLite sur l'heure entière calculée à l'ingestion (heures GTFS > 24 → modulo)
+    has_trips = table_exists(conn, "trips")
+    query = (
+        "SELECT st.stop_id, st.departure_hour % 24 AS hour, t.service_id, COUNT(*) AS departures "
+        "FROM stop_times st LEFT JOIN trips t ON t.trip_id = st.trip_id WHERE st.departure_hour IS NOT NULL"
+        if has_trips else
+        "SELECT st.stop_id, st.departure_hour % 24 AS hour, NULL AS service_id, COUNT(*) AS departures "
+        "FROM stop_times st WHERE st.departure_hour IS NOT NULL"
+    )
+    if stop_ids is not None:
+        fill_refresh_stops(conn, stop_ids)
+        query += " AND st.stop_id IN (SELECT stop_id FROM refresh_stops)"
+    by_service = pd.read_sql(query + " GROUP BY st.stop_id, hour, service_id", conn)
+    by_service["service_id"] = by_service["service_id"].astype(str)
+    by_service["hour"] = by_service["hour"].astype(int)
+
+    calendar = pd.read_sql("SELECT * FROM calendar", conn) if table_exists(conn, "calendar") else None
+    calendar_dates = pd.read_sql("SELECT * FROM calendar_dates", conn) if table_exists(conn, "calendar_dates") else None
+    per_day_type = by_service.merge(service_day_types(calendar, calendar_dates), on="service_id")
+
+    traffic = pd.concat([
+        by_service.groupby(["stop_id", "hour"], as_index=False)["departures"].sum().assign(day_type=ALL_DAYS),
+        per_day_type.groupby(["stop_id", "hour", "day_type"], as_index=False)["departures"].sum(),
+    ], ignore_index=True)
+
+    if stop_ids is not None:
+        conn.execute("DELETE FROM stop_hour_traffic WHERE stop_id IN (SELECT stop_id FROM refresh_stops)")
+    else:
+        conn.execute("DROP TABLE IF EXISTS stop_hour_traffic")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stop_hour_traffic (
+            stop_id TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            day_type TEXT NOT NULL,
+            departures INTEGER NOT NULL,
+            PRIMARY KEY (day_type, hour, stop_id)
+        )
+    """)
+    conn.executemany(
+        "INSERT INTO stop_hour_traffic (stop_id, hour, day_type, departures) VALUES (?, ?, ?, ?)",
+        traffic[["stop_id", "hour", "day_type", "departures"]].astype({"stop_id": str}).itertuples(index=False, name=None)
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stop_hour_traffic_stop ON stop_hour_traffic (stop_id, day_type)")
+    conn.commit()
+    logger.info(f"✅ Agrégat `stop_hour_traffic` créé ({len(traffic)} lignes).")
+
+# === Cube analytique ligne × arrêt × heure × mode (lu par le tableau de bord) ===
+def build_analytics_cube(conn, stop_ids=None):
+    """
+    Construit `analytics_cube` : nombre de départs par ligne, arrêt, heure et route_type,
+    agrégé directement par SQLite. Les noms de ligne et d'arrêt sont dénormalisés pour que
+    les filtres du tableau de bord s'appliquent sans jointure. Comme dans `stop_hour_traffic`,
+    les heures GTFS > 24 sont ramenées sur 0-23.
+    stop_ids : ne recalcule que les lignes de ces arrêts (mise à jour incrémentale du flux).
+    """
+    if not all(table_exists(conn, t) for t in ("stop_times", "stops", "trips", "routes")):
+        return
+    if stop_ids is not None and not table_exists(conn, "analytics_cube"):
+        stop_ids = None
+    logger.info("Construction du cube analytique `analytics_cube`"
+                + (f" ({len(stop_ids)} arrêts)..." if stop_ids is not None else "..."))
+    stop_filter = ""
+    if stop_ids is not None:
+        fill_refresh_stops(conn, stop_ids)
+        conn.execute("DELETE FROM analytics_cube WHERE stop_id IN (SELECT stop_id FROM refresh_stops)")
+        stop_filter = "AND st.stop_id IN (SELECT stop_id FROM refresh_stops)"
+    else:
+        conn.execute("DROP TABLE IF EXISTS analytics_cube")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS analytics_cube (
+            route_id TEXT,
+            route_long_name TEXT,
+            route_type INTEGER,
+            stop_id TEXT,
+            stop_name TEXT,
+            hour INTEGER NOT NULL,
+            departures INTEGER NOT NULL
+        )
+    """)
+    conn.execute(f"""
+        INSERT INTO analytics_cube (route_id, route_long_name, route_type, stop_id, stop_name, hour, departures)
+        SELECT
+            r.route_id,
+            r.route_long_name,
+            r.route_type,
+            st.stop_id,
+            s.stop_name,
+            st.departure_hour % 24 AS hour,
+            COUNT(*)
+        FROM stop_times st
+        JOIN stops s ON st.stop_id = s.stop_id
+        JOIN trips t ON t.trip_id = st.trip_id
+        JOIN routes r ON r.route_id = t.route_id
+        WHERE st.departure_hour IS NOT NULL {stop_filter}
+        GROUP BY r.route_id, st.stop_id, hour
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_analytics_cube_hour ON analytics_cube (hour)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_analytics_cube_route_hour ON analytics_cube (route_long_name, hour)")
+    conn.commit()
+    rows = conn.execute("SELECT COUNT(*) FROM analytics_cube").fetchone()[0]
+    logger.info(f"✅ Cube analytique créé ({rows} lignes).")
+
+# === Empreinte du flux chargé (clé des caches dérivés : graphe, agrégats...) ===
+def write_feed_meta(conn, feed_hash):
+    conn.execute("CREATE TABLE IF NOT EXISTS feed_meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.executemany(
+        "INSERT OR REPLACE INTO feed_meta (key, value) VALUES (?, ?)",
+        [("feed_hash", feed_hash), ("loaded_at", datetime.now().isoformat())]
+    )
+    conn.commit()
+    logger.info(f"🔖 Empreinte du flux : {feed_hash[:16]}")
+
+# Empreinte de l'archive GTFS dont la base a été chargée (cf. automatizer : archive inchangée → rien à faire)
+ARCHIVE_HASH_KEY = "archive_sha256"
+
+def write_archive_hash(conn, archive):
+    sha256 = gtfs_downloader.archive_sha256(archive) if archive else None
+    if sha256 is None:
+        conn.execute("DELETE FROM feed_meta WHERE key = ?", (ARCHIVE_HASH_KEY,))
+    else:
+        conn.execute("INSERT OR REPLACE INTO feed_meta (key, value) VALUES (?, ?)", (ARCHIVE_HASH_KEY, sha256))
+    conn.commit()
+
+def read_archive_hash():
+    """Empreinte de l'archive chargée dans la base en service (None si inconnue)."""
+    if not os.path.exists(DB_PATH):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{os.path.abspath(DB_PATH)}?mode=ro", uri=True)
+        try:
+            row = conn.execute("SELECT value FROM feed_meta WHERE key = ?", (ARCHIVE_HASH_KEY,)).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+# === Résumé du flux pour l'accueil (une seule ligne, lue d'un bloc) ===
+SUMMARY_TABLES = ("stops", "trips", "routes", "transfers")
+
+def write_feed_summary(conn, feed_hash):
+    counts = {
+        table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] if table_exists(conn, table) else 0
+        for table in SUMMARY_TABLES
+    }
+    conn.execute("DROP TABLE IF EXISTS feed_summary")
+    conn.execute("""
+        CREATE TABLE feed_summary (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            stops INTEGER,
+            trips INTEGER,
+            routes INTEGER,
+            transfers INTEGER,
+            feed_hash TEXT,
+            loaded_at TEXT
+        )
+    """)
+    conn.execute(
+        "INSERT INTO feed_summary VALUES (1, ?, ?, ?, ?, ?, ?)",
+        (counts["stops"], counts["trips"], counts["routes"], counts["transfers"],
+         feed_hash, datetime.now().isoformat())
+    )
+    conn.commit()
+    logger.info(f"📋 Résumé du flux : {counts}")
+
 # === Vérifie l'espace disque disponible ===
 def check_disk_space():
     total, used, free = shutil.disk_usage(DATA_DIR)
@@ -47,70 +280,176 @@ def check_disk_space():
         logger.warning("⚠️ Espace disque critique (< 100 Mo) ! Risque d'échec.")
     return free_mb
 
-# === Initialise la base et charge les données ===
-def init_db():
-    logger.info("🚀 Initialisation de la base de données...")
+# === Contrôle de la base préparée avant sa mise en service ===
+def verify_database(conn):
+    """Liste des anomalies de la base (vide si elle peut remplacer la base en service)."""
+    problems = []
+    check = conn.execute("PRAGMA quick_check").fetchall()
+    if check != [("ok",)]:
+        problems.extend(f"quick_check : {row[0]}" for row in check[:10])
+    for table_name in REQUIRED_TABLES:
+        if not table_exists(conn, table_name):
+            problems.append(f"table `{table_name}` absente")
+        elif conn.execute(f'SELECT 1 FROM "{table_name}" LIMIT 1').fetchone() is None:
+            problems.append(f"table `{table_name}` vide")
+    return problems
 
-    free_mb = check_disk_space()
-    if free_mb < 50:
-        logger.error("🛑 Espace disque insuffisant pour continuer.")
-        return
+def remove_staging():
+    for path in (STAGING_DB_PATH, STAGING_DB_PATH + "-journal"):
+        if os.path.exists(path):
+            os.remove(path)
 
-    # Supprimer l'ancienne base si elle existe
-    if os.path.exists(DB_PATH):
-        try:
-            os.remove(DB_PATH)
-            logger.info("🗑️ Ancienne base supprimée.")
-        except Exception as e:
-            logger.error(f"❌ Impossible de supprimer l'ancienne base : {e}")
-            return
-
-    conn = sqlite3.connect(DB_PATH)
-
-    files = {
-        "agency": "datalake/agency.txt",
-        "booking_rules": "datalake/booking_rules.txt",
-        "calendar": "datalake/calendar.txt",
-        "calendar_dates": "datalake/calendar_dates.txt",
-        "pathways": "datalake/pathways.txt",
-        "routes": "datalake/routes.txt",
-        "stop_extensions": "datalake/stop_extensions.txt",
-        "stop_times": "datalake/stop_times.txt",
-        "stops": "datalake/stops.txt",
-        "ticketing_deep_links": "datalake/ticketing_deep_links.txt",
-        "transfers": "datalake/transfers.txt",
-        "trips": "datalake/trips.txt",
-        "arrets_lignes": "datalake/arrets_lignes.csv"
-    }
+def publish_staging(conn):
+    """
+    Contrôle la base de préparation ouverte par `conn`, la ferme et, si elle est valide,
+    la met en service par renommage atomique. Retourne True si la base a été remplacée.
+    """
+    problems = verify_database(conn)
+    conn.close()
+    if problems:
+        for problem in problems:
+            logger.error(f"❌ Base de préparation invalide : {problem}")
+        remove_staging()
+        logger.error("🛑 Base en service conservée.")
+        return False
 
-    for table_name, file_name in files.items():
-        file_path = os.path.join(DATA_DIR, file_name)
+    try:
+        os.replace(STAGING_DB_PATH, DB_PATH)
+    except OSError as e:
+        # Windows refuse de remplacer un fichier ouvert : la base en service reste active
+        logger.error(f"❌ Mise en service impossible ({e}) ; base préparée laissée dans {STAGING_DB_PATH}.")
+        return False
+    return True
+
+# === Fichiers du datalake chargés dans la base : {table: fichier} ===
+GTFS_FILES = {
+    "agency": "datalake/agency.txt",
+    "booking_rules": "datalake/booking_rules.txt",
+    "calendar": "datalake/calendar.txt",
+    "calendar_dates": "datalake/calendar_dates.txt",
+    "pathways": "datalake/pathways.txt",
+    "routes": "datalake/routes.txt",
+    "stop_extensions": "datalake/stop_extensions.txt",
+    "stop_times": "datalake/stop_times.txt",
+    "stops": "datalake/stops.txt",
+    "ticketing_deep_links": "datalake/ticketing_deep_links.txt",
+    "transfers": "datalake/transfers.txt",
+    "trips": "datalake/trips.txt",
+    "arrets_lignes": "datalake/arrets_lignes.csv"
+}
+
+def _archive_members(archive):
+    """Membres de l'archive GTFS `archive` par nom de fichier ({} si l'archive est absente ou illisible)."""
+    if not archive:
+        return {}
+    try:
+        with zipfile.ZipFile(archive) as zip_ref:
+            names = [name for name in zip_ref.namelist() if not name.endswith("/")]
+    except (OSError, zipfile.BadZipFile) as e:
+        logger.warning(f"⚠️ Archive GTFS illisible ({e}) : lecture des fichiers du datalake.")
+        return {}
+    return {os.path.basename(name): name for name in names}
 
-        if not os.path.exists(file_path):
+def gtfs_sources(archive=None):
+    """
+    Fichiers sources présents : {table: (chemin, séparateur)}. Avec `archive` (ZIP GTFS), les
+    fichiers qu'elle contient sont lus directement dans l'archive, sans extraction préalable ;
+    les autres (ex. arrets_lignes.csv) restent lus dans le datalake.
+    """
+    members = _archive_members(archive)
+    sources = {}
+    for table_name, file_name in GTFS_FILES.items():
+        file_path = os.path.join(DATA_DIR, file_name)
+        member = members.get(os.path.basename(file_name))
+        if member is not None:
+            file_path = zip_member(archive, member)
+        elif not os.path.exists(file_path):
             logger.warning(f"⚠️  Fichier manquant : {file_name}")
             continue
 
-        sep = ';' if file_name.endswith('.csv') else ','
+        sources[table_name] = (file_path, ';' if file_name.endswith('.csv') else ',')
+    return sources
 
-        try:
-            chunk_size = 100_000
-            first_chunk = True
-            total_rows = 0
+# === Chargement historique via pandas (mode non massif) ===
+def load_with_pandas(conn, table_name, file_path, sep):
+    try:
+        chunk_size = 100_000
+        first_chunk = True
+        total_rows = 0
 
-            logger.info(f"Chargement de {file_name} dans la table `{table_name}`...")
-            for chunk in pd.read_csv(file_path, sep=sep, chunksize=chunk_size, encoding='utf-8', low_memory=False):
+        logger.info(f"Chargement de {os.path.basename(file_path)} dans la table `{table_name}`...")
+        with open_source(file_path) as f:
+            for chunk in pd.read_csv(f, sep=sep, chunksize=chunk_size, low_memory=False):
                 chunk.to_sql(table_name, conn, if_exists='replace' if first_chunk else 'append', index=False)
                 total_rows += len(chunk)
                 first_chunk = False
 
-            logger.info(f"✅ Table `{table_name}` chargée avec succès ({total_rows} lignes).")
+        logger.info(f"✅ Table `{table_name}` chargée avec succès ({total_rows} lignes).")
+        return total_rows
 
-        except Exception as e:
-            logger.error(f"❌ Erreur lors du chargement de `{file_name}` : {e}")
+    except Exception as e:
+        logger.error(f"❌ Erreur lors du chargement de `{file_path}` : {e}")
+        return None
+
+# === Initialise la base et charge les données ===
+def init_db(bulk=True, archive=None):
+    """
+    Reconstruit la base depuis les fichiers GTFS du datalake, sans interruption de service :
+    le chargement se fait dans une base de préparation qui, une fois contrôlée (`verify_database`),
+    remplace la base en service par un renommage atomique. Les connexions déjà ouvertes gardent
+    l'ancienne version jusqu'à leur réouverture (cf. db_connector) ; en cas d'échec, la base en
+    service est conservée telle quelle. Les fichiers chargés sont ensuite convertis en Parquet
+    (cf. columnar_store). Retourne True si la nouvelle base a été mise en service.
+    archive : archive ZIP GTFS lue directement (membres décompressés en flux vers les insertions,
+              sans extraction dans le datalake) ; None pour les fichiers du datalake.
+    bulk : chargement massif (schémas typés, insertions en flux, journal en mémoire,
+           petits fichiers analysés en parallèle) ; False pour l'ancien chargement pandas.
+    """
+    logger.info("🚀 Initialisation de la base de données...")
+
+    free_mb = check_disk_space()
+    if free_mb < 50:
+        logger.error("🛑 Espace disque insuffisant pour continuer.")
+        return False
+
+    # Reste éventuel d'une reconstruction interrompue
+    try:
+        remove_staging()
+    except OSError as e:
+        logger.error(f"❌ Impossible de supprimer la base de préparation : {e}")
+        return False
+
+    conn = sqlite3.connect(STAGING_DB_PATH)
+
+    sources = gtfs_sources(archive)
+    if bulk:
+        loaded = bulk_load(conn, sources)
+    else:
+        loaded = {}
+        for table_name, (file_path, sep) in sources.items():
+            rows = load_with_pandas(conn, table_name, file_path, sep)
+            if rows is not None:
+                loaded[table_name] = rows
+    add_time_columns(conn)
+
+    # Empreintes par entité, base des mises à jour incrémentales (feed_updater)
+    entity_hashes = compute_entity_hashes({t: sources[t] for t in loaded})
+    for table_name, (header, hashes) in entity_hashes.items():
+        write_entity_hashes(conn, table_name, header, hashes)
 
     create_indexes(conn)
-    conn.close()
+    build_stop_hour_traffic(conn)
+    build_analytics_cube(conn)
+    feed_hash = compute_feed_hash(entity_hashes)
+    write_feed_meta(conn, feed_hash)
+    write_archive_hash(conn, archive)
+    write_feed_summary(conn, feed_hash)
+
+    if not publish_staging(conn):
+        return False
+    convert_sources({t: sources[t] for t in entity_hashes}, entity_hashes)
     logger.info("🎯 Base de données initialisée avec succès !")
+    return True
 
 # === Lancement direct ===
 if __name__ == "__main__":
@@ -0,0 +1,197 @@
+# fichier : app/services/event_log.py
+
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+
+import pandas as pd
+
+# === Logging config ===
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# === Chemins ===
+DATA_DIR = os.path.join(os.path.dirname(__file__), "../../data")
+# Base distincte de mobility.db : elle n'est pas effacée au rechargement du flux GTFS
+EVENT_DB_PATH = os.path.join(DATA_DIR, "databases/events.db")
+LEGACY_EMISSION_LOG = os.path.join(DATA_DIR, "emission_log.csv")
+
+# === Paramètres d'écriture ===
+FLUSH_INTERVAL = 2.0   # secondes entre deux écritures groupées
+FLUSH_BATCH_SIZE = 500  # écriture anticipée au-delà de ce nombre d'événements en attente
+
+EVENT_COLUMNS = ["result_id", "logged_at", "departure_time", "arrival_time", "duration",
+                 "co2_total", "start_name", "end_name", "congestion_avoidance"]
+
+
+def new_result_id():
+    return uuid.uuid4().hex
+
+
+class EventLog:
+    """
+    Journal des itinéraires calculés : les événements sont mis en tampon en mémoire et écrits
+    par lots, depuis un thread d'arrière-plan, dans une table SQLite en mode WAL.
+
+    - dédoublonnage par `result_id` (clé primaire, INSERT OR IGNORE) ;
+    - cumul (`itineraries`, `co2_total_g`) maintenu dans `event_totals` dans la même transaction,
+      pour les seuls événements réellement insérés.
+    """
+
+    def __init__(self, db_path=None, flush_interval=FLUSH_INTERVAL, batch_size=FLUSH_BATCH_SIZE):
+        self.db_path = db_path or EVENT_DB_PATH
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending = []
+        self._pending_ids = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._init_db()
+        self._thread = threading.Thread(target=self._run, name="event-log-flusher", daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS itinerary_events (
+                result_id TEXT PRIMARY KEY,
+                logged_at TEXT NOT NULL,
+                departure_time TEXT,
+                arrival_time TEXT,
+                duration INTEGER,
+                co2_total REAL,
+                start_name TEXT,
+                end_name TEXT,
+                congestion_avoidance INTEGER
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS event_totals (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                itineraries INTEGER NOT NULL,
+                co2_total_g REAL NOT NULL
+            )
+        """)
+        if conn.execute("SELECT 1 FROM event_totals WHERE id = 1").fetchone() is None:
+            itineraries, co2_total_g = _legacy_totals()
+            conn.execute("INSERT INTO event_totals VALUES (1, ?, ?)", (itineraries, co2_total_g))
+        conn.commit()
+        conn.close()
+
+    # === Écriture ===
+    def log_itinerary(self, result, co2_total):
+        """Met en tampon l'itinéraire `result` (dict de session, avec `result_id`) ; non bloquant."""
+        event = (
+            result["result_id"],
+            datetime.now().isoformat(),
+            str(result["departure_time"]),
+            str(result["arrival_time"]),
+            int(result["duration"]),
+            float(co2_total),
+            result["start_name"],
+            result["end_name"],
+            int(bool(result["congestion_avoidance"])),
+        )
+        with self._lock:
+            if event[0] in self._pending_ids:
+                return
+            self._pending.append(event)
+            self._pending_ids.add(event[0])
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """Écrit les événements en attente ; retourne le nombre de nouveaux itinéraires."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._pending_ids = set()
+            if not batch:
+                return 0
+
+            inserted, co2 = 0, 0.0
+            try:
+                conn = self._connect()
+                with conn:
+                    for event in batch:
+                        cursor = conn.execute(
+                            f"INSERT OR IGNORE INTO itinerary_events ({', '.join(EVENT_COLUMNS)}) "
+                            f"VALUES ({', '.join('?' * len(EVENT_COLUMNS))})",
+                            event
+                        )
+                        if cursor.rowcount == 1:
+                            inserted += 1
+                            co2 += event[5]
+                    conn.execute(
+                        "UPDATE event_totals SET itineraries = itineraries + ?, co2_total_g = co2_total_g + ? "
+                        "WHERE id = 1",
+                        (inserted, co2)
+                    )
+                conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"❌ Écriture du journal d'itinéraires impossible : {e}")
+                with self._lock:
+                    # Les événements sont remis en tête du tampon pour la prochaine tentative
+                    self._pending = batch + self._pending
+                    self._pending_ids.update(event[0] for event in batch)
+                return 0
+            return inserted
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    # === Lecture ===
+    def totals(self):
+        """Cumul pré-agrégé : {"itineraries": n, "co2_total_g": g} (une seule ligne lue)."""
+        conn = self._connect()
+        row = conn.execute("SELECT itineraries, co2_total_g FROM event_totals WHERE id = 1").fetchone()
+        conn.close()
+        return {"itineraries": row[0], "co2_total_g": row[1]} if row else {"itineraries": 0, "co2_total_g": 0.0}
+
+
+def _legacy_totals():
+    """Cumul initial repris de l'ancien journal CSV (chaque itinéraire y était écrit deux fois)."""
+    if not os.path.exists(LEGACY_EMISSION_LOG):
+        return 0, 0.0
+    try:
+        emissions_df = pd.read_csv(LEGACY_EMISSION_LOG, header=0, usecols=["co2_total"])
+    except (ValueError, pd.errors.ParserError):
+        return 0, 0.0
+    return len(emissions_df) // 2, float(emissions_df["co2_total"].sum()) / 2
+
+
+# === Instance partagée par le processus ===
+_event_log = None
+_event_log_lock = threading.Lock()
+
+
+def get_event_log():
+    global _event_log
+    with _event_log_lock:
+        if _event_log is None:
+            _event_log = EventLog()
+            atexit.register(_event_log.close)
+        return _event_log
@@ -0,0 +1,148 @@
+# fichier : app/services/export_service.py
+
+import csv
+import gzip
+import html
+import logging
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from app.services.db_connector import get_connection
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet optionnel : l'export CSV gzip reste disponible
+    pa = pq = None
+
+# === Logging config ===
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# === Paramètres ===
+# Exports servis comme fichiers statiques par Streamlit (server.enableStaticServing, cf.
+# .streamlit/config.toml) : le navigateur les télécharge par morceaux, le script ne les relit pas
+EXPORT_DIR = os.path.join(os.path.dirname(__file__), "../static/exports")
+EXPORT_URL = "app/static/exports"
+EXPORT_CHUNK_SIZE = 50_000
+EXPORT_MAX_AGE = 3600  # secondes avant suppression d'un export temporaire
+
+FORMATS = {
+    "csv.gz": {"label": "CSV (gzip)", "mime": "application/gzip"},
+    "parquet": {"label": "Parquet", "mime": "application/vnd.apache.parquet"},
+}
+
+
+def available_formats():
+    """Formats d'export utilisables dans l'environnement (Parquet requiert pyarrow)."""
+    return [fmt for fmt in FORMATS if fmt != "parquet" or pq is not None]
+
+
+def _arrow_type(dtype):
+    """Type Arrow d'une colonne, déduit de la famille de son dtype (pas de ses valeurs)."""
+    if pd.api.types.is_bool_dtype(dtype):
+        return pa.bool_()
+    if pd.api.types.is_integer_dtype(dtype):
+        return pa.int64()
+    if pd.api.types.is_float_dtype(dtype):
+        return pa.float64()
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return pa.timestamp("us", tz=getattr(dtype, "tz", None))
+    return pa.string()
+
+
+def frame_schema(frame):
+    """
+    Schéma Parquet d'une suite de blocs, fixé par le premier : entiers en int64 (NaN des blocs
+    suivants écrits comme valeurs nulles), réels en float64, textes et colonnes vides en string.
+    """
+    return pa.schema([pa.field(str(name), _arrow_type(dtype)) for name, dtype in frame.dtypes.items()])
+
+
+def _cleanup_old_exports():
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    limit = time.time() - EXPORT_MAX_AGE
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < limit:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def export_frames(frames, fmt="csv.gz", basename="export", schema=None):
+    """
+    Écrit une suite de DataFrames (mêmes colonnes) dans un fichier temporaire au format `fmt`,
+    bloc par bloc : la mémoire reste bornée par la taille d'un bloc. Retourne le chemin du fichier.
+    En Parquet, chaque bloc est converti explicitement vers `schema` (par défaut `frame_schema`
+    du premier bloc).
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Format d'export inconnu : {fmt}")
+    if fmt == "parquet" and pq is None:
+        raise ImportError("L'export Parquet nécessite pyarrow")
+
+    _cleanup_old_exports()
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=f"{basename}-", suffix=f".{fmt}", dir=EXPORT_DIR)
+    os.close(fd)
+
+    rows = 0
+    try:
+        if fmt == "csv.gz":
+            with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+                header = True
+                for frame in frames:
+                    frame.to_csv(f, index=False, header=header, quoting=csv.QUOTE_MINIMAL)
+                    header = False
+                    rows += len(frame)
+        else:
+            writer = None
+            try:
+                for frame in frames:
+                    if writer is None:
+                        schema = schema or frame_schema(frame)
+                        writer = pq.ParquetWriter(path, schema, compression="snappy")
+                    writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+                    rows += len(frame)
+            finally:
+                if writer is not None:
+                    writer.close()
+            if writer is None:
+                # Aucun bloc : fichier Parquet vide mais valide
+                pq.write_table(pa.table({}), path)
+    except Exception:
+        os.remove(path)
+        raise
+
+    logger.info(f"📦 Export {fmt} : {rows} lignes → {path} ({os.path.getsize(path) // 1024} Ko)")
+    return path
+
+
+def export_query(query, params=(), fmt="csv.gz", basename="export", chunk_size=EXPORT_CHUNK_SIZE, dtypes=None):
+    """
+    Exécute `query` et écrit son résultat, lu par blocs de `chunk_size` lignes, via `export_frames`.
+    `dtypes` ({colonne: dtype pandas}) fixe le type de colonnes dont le premier bloc peut être
+    entièrement NULL (ex. "Int64" pour un entier facultatif).
+    """
+    conn = get_connection()
+    try:
+        frames = pd.read_sql(query, conn, params=list(params), chunksize=chunk_size, dtype=dtypes)
+        return export_frames(frames, fmt, basename)
+    finally:
+        conn.close()
+
+
+def export_url(path):
+    """URL relative, servie par Streamlit, d'un fichier produit par `export_frames`."""
+    return f"{EXPORT_URL}/{os.path.basename(path)}"
+
+
+def download_link(path, file_name, label="📎 Télécharger"):
+    """Lien HTML de téléchargement d'un export, enregistré sous `file_name` par le navigateur."""
+    return f'<a href="{html.escape(export_url(path))}" download="{html.escape(file_name)}">{html.escape(label)}</a>'
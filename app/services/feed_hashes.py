@@ -0,0 +1,131 @@
+# fichier : app/services/feed_hashes.py
+
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from app.services.bulk_loader import PARSE_WORKERS, open_source, read_rows
+
+# === Configuration du logging ===
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# === Entité de comparaison de chaque table : {table: colonne clé} ===
+# Toutes les lignes d'une entité (ex. les passages d'une course) partagent une empreinte ;
+# une table sans clé connue (ou dont le fichier n'a pas la colonne) forme une entité unique.
+ENTITY_KEYS = {
+    "agency": "agency_id",
+    "calendar": "service_id",
+    "calendar_dates": "service_id",
+    "pathways": "pathway_id",
+    "routes": "route_id",
+    "stop_times": "trip_id",
+    "stops": "stop_id",
+    "transfers": "from_stop_id",
+    "trips": "trip_id",
+}
+WHOLE_TABLE = ""  # identifiant de l'entité unique d'une table sans clé
+
+HASH_BITS = 56  # les empreintes tiennent dans un INTEGER SQLite
+HASH_MASK = (1 << HASH_BITS) - 1
+
+
+def entity_key(table_name, header):
+    """Position de la colonne clé de `table_name` dans `header`, ou None (table comparée d'un bloc)."""
+    key = ENTITY_KEYS.get(table_name)
+    return header.index(key) if key in header else None
+
+
+def row_hash(row):
+    digest = hashlib.blake2b("\x1f".join(row).encode("utf-8"), digest_size=HASH_BITS // 8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def hash_entities(table_name, file_path, sep=","):
+    """
+    Empreintes des entités d'un fichier GTFS : `(en-tête, {identifiant: empreinte})`.
+    L'empreinte d'une entité est la somme (modulo 2^56) de celles de ses lignes : elle ne
+    dépend pas de l'ordre des lignes dans le fichier.
+    """
+    with open_source(file_path) as f:
+        header, rows = read_rows(f, sep)
+        key = entity_key(table_name, header)
+        hashes = {}
+        for row in rows:
+            entity = row[key] if key is not None else WHOLE_TABLE
+            hashes[entity] = (hashes.get(entity, 0) + row_hash(row)) & HASH_MASK
+    return header, hashes
+
+
+def _hash_source(item):
+    table_name, (file_path, sep) = item
+    return table_name, hash_entities(table_name, file_path, sep)
+
+
+def compute_entity_hashes(sources, workers=PARSE_WORKERS):
+    """Empreintes de chaque fichier de `sources` ({table: (chemin, séparateur)}), calculées en parallèle."""
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        return dict(pool.map(_hash_source, sources.items()))
+
+
+def table_hash(header, hashes):
+    """Empreinte du contenu d'une table, dérivée de celles de ses entités."""
+    total = sum(hashes.values()) & HASH_MASK
+    payload = f"{chr(0x1f).join(header)}|{len(hashes)}|{total:014x}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def compute_feed_hash(entity_hashes):
+    """
+    Empreinte du flux, dérivée des empreintes de ses tables (`entity_hashes`, cf.
+    `compute_entity_hashes`) : les fichiers ne sont pas relus. Même forme que l'empreinte
+    limitée à des tables de `db_connector.get_feed_hash`.
+    """
+    payload = ";".join(f"{t}={table_hash(*entity_hashes[t])}" for t in sorted(entity_hashes))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# === Stockage dans la base (avec les données qu'elles décrivent) ===
+def has_entity_hashes(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'feed_entity_hashes'"
+    ).fetchone() is not None
+
+
+def hashed_tables(conn):
+    return [row[0] for row in conn.execute("SELECT DISTINCT table_name FROM feed_entity_hashes")]
+
+
+def read_entity_hashes(conn, table_name):
+    return dict(conn.execute(
+        "SELECT entity_id, hash FROM feed_entity_hashes WHERE table_name = ?", (table_name,)
+    ))
+
+
+def write_entity_hashes(conn, table_name, header, hashes):
+    """Remplace les empreintes enregistrées de `table_name` et son empreinte globale (`feed_meta`)."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS feed_entity_hashes (
+            table_name TEXT NOT NULL,
+            entity_id TEXT NOT NULL,
+            hash INTEGER NOT NULL,
+            PRIMARY KEY (table_name, entity_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE TABLE IF NOT EXISTS feed_meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("DELETE FROM feed_entity_hashes WHERE table_name = ?", (table_name,))
+    conn.executemany(
+        "INSERT INTO feed_entity_hashes (table_name, entity_id, hash) VALUES (?, ?, ?)",
+        ((table_name, entity, value) for entity, value in hashes.items())
+    )
+    conn.execute(
+        "INSERT OR REPLACE INTO feed_meta (key, value) VALUES (?, ?)",
+        (f"table_hash:{table_name}", table_hash(header, hashes))
+    )
+    conn.commit()
+
+
+def delete_entity_hashes(conn, table_name):
+    conn.execute("DELETE FROM feed_entity_hashes WHERE table_name = ?", (table_name,))
+    conn.execute("DELETE FROM feed_meta WHERE key = ?", (f"table_hash:{table_name}",))
+    conn.commit()
@@ -0,0 +1,262 @@
+# fichier : app/services/feed_updater.py
+
+import logging
+import os
+import sqlite3
+import time
+
+from app.services import db_connector, db_initializer, gtfs_downloader
+from app.services.bulk_loader import (
+    BULK_PRAGMAS, PARSE_WORKERS, RESTORED_PRAGMAS, derived_columns, insert_statement, load_table, open_source,
+    read_rows, set_pragmas
+)
+from app.services.columnar_store import convert_sources
+from app.services.feed_hashes import (
+    WHOLE_TABLE, compute_entity_hashes, compute_feed_hash, delete_entity_hashes, entity_key, has_entity_hashes,
+    hashed_tables, read_entity_hashes, write_entity_hashes
+)
+
+# === Configuration du logging ===
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# === Dépendances des agrégats : {agrégat: (tables à reconstruction complète, tables à recalcul par arrêt)} ===
+# Un changement dans la première catégorie touche potentiellement tous les arrêts ; dans la seconde,
+# seuls les arrêts desservis par les courses modifiées (ou les arrêts eux-mêmes) sont recalculés.
+AGGREGATE_INPUTS = {
+    "stop_hour_traffic": ({"calendar", "calendar_dates"}, {"stop_times", "trips"}),
+    "analytics_cube": ({"routes"}, {"stop_times", "trips", "stops"}),
+}
+AGGREGATE_BUILDERS = {
+    "stop_hour_traffic": db_initializer.build_stop_hour_traffic,
+    "analytics_cube": db_initializer.build_analytics_cube,
+}
+
+# Modification d'une table entière (nouvelle table, colonnes différentes, fichier disparu)
+RELOAD = "reload"
+DROP = "drop"
+
+
+def diff_entities(old, new):
+    """Entités insérées, supprimées et modifiées entre deux jeux d'empreintes {identifiant: empreinte}."""
+    return {
+        "inserted": new.keys() - old.keys(),
+        "deleted": old.keys() - new.keys(),
+        "changed": {entity for entity in new.keys() & old.keys() if new[entity] != old[entity]},
+    }
+
+
+def _live_columns(conn, table_name):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')]
+
+
+def _expected_columns(table_name, header):
+    """Colonnes de la table chargée depuis un fichier d'en-tête `header` (colonnes dérivées comprises)."""
+    return list(header) + [name for name, *_ in derived_columns(table_name, header)]
+
+
+def plan_update(conn, new_hashes):
+    """
+    Compare les empreintes des fichiers (`new_hashes`, cf. `compute_entity_hashes`) à celles de
+    la base `conn`. Retourne {table: diff | RELOAD | DROP} pour les seules tables modifiées.
+    """
+    plans = {}
+    for table_name, (header, hashes) in new_hashes.items():
+        old = read_entity_hashes(conn, table_name)
+        if not old or _live_columns(conn, table_name) != _expected_columns(table_name, header):
+            plans[table_name] = RELOAD
+            continue
+        diff = diff_entities(old, hashes)
+        if any(diff.values()):
+            plans[table_name] = diff
+    for table_name in hashed_tables(conn):
+        if table_name not in new_hashes:
+            plans[table_name] = DROP
+    return plans
+
+
+def _fill_update_keys(conn, entities):
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS update_keys (entity_id TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM update_keys")
+    conn.executemany("INSERT INTO update_keys (entity_id) VALUES (?)", ((e,) for e in entities))
+
+
+def _stops_of_trips(conn, trip_ids):
+    if not trip_ids or not db_initializer.table_exists(conn, "stop_times"):
+        return set()
+    _fill_update_keys(conn, trip_ids)
+    stop_ids = {row[0] for row in conn.execute(
+        "SELECT DISTINCT stop_id FROM stop_times WHERE trip_id IN (SELECT entity_id FROM update_keys)"
+    )}
+    conn.commit()
+    return stop_ids
+
+
+def apply_table_diff(conn, table_name, header, diff, file_path, sep=","):
+    """
+    Applique `diff` à `table_name` : suppression des entités supprimées ou modifiées, puis
+    insertion, depuis le fichier, des lignes des entités insérées ou modifiées.
+    Retourne le nombre de lignes insérées.
+    """
+    key = entity_key(table_name, header)
+    removed = diff["deleted"] | diff["changed"]
+    added = diff["inserted"] | diff["changed"]
+
+    if key is None:
+        conn.execute(f'DELETE FROM "{table_name}"')
+    elif removed:
+        column = f'"{header[key]}"'
+        _fill_update_keys(conn, removed)
+        # Les clés vides ont été chargées en NULL
+        null_keys = f" OR {column} IS NULL" if WHOLE_TABLE in removed else ""
+        conn.execute(f'DELETE FROM "{table_name}" WHERE {column} IN (SELECT entity_id FROM update_keys){null_keys}')
+
+    with open_source(file_path) as f:
+        _, rows = read_rows(f, sep)
+        if key is not None:
+            rows = (row for row in rows if row[key] in added)
+        inserted = conn.executemany(insert_statement(table_name, header, "OR IGNORE"), rows).rowcount
+    conn.commit()
+    return inserted
+
+
+def refresh_aggregates(conn, plans, stop_ids):
+    """Reconstruit (entièrement ou pour les arrêts `stop_ids`) les agrégats dont une entrée a changé."""
+    changed = set(plans)
+    whole = {table_name for table_name, plan in plans.items() if plan in (RELOAD, DROP)}
+    for name, (full_inputs, stop_inputs) in AGGREGATE_INPUTS.items():
+        if changed & full_inputs or whole & stop_inputs:
+            AGGREGATE_BUILDERS[name](conn)
+        elif changed & stop_inputs and stop_ids:
+            AGGREGATE_BUILDERS[name](conn, stop_ids=stop_ids)
+        else:
+            logger.info(f"⏭️ Agrégat `{name}` inchangé.")
+
+
+def _describe(plan):
+    if plan in (RELOAD, DROP):
+        return "rechargée entièrement" if plan == RELOAD else "supprimée"
+    return f"+{len(plan['inserted'])} / -{len(plan['deleted'])} / ~{len(plan['changed'])} entités"
+
+
+def apply_update(conn, sources, new_hashes, plans):
+    """Applique `plans` (cf. `plan_update`) à la base `conn`, puis rafraîchit agrégats et métadonnées."""
+    # Arrêts desservis par les courses touchées, avant et après modification
+    trip_ids = set()
+    for table_name in ("stop_times", "trips"):
+        plan = plans.get(table_name)
+        if isinstance(plan, dict):
+            trip_ids |= plan["inserted"] | plan["deleted"] | plan["changed"]
+    stop_ids = _stops_of_trips(conn, trip_ids)
+
+    for table_name, plan in plans.items():
+        if plan == DROP:
+            conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+            delete_entity_hashes(conn, table_name)
+            continue
+        file_path, sep = sources[table_name]
+        header, hashes = new_hashes[table_name]
+        if plan == RELOAD:
+            with open_source(file_path) as f:
+                _, rows = read_rows(f, sep)
+                load_table(conn, table_name, header, rows)
+        else:
+            apply_table_diff(conn, table_name, header, plan, file_path, sep)
+            if table_name == "stops":
+                stop_ids |= plan["inserted"] | plan["deleted"] | plan["changed"]
+        write_entity_hashes(conn, table_name, header, hashes)
+
+    stop_ids |= _stops_of_trips(conn, trip_ids)
+    stop_ids.discard(None)
+
+    db_initializer.create_indexes(conn)
+    refresh_aggregates(conn, plans, stop_ids)
+    feed_hash = compute_feed_hash(new_hashes)
+    db_initializer.write_feed_meta(conn, feed_hash)
+    db_initializer.write_feed_summary(conn, feed_hash)
+
+
+# === Mise à jour incrémentale ===
+def update_db(workers=PARSE_WORKERS, archive=None):
+    """
+    Met à jour la base depuis le datalake en n'appliquant que les différences : les fichiers
+    sont comparés à la base par empreintes d'entités (course, arrêt, ligne, service...), les
+    entités insérées, supprimées ou modifiées sont réécrites dans une copie de la base en service,
+    les agrégats ne sont recalculés que pour les arrêts touchés, puis la copie est contrôlée et
+    mise en service comme pour `init_db`, et le datalake colonnaire est mis à jour. Les artefacts dérivés (graphe...) suivent l'empreinte
+    des seules tables dont ils dépendent (cf. `get_feed_hash`).
+
+    archive : archive ZIP GTFS lue directement, sans extraction (cf. `gtfs_sources`).
+    Repli sur `init_db` (reconstruction complète) pour une base sans empreintes.
+    Retourne True si la base en service est à jour.
+    """
+    db_path = db_initializer.DB_PATH
+    if not os.path.exists(db_path):
+        logger.info("Aucune base en service : reconstruction complète.")
+        return db_initializer.init_db(archive=archive)
+    live_uri = f"file:{os.path.abspath(db_path)}?mode=ro"
+    live = sqlite3.connect(live_uri, uri=True)
+    try:
+        hashed = has_entity_hashes(live)
+    finally:
+        live.close()
+    if not hashed:
+        logger.info("Base chargée sans empreintes d'entités : reconstruction complète.")
+        return db_initializer.init_db(archive=archive)
+
+    logger.info("🔎 Comparaison du datalake avec la base en service...")
+    started = time.time()
+    sources = db_initializer.gtfs_sources(archive)
+    new_hashes = compute_entity_hashes(sources, workers)
+    live = sqlite3.connect(live_uri, uri=True)
+    try:
+        plans = plan_update(live, new_hashes)
+    finally:
+        live.close()
+    if not plans:
+        logger.info(f"✅ Flux inchangé ({time.time() - started:.1f} s) : aucune mise à jour.")
+        # Seule écriture dans la base en service : par l'écrivain unique du pool, et seulement
+        # si l'empreinte d'archive enregistrée diffère (ligne de feed_meta, sans republication)
+        sha256 = gtfs_downloader.archive_sha256(archive) if archive else None
+        if db_initializer.read_archive_hash() != sha256:
+            with db_connector.connection(write=True) as conn:
+                db_initializer.write_archive_hash(conn, archive)
+        convert_sources(sources, new_hashes)
+        return True
+    for table_name, plan in plans.items():
+        logger.info(f"   `{table_name}` : {_describe(plan)}")
+
+    # Copie de la base en service, modifiée puis mise en service par renommage atomique
+    try:
+        db_initializer.remove_staging()
+    except OSError as e:
+        logger.error(f"❌ Impossible de supprimer la base de préparation : {e}")
+        return False
+    conn = sqlite3.connect(db_initializer.STAGING_DB_PATH)
+    live = sqlite3.connect(live_uri, uri=True)
+    try:
+        live.backup(conn)
+    finally:
+        live.close()
+
+    set_pragmas(conn, BULK_PRAGMAS)
+    try:
+        apply_update(conn, sources, new_hashes, plans)
+        db_initializer.write_archive_hash(conn, archive)
+        set_pragmas(conn, RESTORED_PRAGMAS)
+    except Exception:
+        conn.close()
+        db_initializer.remove_staging()
+        raise
+
+    if not db_initializer.publish_staging(conn):
+        return False
+    # Seuls les fichiers modifiés (ou pas encore convertis) sont réécrits en Parquet
+    convert_sources(sources, new_hashes)
+    logger.info(f"🎯 Mise à jour incrémentale appliquée en {time.time() - started:.1f} s.")
+    return True
+
+
+# === Lancement direct ===
+if __name__ == "__main__":
+    update_db()
@@ -1,11 +1,34 @@
 # fichier: app/services/graph_builder.py
 
+import hashlib
+import json
 import os
 import pickle
 import logging
+import re
+import shutil
+import threading
+import time
+from datetime import datetime
+
 import networkx as nx
+import numpy as np
+import pandas as pd
+
+from app.services.columnar_store import read_columns
+from app.services.db_connector import get_connection, get_feed_hash
+from app.services.transit_graph import GRAPH_FORMAT_VERSION, HEADER_FILE, TransitGraph, current_version
 
-GRAPH_PATH = os.path.join(os.path.dirname(__file__), "../../data/graphe_transport.pkl")
+# Graphe networkx sérialisé, un fichier par clé (cf. `graph_cache_key`) : graphe_transport-<clé>.pkl
+GRAPH_PICKLE_DIR = os.path.join(os.path.dirname(__file__), "../../data")
+# Artefacts compacts, un répertoire par clé (flux GTFS + paramètres de construction)
+GRAPH_CACHE_DIR = os.path.join(os.path.dirname(__file__), "../../data/graphs")
+GRAPH_CACHE_KEEP = 2
+GRAPH_KEY_PATTERN = re.compile(r"[0-9a-f]{16}")  # cf. `graph_cache_key`
+# Entrées incomplètes (construction interrompue) supprimées au-delà de ce délai
+GRAPH_ORPHAN_GRACE = 3600
+# Tables lues pour construire le graphe : seule leur modification invalide l'artefact
+GRAPH_INPUT_TABLES = ("stops", "stop_times", "trips", "routes", "transfers")
 
 GTFS_ROUTE_TYPES = {
     0: "Tram", 1: "Métro", 2: "Train", 3: "Bus", 4: "Ferry",
@@ -14,6 +37,25 @@ GTFS_ROUTE_TYPES = {
 
 logger = logging.getLogger(__name__)
 
+_rebuild_lock = threading.Lock()
+_rebuilds_in_progress = set()
+_serving = {"key": None}  # artefact rendu par le dernier `resolve_graph_artifact`
+
+
+# Pondération du temps de parcours par mode (constante : évite de la recréer à chaque arête)
+MODE_PENALTIES = {
+    "Train": 1.0,
+    "Métro": 1.0,
+    "Tram": 1.1,
+    "Bus": 1.5,
+    "Trolleybus": 1.5,
+    "Navette": 1.7,
+    "Correspondance": 2.0
+}
+DEFAULT_MODE_PENALTY = 1.2
+MODE_SWITCH_PENALTY = 120
+DEFAULT_TRANSFER_TIME = 300
+
 
 def time_to_seconds(t):
     try:
@@ -23,88 +65,376 @@ def time_to_seconds(t):
         return 0
 
 
-def build_graph(stops, stop_times, trips, routes, transfers=None):
-    if os.path.exists(GRAPH_PATH):
-        logger.info("📦 Chargement du graphe depuis graphe_transport.pkl...")
-        with open(GRAPH_PATH, "rb") as f:
+def times_to_seconds(times):
+    """Version vectorisée de `time_to_seconds` (gère les horaires GTFS > 24:00:00)."""
+    parts = times.astype("string").str.split(":", expand=True)
+    if parts.shape[1] < 3:
+        return pd.Series(0, index=times.index, dtype="int64")
+    h, m, s = (pd.to_numeric(parts[i], errors="coerce") for i in range(3))
+    return (h * 3600 + m * 60 + s).fillna(0).astype("int64")
+
+
+def stop_time_seconds(stop_times, kind):
+    """
+    Secondes depuis minuit du jour de service de `kind` ("arrival" ou "departure") : colonne
+    entière `<kind>_secs` calculée à l'ingestion, ou conversion du texte `<kind>_time` pour un
+    DataFrame qui ne la porte pas. NaN pour un horaire absent.
+    """
+    if f"{kind}_secs" in stop_times.columns:
+        return stop_times[f"{kind}_secs"].astype("float64")
+    times = stop_times[f"{kind}_time"]
+    return times_to_seconds(times.fillna("00:00:00")).where(times.notna()).astype("float64")
+
+
+def compute_trip_edges(stop_times, trips, routes):
+    """
+    Calcule les arêtes « trajet » colonne par colonne (sans itération ligne à ligne).
+    Retourne une ligne agrégée par (from_stop, to_stop, line) avec le poids médian et le nombre de passages.
+    """
+    st = stop_times[['trip_id', 'stop_id', 'stop_sequence']].copy()
+    st['arrival_secs'] = stop_time_seconds(stop_times, 'arrival').fillna(0).astype('int64')
+    st['departure_secs'] = stop_time_seconds(stop_times, 'departure').fillna(0).astype('int64')
+    st = st.sort_values(by=['trip_id', 'stop_sequence'], kind='stable')
+
+    by_trip = st.groupby('trip_id', sort=False)
+    st['next_stop_id'] = by_trip['stop_id'].shift(-1)
+    st['travel_time'] = by_trip['arrival_secs'].shift(-1) - st['departure_secs']
+    st = st[st['next_stop_id'].notna() & (st['travel_time'] >= 0)]
+
+    route_info = routes[['route_id', 'route_short_name', 'route_type']].drop_duplicates('route_id')
+    st = st.merge(trips[['trip_id', 'route_id']].drop_duplicates('trip_id'), on='trip_id', how='left')
+    st = st.merge(route_info, on='route_id', how='left')
+
+    st['line'] = st['route_short_name'].fillna('??').astype(str)
+    st['mode'] = st['route_type'].map(GTFS_ROUTE_TYPES).fillna('??')
+
+    # Pénalité de changement de mode : même règle que la construction historique,
+    # le mode « précédent » étant celui de la dernière arête issue du même arrêt.
+    previous_mode = st.groupby('stop_id', sort=False)['mode'].shift(1)
+    switch_penalty = np.where(previous_mode.notna() & (previous_mode != st['mode']), MODE_SWITCH_PENALTY, 0)
+    factor = st['mode'].map(MODE_PENALTIES).fillna(DEFAULT_MODE_PENALTY).to_numpy()
+    st['weight'] = (st['travel_time'].to_numpy() * factor).astype('int64') + switch_penalty
+
+    edges = (
+        st.groupby(['stop_id', 'next_stop_id', 'line'], sort=False)
+        .agg(weight=('weight', 'median'), mode=('mode', 'first'), trips=('trip_id', 'size'))
+        .reset_index()
+        .rename(columns={'stop_id': 'from_stop', 'next_stop_id': 'to_stop'})
+    )
+    edges['weight'] = edges['weight'].round().astype('int64')
+    return edges[edges['from_stop'] != edges['to_stop']]
+
+
+def compute_transfer_edges(transfers):
+    """Arêtes de correspondance issues de transfers.txt (une par couple d'arrêts)."""
+    columns = ['from_stop', 'to_stop', 'line', 'weight', 'mode', 'transfer_time']
+    if transfers is None or transfers.empty:
+        return pd.DataFrame(columns=columns)
+
+    if 'min_transfer_time' in transfers.columns:
+        transfer_time = pd.to_numeric(transfers['min_transfer_time'], errors='coerce').fillna(DEFAULT_TRANSFER_TIME)
+    else:
+        transfer_time = pd.Series(DEFAULT_TRANSFER_TIME, index=transfers.index)
+
+    edges = pd.DataFrame({
+        'from_stop': transfers['from_stop_id'],
+        'to_stop': transfers['to_stop_id'],
+        'line': "TRANSFERT",
+        'weight': transfer_time.astype('int64'),
+        'mode': "Correspondance",
+        'transfer_time': transfer_time.astype('int64'),
+    })
+    edges = edges.drop_duplicates(['from_stop', 'to_stop'], keep='last')
+    return edges[edges['from_stop'] != edges['to_stop']][columns]
+
+
+def fastest_trip_edges(trip_edges):
+    """Une arête trajet par couple (u, v) : celle de la ligne la plus rapide."""
+    best = trip_edges.sort_values('weight', kind='stable').drop_duplicates(['from_stop', 'to_stop'])
+    return best[['from_stop', 'to_stop', 'weight', 'line', 'mode']].reset_index(drop=True)
+
+
+def collapse_edges(trip_edges, transfer_edges):
+    """
+    Réduit les arêtes à une seule par couple (u, v), comme dans un DiGraph :
+    la ligne la plus rapide est conservée et une correspondance remplace l'arête trajet.
+    """
+    best = fastest_trip_edges(trip_edges)
+    if transfer_edges.empty:
+        return best
+    edges = pd.concat([best, transfer_edges], ignore_index=True)
+    return edges.drop_duplicates(['from_stop', 'to_stop'], keep='last').reset_index(drop=True)
+
+
+def graph_pickle_path(key):
+    return os.path.join(GRAPH_PICKLE_DIR, f"graphe_transport-{key}.pkl")
+
+
+def build_graph(stops, stop_times, trips, routes, transfers=None, key=None):
+    """
+    Graphe networkx des trajets et correspondances. Avec `key` (cf. `graph_cache_key`), le graphe
+    est mis en cache dans graphe_transport-<key>.pkl et relu s'il existe déjà ; sans clé, il est
+    seulement construit. La purge des anciens fichiers relève de `resolve_graph_artifact`.
+    """
+    path = graph_pickle_path(key) if key else None
+    if path and os.path.exists(path):
+        logger.info(f"📦 Chargement du graphe depuis {os.path.basename(path)}...")
+        with open(path, "rb") as f:
             return pickle.load(f)
 
     logger.info("🚧 Construction du graphe depuis les données brutes...")
     G = nx.DiGraph()
 
-    stop_times['arrival_time'] = stop_times['arrival_time'].fillna("00:00:00").apply(time_to_seconds)
-    stop_times['departure_time'] = stop_times['departure_time'].fillna("00:00:00").apply(time_to_seconds)
-    stop_times = stop_times.sort_values(by=['trip_id', 'stop_sequence'])
-    stop_times['next_stop_id'] = stop_times.groupby('trip_id')['stop_id'].shift(-1)
-    stop_times['next_arrival_time'] = stop_times.groupby('trip_id')['arrival_time'].shift(-1)
-    stop_times['travel_time'] = stop_times['next_arrival_time'] - stop_times['departure_time']
-
     name_to_id = stops.dropna(subset=['stop_name']).drop_duplicates('stop_name').set_index('stop_name')['stop_id'].to_dict()
     id_to_name = stops.set_index('stop_id')['stop_name'].to_dict()
-    trip_to_route = trips.set_index('trip_id')['route_id'].to_dict()
-    route_info = routes.set_index('route_id')[['route_short_name', 'route_type']].to_dict(orient='index')
-
-    edge_count = 0
-    last_mode_by_stop = {}
-
-    for _, row in stop_times.dropna(subset=['next_stop_id']).iterrows():
-        from_stop = row['stop_id']
-        to_stop = row['next_stop_id']
-        travel_time = row['travel_time']
-        trip_id = row['trip_id']
-        route_id = trip_to_route.get(trip_id)
-        route = route_info.get(route_id, {})
-        line_name = route.get('route_short_name', '??')
-        mode = GTFS_ROUTE_TYPES.get(route.get('route_type'), '??')
-
-        previous_mode = last_mode_by_stop.get(from_stop)
-        penalty = 120 if previous_mode and previous_mode != mode else 0
-
-        mode_penalties = {
-            "Train": 1.0,
-            "Métro": 1.0,
-            "Tram": 1.1,
-            "Bus": 1.5,
-            "Trolleybus": 1.5,
-            "Navette": 1.7,
-            "Correspondance": 2.0
-        }
-
-        penalty_factor = mode_penalties.get(mode, 1.2)
-        total_weight = int(travel_time * penalty_factor) + penalty
-
-        if travel_time >= 0:
-            G.add_edge(from_stop, to_stop, weight=total_weight, line=line_name, mode=mode)
-            last_mode_by_stop[from_stop] = mode
-            edge_count += 1
-
-    logger.info(f"🔗 {edge_count} trajets ajoutés au graphe.")
-
-    transfer_count = 0
-    if transfers is not None and not transfers.empty:
-        for _, row in transfers.iterrows():
-            from_stop = row['from_stop_id']
-            to_stop = row['to_stop_id']
-            transfer_time = int(row.get('min_transfer_time', 300))
-            G.add_edge(
-                from_stop,
-                to_stop,
-                weight=int(transfer_time),
-                line="TRANSFERT",
-                mode="Correspondance",
-                transfer_time=int(transfer_time)  # 👈 Ajout explicite
-            )
-            transfer_count += 1
-
-        logger.info(f"🔁 {transfer_count} correspondances ajoutées depuis transfers.txt")
+
+    best = fastest_trip_edges(compute_trip_edges(stop_times, trips, routes))
+    G.add_edges_from(
+        (u, v, {"weight": int(w), "line": line, "mode": mode})
+        for u, v, w, line, mode in zip(best['from_stop'], best['to_stop'], best['weight'], best['line'], best['mode'])
+    )
+    logger.info(f"🔗 {G.number_of_edges()} trajets ajoutés au graphe.")
+
+    transfer_edges = compute_transfer_edges(transfers)
+    if not transfer_edges.empty:
+        G.add_edges_from(
+            (u, v, {"weight": int(t), "line": "TRANSFERT", "mode": "Correspondance", "transfer_time": int(t)})
+            for u, v, t in zip(transfer_edges['from_stop'], transfer_edges['to_stop'], transfer_edges['transfer_time'])
+        )
+        logger.info(f"🔁 {len(transfer_edges)} correspondances ajoutées depuis transfers.txt")
     else:
         logger.warning("⚠️ transfers.txt non fourni ou vide — aucune correspondance ajoutée")
 
-    G.remove_edges_from([(n, n) for n in G.nodes if G.has_edge(n, n)])
+    G.remove_edges_from(list(nx.selfloop_edges(G)))
+
+    if path:
+        logger.info(f"💾 Sauvegarde du graphe dans {os.path.basename(path)}...")
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump((G, name_to_id, id_to_name), f)
+        os.replace(path + ".tmp", path)
+        logger.info("✅ Graphe construit et sauvegardé avec succès.")
+    return G, name_to_id, id_to_name
+
+
+def prune_graph_pickles(keep_keys):
+    """Supprime les graphes networkx sérialisés (et l'ancien fichier sans clé) hors de `keep_keys`."""
+    if not os.path.isdir(GRAPH_PICKLE_DIR):
+        return
+    keep = {os.path.basename(graph_pickle_path(key)) for key in keep_keys if key}
+    for name in os.listdir(GRAPH_PICKLE_DIR):
+        if name.startswith("graphe_transport") and name.endswith(".pkl") and name not in keep:
+            try:
+                os.remove(os.path.join(GRAPH_PICKLE_DIR, name))
+            except OSError:
+                pass
+
+
+def graph_build_params():
+    """Paramètres qui influencent le graphe produit (inclus dans la clé de cache)."""
+    return {
+        "format_version": GRAPH_FORMAT_VERSION,
+        "mode_penalties": MODE_PENALTIES,
+        "default_mode_penalty": DEFAULT_MODE_PENALTY,
+        "mode_switch_penalty": MODE_SWITCH_PENALTY,
+        "default_transfer_time": DEFAULT_TRANSFER_TIME,
+    }
+
+
+def graph_cache_key(feed_hash):
+    """Clé d'artefact : empreinte des tables d'entrée (`GRAPH_INPUT_TABLES`) + paramètres de construction."""
+    payload = json.dumps({"feed": feed_hash, "params": graph_build_params()}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def graph_artifact_dir(key):
+    return os.path.join(GRAPH_CACHE_DIR, key)
+
+
+def list_graph_artifacts():
+    """Artefacts complets présents sur disque (clés valides seulement), du plus récent au plus ancien."""
+    if not os.path.isdir(GRAPH_CACHE_DIR):
+        return []
+    artifacts = []
+    for key in os.listdir(GRAPH_CACHE_DIR):
+        if not GRAPH_KEY_PATTERN.fullmatch(key):
+            continue
+        version_dir = current_version(graph_artifact_dir(key))
+        if version_dir is not None:
+            artifacts.append((os.path.getmtime(os.path.join(version_dir, HEADER_FILE)), key))
+    return [key for _, key in sorted(artifacts, reverse=True)]
+
+
+def prune_graph_artifacts(keep=GRAPH_CACHE_KEEP):
+    """
+    Supprime les artefacts les plus anciens et les entrées orphelines (répertoires temporaires,
+    constructions interrompues depuis plus de GRAPH_ORPHAN_GRACE secondes). L'artefact servi
+    et ceux en cours de reconstruction ne sont jamais supprimés.
+    """
+    if not os.path.isdir(GRAPH_CACHE_DIR):
+        return
+    with _rebuild_lock:
+        protected = set(_rebuilds_in_progress) | {_serving["key"]}
+    artifacts = list_graph_artifacts()
+    stale = set(artifacts[keep:])
+    for name in os.listdir(GRAPH_CACHE_DIR):
+        if name in protected:
+            continue
+        path = graph_artifact_dir(name)
+        if name not in artifacts:
+            try:
+                if time.time() - os.path.getmtime(path) < GRAPH_ORPHAN_GRACE:
+                    continue
+            except OSError:
+                continue
+        elif name not in stale:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+
+def save_transit_graph(G, name_to_id, id_to_name, directory, metadata=None):
+    """Enregistre le graphe compact et la table des noms d'arrêts au format mmap."""
+    stop_ids = list(id_to_name.keys())
+    names = ["" if pd.isna(name) else str(name) for name in id_to_name.values()]
+    name_stop_ids = np.array([str(stop_id) for stop_id in name_to_id.values()])
+    G.save(directory, metadata=metadata, extra_arrays={
+        "name_stop_ids": np.array([str(stop_id) for stop_id in stop_ids]),
+        "names": np.array(names),
+        "name_is_canonical": np.isin(np.array([str(s) for s in stop_ids]), name_stop_ids),
+    })
+
+
+def load_transit_graph(directory=None, mmap=True):
+    """
+    Ouvre le graphe compact enregistré (tableaux projetés en mémoire).
+    Sans `directory`, ouvre l'artefact correspondant au flux actuellement chargé.
+    Retourne `(G, name_to_id, id_to_name)` ou None si absent ou d'une version incompatible.
+    """
+    if directory is None:
+        directory = graph_artifact_dir(graph_cache_key(get_feed_hash(GRAPH_INPUT_TABLES)))
+    if current_version(directory) is None:
+        return None
+    try:
+        G, extras = TransitGraph.load(directory, mmap=mmap)
+    except (ValueError, OSError) as e:
+        logger.warning(f"⚠️ Graphe compact illisible ({e}) — reconstruction nécessaire.")
+        return None
+
+    stop_ids = extras["name_stop_ids"].tolist()
+    names = extras["names"].tolist()
+    id_to_name = dict(zip(stop_ids, names))
+    name_to_id = {name: stop_id for stop_id, name, canonical
+                  in zip(stop_ids, names, extras["name_is_canonical"].tolist()) if canonical and name}
+    return G, name_to_id, id_to_name
+
+
+def load_graph_inputs():
+    """
+    Lit les seules colonnes nécessaires à la construction du graphe : dans le datalake
+    colonnaire s'il correspond à la base en service, sinon dans la base (cf. columnar_store).
+    """
+    conn = get_connection()
+    try:
+        stops = read_columns(conn, "stops", ["stop_id", "stop_name", "stop_lat", "stop_lon"])
+        stop_times = read_columns(
+            conn, "stop_times", ["trip_id", "stop_id", "stop_sequence", "arrival_secs", "departure_secs"])
+        trips = read_columns(conn, "trips", ["trip_id", "route_id"])
+        routes = read_columns(conn, "routes", ["route_id", "route_short_name", "route_type"])
+        transfers = read_columns(conn, "transfers")
+    finally:
+        conn.close()
+    return stops, stop_times, trips, routes, transfers
+
+
+def build_transit_graph(stops, stop_times, trips, routes, transfers=None, feed_hash=None):
+    """
+    Variante compacte de `build_graph` : retourne un `TransitGraph` (tableaux CSR)
+    au lieu d'un `networkx.DiGraph`, avec les mêmes arêtes et les mêmes poids.
+    L'artefact est rangé sous une clé dérivée du flux et des paramètres : des entrées
+    identiques réutilisent toujours la construction existante.
+    """
+    feed_hash = feed_hash or get_feed_hash(GRAPH_INPUT_TABLES)
+    key = graph_cache_key(feed_hash)
+    directory = graph_artifact_dir(key)
+
+    loaded = load_transit_graph(directory)
+    if loaded is not None:
+        logger.info(f"📦 Graphe compact {key} ouvert depuis le cache (mmap).")
+        return loaded
+
+    logger.info(f"🚧 Construction du graphe compact {key} depuis les données brutes...")
+    started = time.time()
+    name_to_id = stops.dropna(subset=['stop_name']).drop_duplicates('stop_name').set_index('stop_name')['stop_id'].to_dict()
+    id_to_name = stops.set_index('stop_id')['stop_name'].to_dict()
+
+    trip_edges = compute_trip_edges(stop_times, trips, routes)
+    transfer_edges = compute_transfer_edges(transfers)
+    if transfer_edges.empty:
+        logger.warning("⚠️ transfers.txt non fourni ou vide — aucune correspondance ajoutée")
+
+    G = TransitGraph.from_edges(collapse_edges(trip_edges, transfer_edges), stops=stops)
+    logger.info(f"🔗 {G.number_of_nodes()} arrêts, {G.number_of_edges()} arêtes ({G.nbytes / 1e6:.1f} Mo).")
 
-    logger.info("💾 Sauvegarde du graphe dans graphe_transport.pkl...")
-    with open(GRAPH_PATH, "wb") as f:
-        pickle.dump((G, name_to_id, id_to_name), f)
+    logger.info(f"💾 Sauvegarde du graphe dans graphs/{key}/...")
+    save_transit_graph(G, name_to_id, id_to_name, directory, metadata={
+        "key": key,
+        "feed_hash": feed_hash,
+        "params": graph_build_params(),
+        "built_at": datetime.now().isoformat(),
+        "build_seconds": round(time.time() - started, 1),
+    })
+    prune_graph_artifacts()
 
-    logger.info("✅ Graphe construit et sauvegardé avec succès.")
+    logger.info("✅ Graphe compact construit et sauvegardé avec succès.")
     return G, name_to_id, id_to_name
+
+
+def _rebuild_in_background(key, feed_hash):
+    try:
+        build_transit_graph(*load_graph_inputs(), feed_hash=feed_hash)
+    except Exception as e:
+        logger.exception(f"❌ Échec de la reconstruction du graphe {key} : {e}")
+    finally:
+        with _rebuild_lock:
+            _rebuilds_in_progress.discard(key)
+
+
+def _serve(key, current_key):
+    """Mémorise l'artefact servi ; à chaque changement, purge les graphes sérialisés des autres flux."""
+    if _serving["key"] != key:
+        _serving["key"] = key
+        prune_graph_pickles({key, current_key})
+
+
+def resolve_graph_artifact():
+    """
+    Retourne le répertoire de l'artefact à servir pour le flux actuellement chargé.
+
+    - artefact à jour présent : il est servi tel quel ;
+    - flux nouveau mais ancien artefact disponible : l'ancien est servi pendant qu'un
+      thread reconstruit le nouveau en arrière-plan ;
+    - aucun artefact : construction synchrone.
+    """
+    feed_hash = get_feed_hash(GRAPH_INPUT_TABLES)
+    key = graph_cache_key(feed_hash)
+    directory = graph_artifact_dir(key)
+    if current_version(directory) is not None:
+        _serve(key, key)
+        return directory
+
+    previous = [k for k in list_graph_artifacts() if k != key]
+    if not previous:
+        build_transit_graph(*load_graph_inputs(), feed_hash=feed_hash)
+        _serve(key, key)
+        return directory
+
+    # L'ancien artefact reste servi (et protégé de la purge) pendant la reconstruction
+    _serve(previous[0], key)
+    with _rebuild_lock:
+        if key not in _rebuilds_in_progress:
+            _rebuilds_in_progress.add(key)
+            logger.info(f"🔄 Nouveau flux détecté : reconstruction du graphe {key} en arrière-plan.")
+            threading.Thread(target=_rebuild_in_background, args=(key, feed_hash), daemon=True).start()
+    return graph_artifact_dir(previous[0])
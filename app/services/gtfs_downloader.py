@@ -0,0 +1,260 @@
+# fichier : app/services/gtfs_downloader.py
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import time
+import zipfile
+
+import requests
+from dotenv import load_dotenv
+
+# === Configuration du logging ===
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# === Paramètres ===
+# Archive GTFS publiée par IDFM (surchargeable par la variable d'environnement GTFS_URL)
+GTFS_URL = "https://data.iledefrance-mobilites.fr/explore/dataset/offre-horaires-tc-gtfs-idfm/files/a925e164271e4bca93433756d6a340d1/download/"
+ARCHIVE_DIR = os.path.join(os.path.dirname(__file__), "../../data/archives")
+ZIP_PATH = os.path.join(ARCHIVE_DIR, "IDFM-gtfs.zip")
+PARTIAL_SUFFIX = ".part"
+META_SUFFIX = ".json"  # validateurs HTTP (ETag, Last-Modified) et empreinte, à côté de chaque fichier
+CHUNK_SIZE = 256 * 1024  # octets perdus au plus lors d'une coupure
+TIMEOUT = (10, 60)  # secondes : connexion, puis silence maximal entre deux blocs reçus
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 2  # secondes, doublées à chaque nouvelle tentative
+PROGRESS_STEP = 10  # % entre deux messages de progression
+PROGRESS_UNKNOWN_BYTES = 10 * 1024 * 1024  # pas des messages lorsque la taille est inconnue
+
+# Résultats de `download_gtfs`
+UNCHANGED = "unchanged"
+DOWNLOADED = "downloaded"
+
+# Erreurs réseau après lesquelles le téléchargement reprend là où il s'est arrêté
+RETRYABLE_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+
+def _read_meta(path):
+    try:
+        with open(path + META_SUFFIX, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_meta(path, meta):
+    with open(path + META_SUFFIX + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(path + META_SUFFIX + ".tmp", path + META_SUFFIX)
+
+
+def _remove(path):
+    for name in (path, path + META_SUFFIX):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def file_sha256(path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest
+
+
+def archive_sha256(path):
+    """Empreinte SHA-256 de l'archive `path` (celle enregistrée au téléchargement si elle est à jour), ou None."""
+    if not os.path.exists(path):
+        return None
+    meta = _read_meta(path)
+    if meta.get("sha256") and meta.get("size") == os.path.getsize(path):
+        return meta["sha256"]
+    return file_sha256(path).hexdigest()
+
+
+def announced_sha256(headers):
+    """Empreinte SHA-256 annoncée par le serveur (en-têtes Repr-Digest ou Digest), en hexadécimal."""
+    for header in ("Repr-Digest", "Digest"):
+        for item in headers.get(header, "").split(","):
+            algorithm, _, value = item.strip().partition("=")
+            if algorithm.lower() == "sha-256" and value:
+                try:
+                    return base64.b64decode(value.strip(":")).hex()
+                except ValueError:
+                    return None
+    return None
+
+
+def progress_logger(step=PROGRESS_STEP):
+    """Rapporteur de progression `(reçus, total)` : un message tous les `step` %."""
+    state = {"next": 0}
+
+    def report(done, total):
+        if total:
+            percent = done * 100 // total
+            if percent >= state["next"]:
+                logger.info(f"⬇️ {percent} % ({done / 1e6:.1f} / {total / 1e6:.1f} Mo)")
+                state["next"] = percent - percent % step + step
+        elif done >= state["next"]:
+            logger.info(f"⬇️ {done / 1e6:.1f} Mo reçus")
+            state["next"] = done + PROGRESS_UNKNOWN_BYTES
+
+    return report
+
+
+def verify_archive(path):
+    """Contrôle l'archive ZIP (structure et CRC de chaque fichier) ; lève ValueError si elle est corrompue."""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            broken = archive.testzip()
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"Archive GTFS illisible : {e}") from e
+    if broken is not None:
+        raise ValueError(f"Archive GTFS corrompue : {broken}")
+
+
+def _content_range(headers):
+    """(début, taille totale) d'une réponse partielle `Content-Range: bytes début-fin/total`."""
+    try:
+        span, _, total = headers["Content-Range"].split(" ", 1)[1].partition("/")
+        return int(span.split("-")[0]), None if total == "*" else int(total)
+    except (KeyError, IndexError, ValueError):
+        return None, None
+
+
+def _download_once(session, url, dest, expected_sha256, progress):
+    partial = dest + PARTIAL_SUFFIX
+    previous = _read_meta(dest) if os.path.exists(dest) else {}
+    resume = _read_meta(partial) if os.path.exists(partial) else {}
+
+    # Requête conditionnelle : le serveur répond 304 si l'archive n'a pas changé.
+    # Pas de compression de transfert : les positions de reprise sont celles du fichier.
+    headers = {"Accept-Encoding": "identity"}
+    if previous.get("url") == url:
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+    # Reprise d'un téléchargement interrompu, si la version distante n'a pas changé depuis (If-Range)
+    offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+    validator = resume.get("etag") or resume.get("last_modified")
+    if offset and validator and resume.get("url") == url:
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = validator
+    else:
+        offset = 0
+
+    with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+        if response.status_code == 304:
+            return UNCHANGED, previous
+        if response.status_code == 416:
+            # Reste partiel inutilisable : nouveau téléchargement complet
+            _remove(partial)
+            return _download_once(session, url, dest, expected_sha256, progress)
+        response.raise_for_status()
+
+        total = None
+        if response.status_code == 206:
+            start, total = _content_range(response.headers)
+            if start != offset:
+                _remove(partial)
+                return _download_once(session, url, dest, expected_sha256, progress)
+            logger.info(f"↪️ Reprise du téléchargement à {offset / 1e6:.1f} Mo.")
+        else:
+            offset = 0
+            if response.headers.get("Content-Length", "").isdigit():
+                total = int(response.headers["Content-Length"])
+
+        meta = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        _write_meta(partial, meta)
+
+        digest = file_sha256(partial) if offset else hashlib.sha256()
+        done = offset
+        with open(partial, "ab" if offset else "wb") as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                digest.update(chunk)
+                done += len(chunk)
+                progress(done, total)
+
+    if total is not None and done < total:
+        raise requests.ConnectionError(f"Téléchargement interrompu ({done} / {total} octets)")
+
+    # Vérifications : empreinte attendue ou annoncée par le serveur, puis intégrité de l'archive
+    sha256 = digest.hexdigest()
+    for expected in (expected_sha256, announced_sha256(response.headers)):
+        if expected and expected.lower() != sha256:
+            _remove(partial)
+            raise ValueError(f"Empreinte SHA-256 incorrecte : {sha256} au lieu de {expected.lower()}")
+    try:
+        verify_archive(partial)
+    except ValueError:
+        _remove(partial)
+        raise
+
+    os.replace(partial, dest)
+    meta.update(sha256=sha256, size=done, downloaded_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+    _write_meta(dest, meta)
+    _remove(partial)
+    # Serveur sans validateurs : contenu identique à l'archive précédente
+    status = UNCHANGED if previous.get("sha256") == sha256 else DOWNLOADED
+    return status, meta
+
+
+# === Téléchargement ===
+def download_gtfs(url=None, dest=ZIP_PATH, expected_sha256=None, session=None, progress=None,
+                  max_attempts=MAX_ATTEMPTS):
+    """
+    Télécharge l'archive GTFS `url` (GTFS_URL par défaut) dans `dest`, en flux et sans navigateur :
+    - requête conditionnelle (ETag / Last-Modified de la version précédente) : rien n'est
+      téléchargé si l'archive n'a pas changé ;
+    - écriture dans `dest.part`, reprise (Range / If-Range) après une coupure réseau, jusqu'à
+      `max_attempts` tentatives ;
+    - vérification de l'empreinte SHA-256 (`expected_sha256`, variable GTFS_SHA256 ou en-tête
+      Digest du serveur) et des CRC de l'archive, avant remplacement atomique de `dest` ;
+    - progression rapportée à `progress(reçus, total)` (messages de log par défaut).
+    Retourne `(UNCHANGED | DOWNLOADED, métadonnées)` ; lève une exception en cas d'échec
+    (l'archive précédente est alors conservée).
+    """
+    load_dotenv()
+    url = url or os.getenv("GTFS_URL") or GTFS_URL
+    expected_sha256 = expected_sha256 or os.getenv("GTFS_SHA256")
+    progress = progress or progress_logger()
+    os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+
+    own_session = session is None
+    session = session or requests.Session()
+    started = time.time()
+    try:
+        for attempt in range(1, max_attempts + 1):
+            try:
+                status, meta = _download_once(session, url, dest, expected_sha256, progress)
+                break
+            except RETRYABLE_ERRORS as e:
+                if attempt == max_attempts:
+                    raise
+                delay = RETRY_DELAY * 2 ** (attempt - 1)
+                logger.warning(f"⚠️ Tentative {attempt}/{max_attempts} interrompue ({e}) : reprise dans {delay} s.")
+                time.sleep(delay)
+    finally:
+        if own_session:
+            session.close()
+
+    if status == UNCHANGED:
+        logger.info(f"✅ Archive GTFS inchangée ({time.time() - started:.1f} s).")
+    else:
+        logger.info(f"📦 Archive GTFS téléchargée : {meta['size'] / 1e6:.1f} Mo en {time.time() - started:.1f} s "
+                    f"(sha256 {meta['sha256'][:12]}…).")
+    return status, meta
+
+
+# === Lancement direct ===
+if __name__ == "__main__":
+    download_gtfs()
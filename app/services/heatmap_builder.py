@@ -0,0 +1,169 @@
+# fichier : app/services/heatmap_builder.py
+
+import json
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.services import congestion_handler
+from app.services.db_connector import get_connection, get_feed_hash
+from app.services.transit_graph import HEADER_FILE, create_version, current_version, publish_version
+
+# === Logging config ===
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# === Chemins ===
+HEATMAP_DIR = os.path.join(os.path.dirname(__file__), "../../data/heatmaps")
+HEATMAP_FORMAT = "urbanmobidf-congestion-heatmap"
+HEATMAP_FORMAT_VERSION = 1
+
+# Jour représentatif de chaque type de jour (0 = lundi)
+HEATMAP_DAY_TYPES = {"weekday": 1, "saturday": 5, "sunday": 6}
+HOURS = 24
+
+
+def build_heatmap_artifact(directory=None, min_traffic=0.5):
+    """
+    Précalcule, depuis le modèle de congestion enregistré, les points de chaleur
+    (lat, lon, trafic prévu) de chaque heure et type de jour.
+
+    Pour chaque type de jour, les points sont triés par heure dans `points_<type>.npy`
+    (float32, n × 3) et `offsets_<type>.npy` (25 bornes) délimite chaque heure :
+    l'écran ne lit ainsi que les tranches horaires affichées.
+
+    Comme le graphe compact, l'artefact est écrit dans un nouveau sous-répertoire de
+    version de `directory`, puis publié par remplacement atomique du pointeur CURRENT :
+    un lecteur trouve toujours une version complète.
+    """
+    directory = directory or HEATMAP_DIR
+    started = time.time()
+    if congestion_handler.load_congestion_model() is None:
+        logger.info("Aucun modèle de congestion : entraînement préalable.")
+        congestion_handler.train_congestion_model()
+    _, le = congestion_handler.load_congestion_model()
+
+    conn = get_connection()
+    stops = pd.read_sql("SELECT stop_id, stop_lat, stop_lon FROM stops", conn)
+    conn.close()
+    stops = stops.astype({"stop_id": str}).drop_duplicates("stop_id").set_index("stop_id")
+    coords = stops.reindex(le.classes_.astype(str))[["stop_lat", "stop_lon"]].to_numpy(dtype=np.float32)
+    located = np.isfinite(coords).all(axis=1)
+
+    version_dir = create_version(directory)
+
+    max_values = {}
+    for day_type, weekday in HEATMAP_DAY_TYPES.items():
+        table = congestion_handler.prediction_table(weekday)  # arrêts × heures
+        points, stop_codes, offsets = [], [], [0]
+        for hour in range(HOURS):
+            keep = located & (table[:, hour] >= min_traffic)
+            codes = np.flatnonzero(keep)
+            points.append(np.column_stack([coords[codes], table[codes, hour]]).astype(np.float32))
+            stop_codes.append(codes.astype(np.int32))
+            offsets.append(offsets[-1] + len(codes))
+
+        points = np.concatenate(points) if points else np.empty((0, 3), dtype=np.float32)
+        np.save(os.path.join(version_dir, f"points_{day_type}.npy"), points)
+        np.save(os.path.join(version_dir, f"stops_{day_type}.npy"), np.concatenate(stop_codes))
+        np.save(os.path.join(version_dir, f"offsets_{day_type}.npy"), np.array(offsets, dtype=np.int64))
+        max_values[day_type] = float(points[:, 2].max()) if len(points) else 0.0
+
+    np.save(os.path.join(version_dir, "stop_ids.npy"), le.classes_.astype(str))
+    metadata = congestion_handler.congestion_model_metadata() or {}
+    with open(os.path.join(version_dir, HEADER_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "format": HEATMAP_FORMAT,
+            "version": HEATMAP_FORMAT_VERSION,
+            "feed_hash": get_feed_hash(),
+            "model_trained_at": metadata.get("trained_at"),
+            "day_types": HEATMAP_DAY_TYPES,
+            "max_traffic": max_values,
+            "built_at": pd.Timestamp.now().isoformat(),
+        }, f, indent=2)
+
+    publish_version(version_dir)
+    logger.info(f"🔥 Carte de chaleur précalculée en {time.time() - started:.1f} s ({directory}).")
+    return directory
+
+
+class HeatmapArtifact:
+    """Accès en lecture aux tranches horaires d'un artefact (tableaux projetés en mémoire)."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or HEATMAP_DIR
+        # Version en service résolue une seule fois : ses fichiers ne sont jamais réécrits,
+        # et tous les tableaux sont ouverts ici (projections établies avant tout remplacement).
+        self.version_dir = current_version(self.directory)
+        if self.version_dir is None:
+            raise FileNotFoundError(f"Aucune carte de chaleur publiée : {self.directory}")
+        self.header = _read_header(self.version_dir)
+        self._arrays = {"stop_ids": self._load("stop_ids")}
+        for day_type in self.header["day_types"]:
+            for name in ("points", "stops", "offsets"):
+                self._arrays[f"{name}_{day_type}"] = self._load(f"{name}_{day_type}")
+
+    def _load(self, name):
+        return np.load(os.path.join(self.version_dir, f"{name}.npy"), mmap_mode="r")
+
+    @property
+    def day_types(self):
+        return list(self.header["day_types"])
+
+    def max_traffic(self, day_type):
+        return self.header["max_traffic"][day_type]
+
+    def hours_frame(self, day_type, hours):
+        """DataFrame (stop_id, hour, stop_lat, stop_lon, predicted_traffic) des heures demandées."""
+        offsets = self._arrays[f"offsets_{day_type}"]
+        stop_ids = self._arrays["stop_ids"]
+        frames = []
+        for hour in hours:
+            a, b = offsets[hour], offsets[hour + 1]
+            points = np.asarray(self._arrays[f"points_{day_type}"][a:b])
+            frames.append(pd.DataFrame({
+                "stop_id": stop_ids[np.asarray(self._arrays[f"stops_{day_type}"][a:b])],
+                "hour": hour,
+                "stop_lat": points[:, 0],
+                "stop_lon": points[:, 1],
+                "predicted_traffic": points[:, 2],
+            }))
+        if not frames:
+            return pd.DataFrame(columns=["stop_id", "hour", "stop_lat", "stop_lon", "predicted_traffic"])
+        return pd.concat(frames, ignore_index=True)
+
+
+def heatmap_version(directory=None):
+    """Date de construction de l'artefact en place (None s'il est absent) : clé des caches de l'écran."""
+    version_dir = current_version(directory or HEATMAP_DIR)
+    if version_dir is None:
+        return None
+    try:
+        return _read_header(version_dir).get("built_at")
+    except (OSError, ValueError):
+        return None
+
+
+def _read_header(version_dir):
+    with open(os.path.join(version_dir, HEADER_FILE), encoding="utf-8") as f:
+        header = json.load(f)
+    if header.get("format") != HEATMAP_FORMAT or header.get("version") != HEATMAP_FORMAT_VERSION:
+        raise ValueError(f"Artefact de carte de chaleur incompatible : {version_dir}")
+    return header
+
+
+def open_heatmap_artifact(directory=None):
+    """Artefact existant et compatible, ou None (à produire avec `build_heatmap_artifact`)."""
+    try:
+        return HeatmapArtifact(directory)
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ Carte de chaleur indisponible : {e}")
+        return None
+
+
+# === Job hors ligne ===
+if __name__ == "__main__":
+    build_heatmap_artifact()
@@ -0,0 +1,350 @@
+# fichier : app/services/raptor.py
+
+import bisect
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from app.services.columnar_store import read_columns
+from app.services.db_connector import get_connection
+from app.services.graph_builder import GTFS_ROUTE_TYPES, stop_time_seconds
+from app.services.service_calendar import ServiceCalendar
+from app.services.timetable_inputs import build_footpaths, read_optional_table
+
+logger = logging.getLogger(__name__)
+
+INF = float("inf")
+DAY = 86400
+MAX_ROUNDS = 5
+
+
+class RaptorTimetable:
+    """
+    Horaires prétraités pour l'algorithme RAPTOR (Round-bAsed Public Transit Optimized Router).
+
+    Les courses sont regroupées en « motifs » (même ligne, même suite d'arrêts). Pour chaque
+    motif `p` : `pattern_stops[p]` (indices d'arrêts), `arrivals[p]` / `departures[p]`
+    (matrices courses × arrêts, en secondes depuis minuit du jour de service) et
+    `pattern_trips[p]` (indices des courses, triées par heure de départ).
+    """
+
+    def __init__(self, stop_ids, pattern_stops, pattern_trips, arrivals, departures, pattern_routes,
+                 trip_ids, trip_services, route_info, footpaths, calendar):
+        self.stop_ids = stop_ids
+        self.stop_index = {stop_id: i for i, stop_id in enumerate(stop_ids)}
+        self.pattern_stops = pattern_stops
+        self.pattern_trips = pattern_trips
+        self.arrivals = arrivals
+        self.departures = departures
+        self.pattern_routes = pattern_routes
+        self.trip_ids = trip_ids
+        self.trip_services = trip_services
+        self.route_info = route_info
+        self.footpaths = footpaths
+        self.calendar = calendar
+
+        # Motifs desservant chaque arrêt : liste de (motif, position dans le motif)
+        self.stop_patterns = [[] for _ in stop_ids]
+        for p, stops in enumerate(pattern_stops):
+            for pos, s in enumerate(stops):
+                self.stop_patterns[s].append((p, pos))
+
+        # Colonnes de départ triées ? (pas de dépassement entre courses → recherche dichotomique)
+        self.fifo = [bool(np.all(np.diff(dep, axis=0) >= 0)) for dep in departures]
+        self._columns = {}
+
+    # === Construction ===
+    @classmethod
+    def build(cls, stop_times, trips, routes=None, calendar=None, calendar_dates=None, transfers=None):
+        st = stop_times[['trip_id', 'stop_id', 'stop_sequence']].copy()
+        st['trip_id'] = st['trip_id'].astype(str)
+        st['stop_id'] = st['stop_id'].astype(str)
+        arrivals = stop_time_seconds(stop_times, 'arrival')
+        departures = stop_time_seconds(stop_times, 'departure')
+        st['arrival_secs'] = arrivals.fillna(departures).fillna(0).astype('int64')
+        st['departure_secs'] = departures.fillna(arrivals).fillna(0).astype('int64')
+        st = st.sort_values(['trip_id', 'stop_sequence'], kind='stable').reset_index(drop=True)
+
+        stop_ids, stop_codes = np.unique(st['stop_id'].to_numpy(dtype=str), return_inverse=True)
+        st['stop_idx'] = stop_codes.astype(np.int32)
+
+        trips = trips.copy()
+        trips['trip_id'] = trips['trip_id'].astype(str)
+        trips = trips.drop_duplicates('trip_id').set_index('trip_id')
+
+        # Motif = (ligne, suite d'arrêts)
+        signatures = st.groupby('trip_id', sort=False)['stop_idx'].agg(tuple)
+        trip_routes = trips['route_id'].reindex(signatures.index).astype(str)
+        pattern_codes, pattern_keys = pd.factorize(pd.Series(list(zip(trip_routes, signatures)), index=signatures.index))
+        trip_pattern = pd.Series(pattern_codes, index=signatures.index)
+
+        st['pattern'] = st['trip_id'].map(trip_pattern).to_numpy()
+        first_departure = st.groupby('trip_id', sort=False)['departure_secs'].first()
+        st['first_departure'] = st['trip_id'].map(first_departure)
+        st = st.sort_values(['pattern', 'first_departure', 'trip_id', 'stop_sequence'], kind='stable')
+
+        trip_ids = signatures.index.to_numpy(dtype=str)
+        trip_index = {trip_id: i for i, trip_id in enumerate(trip_ids)}
+        services = trips['service_id'].reindex(trip_ids).astype(str)
+        service_ids = sorted(services.unique())
+        service_index = {service_id: i for i, service_id in enumerate(service_ids)}
+        trip_services = services.map(service_index).to_numpy(dtype=np.int32)
+
+        pattern_stops, pattern_trips, arrivals, departures, pattern_routes = [], [], [], [], []
+        arr_all = st['arrival_secs'].to_numpy(dtype=np.int32)
+        dep_all = st['departure_secs'].to_numpy(dtype=np.int32)
+        trip_all = st['trip_id'].to_numpy()
+        bounds = np.flatnonzero(np.diff(st['pattern'].to_numpy(), prepend=-1, append=-1))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            p = len(pattern_stops)
+            route_id, stops = pattern_keys[p]
+            width = len(stops)
+            pattern_stops.append(np.asarray(stops, dtype=np.int32))
+            pattern_routes.append(route_id)
+            arrivals.append(arr_all[start:end].reshape(-1, width))
+            departures.append(dep_all[start:end].reshape(-1, width))
+            pattern_trips.append(np.array([trip_index[t] for t in trip_all[start:end:width]], dtype=np.int32))
+
+        route_info = {}
+        if routes is not None and not routes.empty:
+            for row in routes.drop_duplicates('route_id').itertuples(index=False):
+                route_info[str(row.route_id)] = {
+                    "route_name": getattr(row, "route_short_name", "?"),
+                    "mode": GTFS_ROUTE_TYPES.get(getattr(row, "route_type", None), "Inconnu"),
+                }
+
+        stop_position = {stop_id: i for i, stop_id in enumerate(stop_ids.tolist())}
+        footpaths = build_footpaths(transfers, stop_position)
+
+        calendar = ServiceCalendar(service_ids, calendar, calendar_dates)
+        logger.info(f"🚆 RAPTOR : {len(pattern_stops)} motifs, {len(trip_ids)} courses, {len(stop_ids)} arrêts.")
+        return cls(stop_ids.tolist(), pattern_stops, pattern_trips, arrivals, departures, pattern_routes,
+                   trip_ids.tolist(), trip_services, route_info, footpaths, calendar)
+
+    @classmethod
+    def from_db(cls):
+        """
+        Construit les horaires depuis les tables stop_times, trips, routes, calendar(_dates) et transfers
+        (colonnes utiles lues dans le datalake colonnaire lorsqu'il correspond à la base).
+        """
+        conn = get_connection()
+        try:
+            stop_times = read_columns(
+                conn, "stop_times", ["trip_id", "stop_id", "stop_sequence", "arrival_secs", "departure_secs"])
+            trips = read_columns(conn, "trips", ["trip_id", "route_id", "service_id"])
+            routes = read_columns(conn, "routes", ["route_id", "route_short_name", "route_type"])
+            calendar = read_optional_table(conn, "calendar")
+            calendar_dates = read_optional_table(conn, "calendar_dates")
+            transfers = read_optional_table(conn, "transfers")
+        finally:
+            conn.close()
+        return cls.build(stop_times, trips, routes, calendar, calendar_dates, transfers)
+
+    # === Recherche de course ===
+    def _departure_column(self, p, pos):
+        key = (p, pos)
+        column = self._columns.get(key)
+        if column is None:
+            column = self._columns[key] = self.departures[p][:, pos].tolist()
+        return column
+
+    def earliest_trip(self, p, pos, time, masks):
+        """
+        Première course active du motif `p` partant de la position `pos` à `time` ou après.
+        `masks` : liste de (décalage en secondes, masque des services actifs) — le jour
+        demandé (décalage 0) et la veille (décalage -86400, pour les horaires > 24:00).
+        Retourne (ligne de la course dans le motif, décalage) ou None.
+        """
+        column = self._departure_column(p, pos)
+        trips = self.pattern_trips[p]
+        best = None
+        for offset, mask in masks:
+            target = time - offset
+            if target > column[-1] and self.fifo[p]:
+                continue
+            start = bisect.bisect_left(column, target) if self.fifo[p] else 0
+            for row in range(start, len(column)):
+                if column[row] >= target and mask[self.trip_services[trips[row]]]:
+                    if best is None or column[row] + offset < self.departures[p][best[0], pos] + best[1]:
+                        best = (row, offset)
+                    if self.fifo[p]:
+                        break
+        return best
+
+
+def raptor_query(timetable, origin, destination, departure_dt, max_rounds=MAX_ROUNDS):
+    """
+    Itinéraires au plus tôt de `origin` vers `destination` pour un départ à `departure_dt`.
+
+    Retourne la liste des trajets Pareto-optimaux (arrivée / nombre de correspondances),
+    du plus direct au plus rapide. Chaque trajet est un dict :
+    `departure`, `arrival` (datetime), `transfers`, `legs` (liste d'étapes `trip` ou `walk`).
+    """
+    tt = timetable
+    source, target = tt.stop_index.get(str(origin)), tt.stop_index.get(str(destination))
+    if source is None or target is None:
+        return []
+
+    day = departure_dt.date()
+    midnight = datetime.combine(day, datetime.min.time())
+    t0 = int((departure_dt - midnight).total_seconds())
+    masks = [(0, tt.calendar.mask(day)), (-DAY, tt.calendar.mask(day - timedelta(days=1)))]
+
+    best = {source: t0}
+    taus = [{source: t0}]
+    parents = [{source: None}]
+    marked = {source}
+    for s, duration in tt.footpaths[source]:
+        taus[0][s] = best[s] = t0 + duration
+        parents[0][s] = ("walk", source, duration)
+        marked.add(s)
+
+    for k in range(1, max_rounds + 1):
+        previous = taus[k - 1]
+        tau = dict(previous)
+        parent = {}
+
+        queue = {}
+        for s in marked:
+            for p, pos in tt.stop_patterns[s]:
+                if pos < queue.get(p, INF):
+                    queue[p] = pos
+        marked = set()
+
+        for p, start in queue.items():
+            stops = tt.pattern_stops[p].tolist()
+            arrivals = tt.arrivals[p]
+            departures = tt.departures[p]
+            trip = None
+            for pos in range(start, len(stops)):
+                s = stops[pos]
+                if trip is not None:
+                    row, offset, board = trip
+                    arrival = int(arrivals[row, pos]) + offset
+                    if arrival < min(best.get(s, INF), best.get(target, INF)):
+                        tau[s] = best[s] = arrival
+                        parent[s] = ("trip", p, row, offset, board, pos)
+                        marked.add(s)
+                ready = previous.get(s)
+                if ready is not None and (trip is None or ready <= int(departures[trip[0], pos]) + trip[1]):
+                    found = tt.earliest_trip(p, pos, ready, masks)
+                    if found is not None and (trip is None or
+                                              departures[found[0], pos] + found[1] < departures[trip[0], pos] + trip[1]):
+                        trip = (found[0], found[1], pos)
+
+        # Correspondances à pied depuis les arrêts atteints pendant ce tour
+        for s in list(marked):
+            for s2, duration in tt.footpaths[s]:
+                arrival = tau[s] + duration
+                if arrival < min(best.get(s2, INF), best.get(target, INF)):
+                    tau[s2] = best[s2] = arrival
+                    parent[s2] = ("walk", s, duration)
+                    marked.add(s2)
+
+        taus.append(tau)
+        parents.append(parent)
+        if not marked:
+            break
+
+    journeys = []
+    best_arrival = INF
+    for k in range(len(taus)):
+        arrival = taus[k].get(target, INF)
+        if arrival < best_arrival and parents[k].get(target) is not None:
+            best_arrival = arrival
+            journeys.append(_reconstruct(tt, parents, k, target, midnight, departure_dt))
+    return journeys
+
+
+def _reconstruct(tt, parents, k, target, midnight, departure_dt):
+    legs = []
+    s = target
+    while k >= 0:
+        label = parents[k].get(s)
+        if label is None:
+            if k == 0:
+                break
+            k -= 1
+            continue
+        if label[0] == "walk":
+            _, from_stop, duration = label
+            legs.append({"type": "walk", "from_stop": tt.stop_ids[from_stop], "to_stop": tt.stop_ids[s],
+                         "duration": duration})
+            s = from_stop
+            continue
+        _, p, row, offset, board, alight = label
+        stops = tt.pattern_stops[p].tolist()
+        route = tt.route_info.get(tt.pattern_routes[p], {})
+        legs.append({
+            "type": "trip",
+            "trip_id": tt.trip_ids[tt.pattern_trips[p][row]],
+            "route_id": tt.pattern_routes[p],
+            "route_name": route.get("route_name", "?"),
+            "mode": route.get("mode", "Inconnu"),
+            "from_stop": tt.stop_ids[stops[board]],
+            "to_stop": tt.stop_ids[stops[alight]],
+            "stops": [
+                (tt.stop_ids[stops[pos]],
+                 midnight + timedelta(seconds=int(tt.arrivals[p][row, pos]) + offset),
+                 midnight + timedelta(seconds=int(tt.departures[p][row, pos]) + offset))
+                for pos in range(board, alight + 1)
+            ],
+        })
+        s = stops[board]
+        k -= 1
+    legs.reverse()
+
+    # Les trajets à pied partent dès l'arrivée de l'étape précédente (ou à l'heure demandée)
+    clock = departure_dt
+    for leg in legs:
+        if leg["type"] == "trip":
+            leg["departure"] = leg["stops"][0][2]
+            leg["arrival"] = leg["stops"][-1][1]
+        else:
+            leg["departure"] = clock
+            leg["arrival"] = clock + timedelta(seconds=leg["duration"])
+        clock = leg["arrival"]
+
+    trip_legs = [leg for leg in legs if leg["type"] == "trip"]
+    return {
+        "departure": legs[0]["departure"],
+        "arrival": legs[-1]["arrival"],
+        "transfers": max(len(trip_legs) - 1, 0),
+        "legs": legs,
+    }
+
+
+def journey_to_schedule(journey, stops_dict):
+    """
+    Convertit un trajet RAPTOR au format produit par `estimate_schedule`
+    (une étape par arrêt, pour l'affichage du tableau et de la carte).
+    """
+    schedule = []
+
+    def step(from_stop, to_stop, departure, arrival, route_name, mode):
+        info = stops_dict.get(from_stop, {})
+        schedule.append({
+            "from_stop": from_stop,
+            "to_stop": to_stop,
+            "departure_dt": departure,
+            "arrival_dt": arrival,
+            "duration_min": int((arrival - departure).total_seconds() // 60),
+            "route_name": route_name,
+            "mode": mode,
+            "stop_name": info.get("stop_name", from_stop),
+            "lat": info.get("stop_lat"),
+            "lon": info.get("stop_lon"),
+        })
+
+    for leg in journey["legs"]:
+        if leg["type"] == "walk":
+            step(leg["from_stop"], leg["to_stop"], leg["departure"], leg["arrival"], "Transfert", "Correspondance")
+            continue
+        for (stop, _, departure), (next_stop, arrival, _) in zip(leg["stops"][:-1], leg["stops"][1:]):
+            step(stop, next_stop, departure, arrival, leg["route_name"], leg["mode"])
+
+    last_stop = journey["legs"][-1]["to_stop"]
+    step(last_stop, None, journey["arrival"], journey["arrival"], "", "")
+    return schedule
@@ -1,7 +1,11 @@
 # fichier : app/services/route_finder.py (mise à jour avec intégration IA + CO2)
 
-import networkx as nx
 import heapq
+import weakref
+
+import numpy as np
+
+from app.services.transit_graph import TransitGraph
 
 # Coûts d'émission CO2 par mode de transport (en g/km estimés)
 CO2_PER_KM = {
@@ -14,33 +18,329 @@ CO2_PER_KM = {
     "Correspondance": 0  # pas de transport effectif
 }
 
-# Fonction de dijkstra pondérée par CO2
+INF = float("inf")
+EARTH_RADIUS_M = 6_371_000
+# Temps minimal (s) d'une arête dans le modèle de coût : les horaires GTFS sont à la minute, deux
+# arrêts desservis au même horaire donnent une arête de poids nul, qui rendrait la vitesse maximale
+# du réseau infinie (heuristique A* nulle). Toutes les recherches (et la CH) utilisent ce plancher.
+MIN_EDGE_SECONDS = 30
+
+# Coûts d'arêtes précalculés par graphe compact et par couple (alpha, beta)
+_edge_cost_cache = weakref.WeakKeyDictionary()
+_max_speed_cache = weakref.WeakKeyDictionary()
+
+
+def edge_costs(G, alpha=1.0, beta=0.02):
+    """Coût alpha * temps + beta * CO2 de chaque arête d'un `TransitGraph` (tableau aligné sur `G.targets`)."""
+    per_graph = _edge_cost_cache.setdefault(G, {})
+    key = (alpha, beta)
+    if key not in per_graph:
+        co2_by_code = np.array([CO2_PER_KM.get(mode, 100) * 0.3 for mode in G.modes], dtype=np.float64)
+        per_graph[key] = alpha * edge_seconds(G.weights) + beta * co2_by_code[G.mode_codes]
+    return per_graph[key]
+
+
+def edge_seconds(weights):
+    """Temps d'arête (tableau de poids) utilisé par le modèle de coût, planché à MIN_EDGE_SECONDS."""
+    return np.maximum(np.asarray(weights, dtype=np.float64), MIN_EDGE_SECONDS)
+
+
+def edge_cost(edge, alpha=1.0, beta=0.02):
+    """Coût d'une arête networkx (dict d'attributs) selon le même modèle temps / CO2."""
+    time_weight = max(edge.get("weight", 60), MIN_EDGE_SECONDS)
+    co2_factor = CO2_PER_KM.get(edge.get("mode", "Bus"), 100)
+    co2_weight = co2_factor * 0.3  # valeur fixe estimée car pas de distance réelle
+    return alpha * time_weight + beta * co2_weight
 
-def find_best_path(G, start, end, alpha=1.0, beta=0.02):
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Distance orthodromique en mètres (scalaires ou tableaux NumPy)."""
+    lat1, lon1, lat2, lon2 = (np.radians(x) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def estimate_max_speed(G, coords=None):
     """
-    alpha : poids du temps
-    beta : poids de l'empreinte carbone
+    Vitesse maximale (m/s) observée sur le réseau : max(distance / temps) sur les arêtes
+    dont les deux extrémités sont géolocalisées, le temps étant celui du modèle de coût (planché
+    à MIN_EDGE_SECONDS). Divisée par cette vitesse, la distance à vol d'oiseau minore le temps
+    restant (heuristique A* admissible), y compris en présence d'arêtes de poids nul.
+    """
+    if isinstance(G, TransitGraph):
+        if G in _max_speed_cache:
+            return _max_speed_cache[G]
+        distances = haversine_m(G.lats[G.sources], G.lons[G.sources], G.lats[G.targets], G.lons[G.targets])
+        located = np.isfinite(distances) & (distances > 0)
+        speed = float(np.max(distances[located] / edge_seconds(G.weights[located]))) if located.any() else 0.0
+        _max_speed_cache[G] = speed
+        return speed
+
+    speed = 0.0
+    for u, v, data in G.edges(data=True):
+        if u not in coords or v not in coords:
+            continue
+        distance = float(haversine_m(*coords[u], *coords[v]))
+        if distance <= 0:
+            continue
+        speed = max(speed, distance / max(data.get("weight", 60), MIN_EDGE_SECONDS))
+    return speed
+
+
+class CostOverlay:
+    """
+    Pénalités appliquées à la volée sur un graphe partagé, sans le copier ni le modifier.
+
+    stop_factors : {stop_id: multiplicateur} pour les arêtes qui touchent l'arrêt
+    edge_factors : {(from_stop, to_stop): multiplicateur} pour une arête précise
+    Le multiplicateur porte sur le temps de l'arête (`weight`) ; une arête reçoit le plus fort
+    facteur de ses deux arrêts, multiplié par son propre facteur. Les facteurs doivent être >= 1
+    pour que l'heuristique A* reste admissible.
     """
-    queue = [(0, start, [])]
-    visited = set()
+
+    def __init__(self, stop_factors=None, edge_factors=None):
+        self.stop_factors = {str(s): float(f) for s, f in (stop_factors or {}).items()}
+        self.edge_factors = {(str(u), str(v)): float(f) for (u, v), f in (edge_factors or {}).items()}
+        if any(f < 1 for f in [*self.stop_factors.values(), *self.edge_factors.values()]):
+            raise ValueError("Les multiplicateurs de coût doivent être >= 1")
+
+    @classmethod
+    def from_stops(cls, stop_ids, factor=2.0):
+        return cls(stop_factors={stop_id: factor for stop_id in stop_ids})
+
+    def __bool__(self):
+        return bool(self.stop_factors or self.edge_factors)
+
+    def surcharges(self, G, alpha=1.0):
+        """
+        Surcoût alpha * temps * (facteur - 1) par arête pénalisée (temps du modèle de coût), indexé comme les nœuds de `G`.
+        Le calcul ne parcourt que les arêtes des arrêts pénalisés.
+        """
+        factors = {}
+        if isinstance(G, TransitGraph):
+            rev_offsets, rev_sources, rev_positions = G.reverse_adjacency
+            for stop_id, factor in self.stop_factors.items():
+                i = G.index_of(stop_id)
+                if i is None:
+                    continue
+                start, end = G.edge_range(i)
+                for pos in range(start, end):
+                    key = (i, int(G.targets[pos]), pos)
+                    factors[key] = max(factors.get(key, 1.0), factor)
+                for k in range(rev_offsets[i], rev_offsets[i + 1]):
+                    key = (int(rev_sources[k]), i, int(rev_positions[k]))
+                    factors[key] = max(factors.get(key, 1.0), factor)
+            for (u, v), factor in self.edge_factors.items():
+                i, j = G.index_of(u), G.index_of(v)
+                pos = G.find_edge(i, j) if i is not None and j is not None else -1
+                if pos >= 0:
+                    factors[(i, j, pos)] = factors.get((i, j, pos), 1.0) * factor
+            return {(i, j): alpha * max(float(G.weights[pos]), MIN_EDGE_SECONDS) * (f - 1)
+                    for (i, j, pos), f in factors.items()}
+
+        for stop_id, factor in self.stop_factors.items():
+            if stop_id not in G:
+                continue
+            for edge in [*G.out_edges(stop_id), *G.in_edges(stop_id)]:
+                factors[edge] = max(factors.get(edge, 1.0), factor)
+        for edge, factor in self.edge_factors.items():
+            if G.has_edge(*edge):
+                factors[edge] = factors.get(edge, 1.0) * factor
+        return {(u, v): alpha * max(G[u][v].get("weight", 60), MIN_EDGE_SECONDS) * (f - 1)
+                for (u, v), f in factors.items()}
+
+
+def _with_overlay(neighbors, surcharges, reverse=False):
+    """Ajoute les surcoûts de l'overlay aux arêtes concernées uniquement."""
+    if not surcharges:
+        return neighbors
+    if reverse:
+        return lambda n: [(m, cost + surcharges.get((m, n), 0.0)) for m, cost in neighbors(n)]
+    return lambda n: [(m, cost + surcharges.get((n, m), 0.0)) for m, cost in neighbors(n)]
+
+
+def _adjacency(G, alpha, beta, reverse=False, overlay=None):
+    """
+    Fonction `voisins(n) -> [(voisin, coût)]` (arêtes sortantes, ou entrantes si `reverse`).
+    Les nœuds sont des indices pour un `TransitGraph`, des identifiants d'arrêts sinon.
+    Un `CostOverlay` éventuel est appliqué à la volée, sans toucher aux coûts partagés.
+    """
+    if overlay:
+        return _with_overlay(_adjacency(G, alpha, beta, reverse), overlay.surcharges(G, alpha), reverse)
+
+    if isinstance(G, TransitGraph):
+        costs = edge_costs(G, alpha, beta)
+        if reverse:
+            offsets, nodes, positions = G.reverse_adjacency
+
+            def neighbors(n):
+                a, b = offsets[n], offsets[n + 1]
+                return zip(nodes[a:b].tolist(), costs[positions[a:b]].tolist())
+        else:
+            offsets, nodes = G.offsets, G.targets
+
+            def neighbors(n):
+                a, b = offsets[n], offsets[n + 1]
+                return zip(nodes[a:b].tolist(), costs[a:b].tolist())
+        return neighbors
+
+    if reverse:
+        return lambda n: ((u, edge_cost(G[u][n], alpha, beta)) for u in G.predecessors(n))
+    return lambda n: ((v, edge_cost(G[n][v], alpha, beta)) for v in G.successors(n))
+
+
+def _heuristic(G, target, alpha, coords, max_speed):
+    """Minorant alpha * distance(n, cible) / vitesse max (0 si coordonnées ou vitesse inconnues)."""
+    if not max_speed or max_speed == INF:
+        return lambda n: 0.0
+    if isinstance(G, TransitGraph):
+        target_lat, target_lon = G.lats[target], G.lons[target]
+        if not np.isfinite(target_lat):
+            return lambda n: 0.0
+        bound = alpha * np.nan_to_num(haversine_m(G.lats, G.lons, target_lat, target_lon)) / max_speed
+        bound = bound.tolist()
+        return lambda n: bound[n]
+
+    if not coords or target not in coords:
+        return lambda n: 0.0
+    target_lat, target_lon = coords[target]
+
+    def h(n):
+        if n not in coords:
+            return 0.0
+        return alpha * float(haversine_m(coords[n][0], coords[n][1], target_lat, target_lon)) / max_speed
+    return h
+
+
+def _unwind(parent, node):
+    path = []
+    while node is not None:
+        path.append(node)
+        node = parent[node]
+    return path[::-1]
+
+
+def _search(neighbors, source, target, h):
+    """Dijkstra (h nulle) ou A* (h consistante), avec carte des prédécesseurs."""
+    dist = {source: 0.0}
+    parent = {source: None}
+    queue = [(h(source), 0.0, source)]
+    closed = set()
 
     while queue:
-        cost, node, path = heapq.heappop(queue)
-        if node in visited:
+        _, cost, node = heapq.heappop(queue)
+        if node in closed:
+            continue
+        closed.add(node)
+
+        if node == target:
+            return _unwind(parent, node), cost
+
+        for neighbor, step in neighbors(node):
+            new_cost = cost + step
+            if new_cost < dist.get(neighbor, INF):
+                dist[neighbor] = new_cost
+                parent[neighbor] = node
+                heapq.heappush(queue, (new_cost + h(neighbor), new_cost, neighbor))
+
+    return None, INF
+
+
+def _bidirectional_search(forward, backward, source, target):
+    """Dijkstra bidirectionnel : arrêt dès que min(avant) + min(arrière) >= meilleur coût connu."""
+    if source == target:
+        return [source], 0.0
+
+    dists = ({source: 0.0}, {target: 0.0})
+    parents = ({source: None}, {target: None})
+    queues = ([(0.0, source)], [(0.0, target)])
+    closed = (set(), set())
+    neighbors = (forward, backward)
+    best, meeting = INF, None
+
+    while queues[0] and queues[1]:
+        if queues[0][0][0] + queues[1][0][0] >= best:
+            break
+        side = 0 if queues[0][0][0] <= queues[1][0][0] else 1
+        cost, node = heapq.heappop(queues[side])
+        if node in closed[side]:
             continue
-        visited.add(node)
-        path = path + [node]
-
-        if node == end:
-            return path
-
-        for neighbor in G.successors(node):
-            edge = G[node][neighbor]
-            time_weight = edge.get("weight", 60)
-            mode = edge.get("mode", "Bus")
-            co2_factor = CO2_PER_KM.get(mode, 100)
-            co2_weight = co2_factor * 0.3  # valeur fixe estimée car pas de distance réelle
-            new_cost = cost + alpha * time_weight + beta * co2_weight
-            heapq.heappush(queue, (new_cost, neighbor, path))
-
-    return None
\ No newline at end of file
+        closed[side].add(node)
+
+        dist, other = dists[side], dists[1 - side]
+        for neighbor, step in neighbors[side](node):
+            new_cost = cost + step
+            if new_cost < dist.get(neighbor, INF):
+                dist[neighbor] = new_cost
+                parents[side][neighbor] = node
+                heapq.heappush(queues[side], (new_cost, neighbor))
+            if neighbor in other and new_cost + other[neighbor] < best:
+                best, meeting = new_cost + other[neighbor], neighbor
+
+    if meeting is None:
+        return None, INF
+    path = _unwind(parents[0], meeting)
+    node = parents[1][meeting]
+    while node is not None:
+        path.append(node)
+        node = parents[1][node]
+    return path, best
+
+
+def find_best_path_with_cost(G, start, end, alpha=1.0, beta=0.02, method="dijkstra", coords=None, max_speed=None,
+                             hierarchy=None, overlay=None):
+    """
+    Comme `find_best_path`, mais retourne `(chemin, coût)` ; `(None, inf)` si aucun chemin.
+    """
+    if method == "ch":
+        if overlay:
+            raise ValueError("La méthode 'ch' ne prend pas en charge les pénalités (overlay)")
+        if hierarchy is None or (hierarchy.alpha, hierarchy.beta) != (alpha, beta):
+            raise ValueError("La méthode 'ch' requiert une hiérarchie construite pour les mêmes alpha et beta")
+        return hierarchy.query(start, end)
+
+    if isinstance(G, TransitGraph):
+        source, target = G.index_of(start), G.index_of(end)
+        if source is None or target is None:
+            return None, INF
+    else:
+        if start not in G or end not in G:
+            return None, INF
+        source, target = start, end
+
+    if method == "bidirectional":
+        surcharges = overlay.surcharges(G, alpha) if overlay else None
+        path, cost = _bidirectional_search(
+            _with_overlay(_adjacency(G, alpha, beta), surcharges),
+            _with_overlay(_adjacency(G, alpha, beta, reverse=True), surcharges, reverse=True), source, target)
+    elif method == "astar":
+        if max_speed is None:
+            max_speed = estimate_max_speed(G, coords)
+        path, cost = _search(_adjacency(G, alpha, beta, overlay=overlay), source, target,
+                             _heuristic(G, target, alpha, coords, max_speed))
+    elif method == "dijkstra":
+        path, cost = _search(_adjacency(G, alpha, beta, overlay=overlay), source, target, lambda n: 0.0)
+    else:
+        raise ValueError(f"Méthode de recherche inconnue : {method}")
+
+    if path is not None and isinstance(G, TransitGraph):
+        path = [str(G.stop_ids[i]) for i in path]
+    return path, cost
+
+
+def find_best_path(G, start, end, alpha=1.0, beta=0.02, method="dijkstra", coords=None, max_speed=None,
+                   hierarchy=None, overlay=None):
+    """
+    alpha : poids du temps
+    beta : poids de l'empreinte carbone
+    method : "dijkstra", "astar" (heuristique géographique), "bidirectional"
+             ou "ch" (hiérarchie de contraction précalculée, cf. `contraction.py`)
+    coords : {stop_id: (lat, lon)} pour A* sur un `networkx.DiGraph`
+             (un `TransitGraph` porte ses propres coordonnées)
+    max_speed : vitesse maximale du réseau en m/s (estimée depuis le graphe par défaut)
+    hierarchy : `ContractionHierarchy` utilisée par la méthode "ch"
+    overlay : `CostOverlay` de pénalités (ex. arrêts congestionnés), appliqué sans modifier `G`
+    Accepte un `networkx.DiGraph` ou un `TransitGraph` compact.
+    """
+    path, _ = find_best_path_with_cost(G, start, end, alpha, beta, method, coords, max_speed, hierarchy, overlay)
+    return path
@@ -1,75 +1,92 @@
 from datetime import timedelta
 import pandas as pd
 
-from app.services.db_connector import get_connection
-
-
-
-def estimate_schedule(path, departure_dt, stop_times, trips, routes, G):
+from app.services.db_connector import connection
+
+# Passage d'une course de `from_stop` à l'arrêt suivant `to_stop` : parcours d'intervalle sur
+# l'index (stop_id, departure_secs), arrêt suivant retrouvé par la clé (trip_id, stop_sequence)
+NEXT_HOP_SQL = """
+    SELECT a.departure_secs, b.arrival_secs, r.route_short_name, r.route_type
+    FROM stop_times a
+    JOIN stop_times b ON b.trip_id = a.trip_id AND b.stop_sequence = (
+        SELECT MIN(n.stop_sequence) FROM stop_times n
+        WHERE n.trip_id = a.trip_id AND n.stop_sequence > a.stop_sequence
+    )
+    LEFT JOIN trips t ON t.trip_id = a.trip_id
+    LEFT JOIN routes r ON r.route_id = t.route_id
+    WHERE a.stop_id = ? AND a.departure_secs >= ? AND b.stop_id = ?
+    ORDER BY a.departure_secs
+    LIMIT 1
+"""
+
+
+def _next_hop(conn, from_stop, to_stop, time_secs):
+    """Premier passage de `from_stop` vers `to_stop` à partir de `time_secs` (sinon le premier de la journée)."""
+    row = conn.execute(NEXT_HOP_SQL, (from_stop, time_secs, to_stop)).fetchone()
+    if row is None and time_secs > 0:
+        row = conn.execute(NEXT_HOP_SQL, (from_stop, 0, to_stop)).fetchone()
+    return row
+
+
+def estimate_schedule(path, departure_dt, G):
+    """
+    Horaire estimé le long d'un chemin du graphe : durée de chaque tronçon lue sur le prochain
+    passage correspondant dans stop_times (requête indexée par tronçon, sans charger les tables).
+    """
     schedule = []
     current_time = departure_dt
 
-    # === Chargement des infos stations ===
-    conn = get_connection()
-    stops = pd.read_sql("SELECT stop_id, stop_name, stop_lat, stop_lon FROM stops", conn)
-    conn.close()
-    stops_dict = stops.set_index("stop_id").to_dict("index")
-
-    # === Préparation des horaires ===
-    trip_lookup = stop_times.copy()
-    trip_lookup['next_stop_id'] = trip_lookup.groupby('trip_id')['stop_id'].shift(-1)
-    trip_lookup['next_arrival_time'] = trip_lookup.groupby('trip_id')['arrival_time'].shift(-1)
-    trip_lookup = trip_lookup.dropna(subset=['next_stop_id'])
-
-    trip_lookup = trip_lookup.merge(trips[['trip_id', 'route_id']], on='trip_id', how='left')
-    trip_lookup = trip_lookup.merge(routes[['route_id', 'route_short_name', 'route_type']], on='route_id', how='left')
-
-    for i in range(len(path) - 1):
-        from_stop = path[i]
-        to_stop = path[i + 1]
-
-        edge_data = G.get_edge_data(from_stop, to_stop) if G else {}
-        is_transfer = edge_data.get("mode") == "Correspondance"
-        transfer_time = edge_data.get("transfer_time", 300) if is_transfer else None
-
-        if is_transfer:
-            duration_sec = max(transfer_time, 60)
-            route_name = "Transfert"
-            mode = "Correspondance"
-        else:
-            match = trip_lookup[(trip_lookup['stop_id'] == from_stop) & (trip_lookup['next_stop_id'] == to_stop)]
-            if match.empty:
-                continue
-            row = match.iloc[0]
-
-            try:
-                duration_sec = max(
-                    pd.to_timedelta(row['next_arrival_time']).total_seconds() -
-                    pd.to_timedelta(row['departure_time']).total_seconds(), 60)
-            except Exception:
-                duration_sec = 120
-
-            route_name = row.get("route_short_name", "?")
-            mode = route_type_label(row.get("route_type"))
-
-        stop_name = stops_dict.get(from_stop, {}).get("stop_name", from_stop)
-        lat = stops_dict.get(from_stop, {}).get("stop_lat", None)
-        lon = stops_dict.get(from_stop, {}).get("stop_lon", None)
-
-        schedule.append({
-            "from_stop": from_stop,
-            "to_stop": to_stop,
-            "departure_dt": current_time,
-            "arrival_dt": current_time + timedelta(seconds=duration_sec),
-            "duration_min": int(duration_sec // 60),
-            "route_name": route_name,
-            "mode": mode,
-            "stop_name": stop_name,
-            "lat": lat,
-            "lon": lon,
-        })
-
-        current_time += timedelta(seconds=duration_sec)
+    with connection() as conn:
+        # === Infos des seules stations du chemin ===
+        placeholders = ", ".join("?" * len(set(path)))
+        stops = pd.read_sql(
+            f"SELECT stop_id, stop_name, stop_lat, stop_lon FROM stops WHERE stop_id IN ({placeholders})",
+            conn, params=list(set(path)))
+        stops_dict = stops.drop_duplicates("stop_id").set_index("stop_id").to_dict("index")
+
+        for i in range(len(path) - 1):
+            from_stop = path[i]
+            to_stop = path[i + 1]
+
+            edge_data = G.get_edge_data(from_stop, to_stop) if G else {}
+            is_transfer = edge_data.get("mode") == "Correspondance"
+            transfer_time = edge_data.get("transfer_time", 300) if is_transfer else None
+
+            if is_transfer:
+                duration_sec = max(transfer_time, 60)
+                route_name = "Transfert"
+                mode = "Correspondance"
+            else:
+                midnight = current_time.replace(hour=0, minute=0, second=0, microsecond=0)
+                row = _next_hop(conn, from_stop, to_stop, int((current_time - midnight).total_seconds()))
+                if row is None:
+                    continue
+                departure_secs, arrival_secs, route_name, route_type = row
+
+                duration_sec = None if departure_secs is None or arrival_secs is None else arrival_secs - departure_secs
+                duration_sec = 120 if duration_sec is None else max(float(duration_sec), 60)
+
+                route_name = "?" if route_name is None else route_name
+                mode = route_type_label(route_type)
+
+            stop_name = stops_dict.get(from_stop, {}).get("stop_name", from_stop)
+            lat = stops_dict.get(from_stop, {}).get("stop_lat", None)
+            lon = stops_dict.get(from_stop, {}).get("stop_lon", None)
+
+            schedule.append({
+                "from_stop": from_stop,
+                "to_stop": to_stop,
+                "departure_dt": current_time,
+                "arrival_dt": current_time + timedelta(seconds=duration_sec),
+                "duration_min": int(duration_sec // 60),
+                "route_name": route_name,
+                "mode": mode,
+                "stop_name": stop_name,
+                "lat": lat,
+                "lon": lon,
+            })
+
+            current_time += timedelta(seconds=duration_sec)
 
     # === Dernier arrêt ===
     last_stop = path[-1]
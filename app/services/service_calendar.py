@@ -0,0 +1,100 @@
+# fichier : app/services/service_calendar.py
+
+import numpy as np
+import pandas as pd
+
+WEEKDAY_COLUMNS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+
+class ServiceCalendar:
+    """
+    Jours de circulation des services GTFS (calendar + calendar_dates).
+
+    `mask(day)` retourne un tableau booléen aligné sur `service_ids` indiquant les
+    services actifs ce jour-là ; le résultat est mis en cache par date.
+    """
+
+    def __init__(self, service_ids, calendar=None, calendar_dates=None):
+        self.service_ids = list(service_ids)
+        self.service_index = {service_id: i for i, service_id in enumerate(self.service_ids)}
+        self.calendar = calendar if calendar is not None else pd.DataFrame()
+        self.calendar_dates = calendar_dates if calendar_dates is not None else pd.DataFrame()
+        self._masks = {}
+
+    def active_service_ids(self, day):
+        ymd = int(day.strftime("%Y%m%d"))
+        active = set()
+
+        calendar = self.calendar
+        if not calendar.empty:
+            weekday = WEEKDAY_COLUMNS[day.weekday()]
+            running = (
+                (pd.to_numeric(calendar[weekday], errors="coerce") == 1)
+                & (pd.to_numeric(calendar["start_date"], errors="coerce") <= ymd)
+                & (pd.to_numeric(calendar["end_date"], errors="coerce") >= ymd)
+            )
+            active.update(calendar.loc[running, "service_id"].astype(str))
+
+        exceptions = self.calendar_dates
+        if not exceptions.empty:
+            today = exceptions[pd.to_numeric(exceptions["date"], errors="coerce") == ymd]
+            exception_type = pd.to_numeric(today["exception_type"], errors="coerce")
+            active.update(today.loc[exception_type == 1, "service_id"].astype(str))
+            active.difference_update(today.loc[exception_type == 2, "service_id"].astype(str))
+
+        return active
+
+    def mask(self, day):
+        if day not in self._masks:
+            mask = np.zeros(len(self.service_ids), dtype=bool)
+            for service_id in self.active_service_ids(day):
+                i = self.service_index.get(service_id)
+                if i is not None:
+                    mask[i] = True
+            self._masks[day] = mask
+        return self._masks[day]
+
+
+# === Types de jour (agrégats de trafic) ===
+DAY_TYPES = ("weekday", "saturday", "sunday")
+# Tous les passages, quel que soit le service (comptage historique de `stop_times`)
+ALL_DAYS = "all"
+
+
+def day_type_of(day):
+    """Type de jour d'une date : "weekday", "saturday" ou "sunday"."""
+    return {5: "saturday", 6: "sunday"}.get(day.weekday(), "weekday")
+
+
+def service_weekdays(calendar=None, calendar_dates=None):
+    """
+    Jours de semaine (0 = lundi … 6 = dimanche) où circule chaque service : DataFrame (service_id, weekday).
+    Les services définis uniquement par calendar_dates sont classés d'après les jours de leurs ajouts.
+    """
+    frames = []
+    if calendar is not None and not calendar.empty:
+        for weekday, column in enumerate(WEEKDAY_COLUMNS):
+            running = pd.to_numeric(calendar[column], errors="coerce") == 1
+            frames.append(pd.DataFrame({"service_id": calendar.loc[running, "service_id"].astype(str),
+                                        "weekday": weekday}))
+
+    if calendar_dates is not None and not calendar_dates.empty:
+        added = calendar_dates[pd.to_numeric(calendar_dates["exception_type"], errors="coerce") == 1]
+        dates = pd.to_datetime(added["date"].astype(str), format="%Y%m%d", errors="coerce")
+        frames.append(pd.DataFrame({"service_id": added["service_id"].astype(str),
+                                    "weekday": dates.dt.weekday})[dates.notna()])
+
+    if not frames:
+        return pd.DataFrame({"service_id": pd.Series(dtype=str), "weekday": pd.Series(dtype=np.int64)})
+    weekdays = pd.concat(frames, ignore_index=True).drop_duplicates()
+    return weekdays.astype({"weekday": np.int64})
+
+
+def service_day_types(calendar=None, calendar_dates=None):
+    """
+    Types de jour où circule chaque service : DataFrame (service_id, day_type).
+    Un service peut apparaître pour plusieurs types (cf. `service_weekdays`).
+    """
+    weekdays = service_weekdays(calendar, calendar_dates)
+    day_types = np.select([weekdays["weekday"] == 5, weekdays["weekday"] == 6], ["saturday", "sunday"], "weekday")
+    return pd.DataFrame({"service_id": weekdays["service_id"], "day_type": day_types}).drop_duplicates()
@@ -39,8 +39,13 @@ else:
     routes = pd.read_sql_query("SELECT * FROM routes", conn)
     conn.close()
 
-    stop_times['arrival_time'] = stop_times['arrival_time'].fillna("00:00:00").apply(time_to_seconds)
-    stop_times['departure_time'] = stop_times['departure_time'].fillna("00:00:00").apply(time_to_seconds)
+    if 'departure_secs' in stop_times.columns:
+        # Secondes calculées à l'ingestion (db_initializer)
+        stop_times['arrival_time'] = stop_times['arrival_secs'].fillna(0)
+        stop_times['departure_time'] = stop_times['departure_secs'].fillna(0)
+    else:
+        stop_times['arrival_time'] = stop_times['arrival_time'].fillna("00:00:00").apply(time_to_seconds)
+        stop_times['departure_time'] = stop_times['departure_time'].fillna("00:00:00").apply(time_to_seconds)
     stop_times = stop_times.sort_values(by=['trip_id', 'stop_sequence'])
     stop_times['next_stop_id'] = stop_times.groupby('trip_id')['stop_id'].shift(-1)
     stop_times['next_arrival_time'] = stop_times.groupby('trip_id')['arrival_time'].shift(-1)
@@ -0,0 +1,36 @@
+# fichier : app/services/timetable_inputs.py
+
+import sqlite3
+
+import pandas as pd
+
+from app.services.graph_builder import DEFAULT_TRANSFER_TIME
+
+
+# === Entrées communes aux horaires RAPTOR et CSA ===
+def read_optional_table(conn, table):
+    """Contenu de `table`, ou DataFrame vide si la base ne la contient pas (tables GTFS facultatives)."""
+    try:
+        return pd.read_sql(f"SELECT * FROM {table}", conn)
+    except (sqlite3.Error, pd.errors.DatabaseError):
+        return pd.DataFrame()
+
+
+def build_footpaths(transfers, stop_position):
+    """
+    Correspondances à pied issues de transfers.txt : liste indexée par arrêt de départ de couples
+    (arrêt d'arrivée, durée en secondes). `stop_position` associe chaque stop_id à son indice ;
+    les arrêts inconnus et les boucles sont ignorés.
+    """
+    footpaths = [[] for _ in stop_position]
+    if transfers is None or transfers.empty:
+        return footpaths
+    if 'min_transfer_time' in transfers.columns:
+        durations = pd.to_numeric(transfers['min_transfer_time'], errors='coerce').fillna(DEFAULT_TRANSFER_TIME)
+    else:
+        durations = pd.Series(DEFAULT_TRANSFER_TIME, index=transfers.index)
+    for a, b, d in zip(transfers['from_stop_id'].astype(str), transfers['to_stop_id'].astype(str), durations):
+        i, j = stop_position.get(a), stop_position.get(b)
+        if i is not None and j is not None and i != j:
+            footpaths[i].append((j, int(d)))
+    return footpaths
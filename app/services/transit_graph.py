@@ -0,0 +1,337 @@
+# fichier : app/services/transit_graph.py
+
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+# === Format disque : un fichier .npy par tableau + un en-tête JSON versionné ===
+GRAPH_FORMAT = "urbanmobidf-transit-graph"
+GRAPH_FORMAT_VERSION = 2
+HEADER_FILE = "header.json"
+# Chaque enregistrement crée une version (sous-répertoire) ; CURRENT désigne celle en service
+CURRENT_FILE = "CURRENT"
+VERSION_PREFIX = "v-"
+ARRAY_NAMES = ("stop_ids", "offsets", "targets", "weights", "line_codes", "mode_codes", "transfer_times",
+               "lats", "lons")
+
+
+class TransitGraph:
+    """
+    Graphe de transport compact au format CSR (Compressed Sparse Row).
+
+    Les arrêts sont indexés par des entiers ; les arêtes sortantes de l'arrêt `i`
+    occupent la plage `offsets[i]:offsets[i + 1]` des tableaux `targets`, `weights`,
+    `line_codes`, `mode_codes` et `transfer_times`. Les noms de lignes et de modes
+    sont internés dans de petites tables (`lines`, `modes`).
+
+    L'interface reprend le sous-ensemble de `networkx.DiGraph` utilisé par l'application
+    (`successors`, `get_edge_data`, `G[u][v]`, `in G.nodes`).
+    """
+
+    NO_TRANSFER = -1
+
+    def __init__(self, stop_ids, offsets, targets, weights, line_codes, mode_codes, transfer_times, lines, modes,
+                 lats=None, lons=None):
+        self.stop_ids = stop_ids
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self.line_codes = line_codes
+        self.mode_codes = mode_codes
+        self.transfer_times = transfer_times
+        self.lines = list(lines)
+        self.modes = list(modes)
+        # Coordonnées des arrêts (NaN si inconnues), utilisées par l'heuristique A*
+        self.lats = lats if lats is not None else np.full(len(stop_ids), np.nan, dtype=np.float32)
+        self.lons = lons if lons is not None else np.full(len(stop_ids), np.nan, dtype=np.float32)
+        self._index = None
+        self._sources = None
+        self._reverse = None
+
+    # === Construction ===
+    @classmethod
+    def from_edges(cls, edges, stops=None):
+        """
+        Construit le graphe depuis un DataFrame d'arêtes (une ligne par couple d'arrêts) :
+        colonnes `from_stop`, `to_stop`, `weight`, `line`, `mode` et optionnellement `transfer_time`.
+        `stops` (optionnel) fournit `stop_id`, `stop_lat`, `stop_lon` pour les coordonnées.
+        """
+        from_stops = edges['from_stop'].astype(str).to_numpy(dtype=str)
+        to_stops = edges['to_stop'].astype(str).to_numpy(dtype=str)
+        stop_ids = np.unique(np.concatenate([from_stops, to_stops]))
+        sources = np.searchsorted(stop_ids, from_stops)
+        targets = np.searchsorted(stop_ids, to_stops)
+
+        order = np.lexsort((targets, sources))
+        sources, targets = sources[order], targets[order]
+        counts = np.bincount(sources, minlength=len(stop_ids))
+        offsets = np.zeros(len(stop_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        lines, line_codes = np.unique(edges['line'].astype(str).to_numpy(), return_inverse=True)
+        modes, mode_codes = np.unique(edges['mode'].astype(str).to_numpy(), return_inverse=True)
+
+        if 'transfer_time' in edges.columns:
+            transfer_times = edges['transfer_time'].fillna(cls.NO_TRANSFER).to_numpy()
+        else:
+            transfer_times = np.full(len(edges), cls.NO_TRANSFER)
+
+        lats = np.full(len(stop_ids), np.nan, dtype=np.float32)
+        lons = np.full(len(stop_ids), np.nan, dtype=np.float32)
+        if stops is not None and {'stop_lat', 'stop_lon'} <= set(stops.columns):
+            coords = stops.assign(stop_id=stops['stop_id'].astype(str)).drop_duplicates('stop_id').set_index('stop_id')
+            coords = coords.reindex(stop_ids)
+            lats = coords['stop_lat'].astype(np.float32).to_numpy()
+            lons = coords['stop_lon'].astype(np.float32).to_numpy()
+
+        return cls(
+            stop_ids=stop_ids,
+            offsets=offsets,
+            targets=targets.astype(np.int32),
+            weights=edges['weight'].to_numpy()[order].astype(np.int32),
+            line_codes=line_codes[order].astype(np.int16 if len(lines) < 2 ** 15 else np.int32),
+            mode_codes=mode_codes[order].astype(np.int8),
+            transfer_times=transfer_times[order].astype(np.int32),
+            lines=lines.tolist(),
+            modes=modes.tolist(),
+            lats=lats,
+            lons=lons,
+        )
+
+    @classmethod
+    def from_networkx(cls, G, stops=None):
+        """Convertit un `networkx.DiGraph` existant (ex. ancien graphe picklé)."""
+        import pandas as pd
+
+        edges = pd.DataFrame(
+            [(u, v, d.get("weight", 60), d.get("line", "??"), d.get("mode", "??"), d.get("transfer_time"))
+             for u, v, d in G.edges(data=True)],
+            columns=['from_stop', 'to_stop', 'weight', 'line', 'mode', 'transfer_time'],
+        )
+        return cls.from_edges(edges, stops=stops)
+
+    # === Accès par indices ===
+    @property
+    def index(self):
+        """Dictionnaire stop_id -> indice (construit à la première utilisation)."""
+        if self._index is None:
+            self._index = {stop_id: i for i, stop_id in enumerate(self.stop_ids.tolist())}
+        return self._index
+
+    @property
+    def sources(self):
+        """Indice de l'arrêt de départ de chaque arête."""
+        if self._sources is None:
+            self._sources = np.repeat(np.arange(self.number_of_nodes(), dtype=np.int32), np.diff(self.offsets))
+        return self._sources
+
+    @property
+    def reverse_adjacency(self):
+        """
+        Arêtes entrantes au format CSR : `(offsets, sources, positions)` où `positions`
+        renvoie à l'arête d'origine dans les tableaux directs (poids, modes...).
+        """
+        if self._reverse is None:
+            positions = np.argsort(self.targets, kind='stable')
+            counts = np.bincount(self.targets, minlength=self.number_of_nodes())
+            offsets = np.zeros(self.number_of_nodes() + 1, dtype=np.int64)
+            np.cumsum(counts, out=offsets[1:])
+            self._reverse = (offsets, self.sources[positions], positions)
+        return self._reverse
+
+    def index_of(self, stop_id):
+        return self.index.get(str(stop_id))
+
+    def indices_of(self, stop_ids):
+        index = self.index
+        keys = (str(s) for s in stop_ids)
+        return np.array([index[k] for k in keys if k in index], dtype=np.int32)
+
+    def edge_range(self, i):
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def find_edge(self, i, j):
+        """Position de l'arête i -> j dans les tableaux, ou -1 (cibles triées par source)."""
+        start, end = self.edge_range(i)
+        pos = start + int(np.searchsorted(self.targets[start:end], j))
+        if pos < end and self.targets[pos] == j:
+            return pos
+        return -1
+
+    def edge_attributes(self, pos):
+        data = {
+            "weight": int(self.weights[pos]),
+            "line": self.lines[self.line_codes[pos]],
+            "mode": self.modes[self.mode_codes[pos]],
+        }
+        transfer_time = int(self.transfer_times[pos])
+        if transfer_time != self.NO_TRANSFER:
+            data["transfer_time"] = transfer_time
+        return data
+
+    # === Interface compatible networkx ===
+    @property
+    def nodes(self):
+        return self.index.keys()
+
+    def __contains__(self, stop_id):
+        return str(stop_id) in self.index
+
+    def __len__(self):
+        return self.number_of_nodes()
+
+    def __getitem__(self, stop_id):
+        i = self.index[str(stop_id)]
+        start, end = self.edge_range(i)
+        return {str(self.stop_ids[self.targets[pos]]): self.edge_attributes(pos) for pos in range(start, end)}
+
+    def number_of_nodes(self):
+        return len(self.stop_ids)
+
+    def number_of_edges(self):
+        return len(self.targets)
+
+    def successors(self, stop_id):
+        start, end = self.edge_range(self.index[str(stop_id)])
+        return iter(self.stop_ids[self.targets[start:end]].tolist())
+
+    def has_edge(self, u, v):
+        i, j = self.index_of(u), self.index_of(v)
+        return i is not None and j is not None and self.find_edge(i, j) >= 0
+
+    def get_edge_data(self, u, v, default=None):
+        i, j = self.index_of(u), self.index_of(v)
+        if i is None or j is None:
+            return default
+        pos = self.find_edge(i, j)
+        return self.edge_attributes(pos) if pos >= 0 else default
+
+    def edges(self, data=False):
+        stop_ids = self.stop_ids.tolist()
+        for pos, (i, j) in enumerate(zip(self.sources.tolist(), self.targets.tolist())):
+            if data:
+                yield stop_ids[i], stop_ids[j], self.edge_attributes(pos)
+            else:
+                yield stop_ids[i], stop_ids[j]
+
+    @property
+    def nbytes(self):
+        """Mémoire occupée par les tableaux (hors tables internées et index)."""
+        return sum(getattr(self, name).nbytes for name in ARRAY_NAMES)
+
+    # === Persistance ===
+    def save(self, directory, extra_arrays=None, metadata=None):
+        """
+        Écrit le graphe dans `directory` (.npy + header.json), de façon atomique : les fichiers
+        sont écrits dans un nouveau sous-répertoire de version, puis le pointeur CURRENT est
+        remplacé (`os.replace`). `directory` désigne à tout instant une version complète ;
+        la version précédente est conservée pour les lecteurs qui l'ouvrent encore.
+        `extra_arrays` permet d'ajouter des tableaux annexes (ex. noms des arrêts).
+        """
+        arrays = {name: getattr(self, name) for name in ARRAY_NAMES}
+        arrays.update(extra_arrays or {})
+
+        version_dir = create_version(directory)
+        for name, array in arrays.items():
+            np.save(os.path.join(version_dir, f"{name}.npy"), np.ascontiguousarray(array), allow_pickle=False)
+
+        header = {
+            "format": GRAPH_FORMAT,
+            "version": GRAPH_FORMAT_VERSION,
+            "nodes": self.number_of_nodes(),
+            "edges": self.number_of_edges(),
+            "lines": self.lines,
+            "modes": self.modes,
+            "arrays": {name: str(array.dtype) for name, array in arrays.items()},
+            "metadata": metadata or {},
+        }
+        with open(os.path.join(version_dir, HEADER_FILE), "w", encoding="utf-8") as f:
+            json.dump(header, f, ensure_ascii=False)
+        publish_version(version_dir)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Ouvre un graphe écrit par `save`. Avec `mmap=True`, les tableaux sont projetés en
+        mémoire (lecture seule) : l'ouverture est quasi instantanée et les pages sont
+        partagées entre processus via le cache du système.
+        Retourne `(graph, extras)` où `extras` contient les tableaux annexes.
+        """
+        version_dir = current_version(directory)
+        if version_dir is None:
+            raise FileNotFoundError(f"Aucun graphe enregistré dans {directory}")
+        header = read_header(version_dir)
+        mmap_mode = "r" if mmap else None
+        arrays = {
+            name: np.load(os.path.join(version_dir, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+            for name in header["arrays"]
+        }
+        graph = cls(lines=header["lines"], modes=header["modes"], **{name: arrays.pop(name) for name in ARRAY_NAMES})
+        return graph, arrays
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_index'] = None
+        state['_sources'] = None
+        state['_reverse'] = None
+        return state
+
+
+def create_version(directory):
+    """Nouveau sous-répertoire de version, vide, de `directory` (à remplir puis publier avec `publish_version`)."""
+    os.makedirs(directory, exist_ok=True)
+    version_dir = os.path.join(directory, f"{VERSION_PREFIX}{time.time_ns()}-{os.getpid()}-{threading.get_ident()}")
+    os.makedirs(version_dir)
+    return version_dir
+
+
+def publish_version(version_dir):
+    """
+    Met en service une version complète (en-tête écrit en dernier) : le pointeur CURRENT est
+    remplacé par `os.replace`, si bien que le répertoire désigne à tout instant une version
+    complète. La version précédente est conservée pour les lecteurs qui l'ouvrent encore,
+    les plus anciennes sont supprimées.
+    """
+    directory = os.path.dirname(version_dir)
+    version = os.path.basename(version_dir)
+    previous = current_version(directory)
+    pointer = os.path.join(directory, f"{CURRENT_FILE}.tmp-{os.getpid()}-{threading.get_ident()}")
+    with open(pointer, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer, os.path.join(directory, CURRENT_FILE))
+
+    # Versions antérieures à la précédente : plus servies
+    kept = {version, os.path.basename(previous or "")}
+    for name in os.listdir(directory):
+        if name.startswith(VERSION_PREFIX) and name not in kept:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def current_version(directory):
+    """
+    Sous-répertoire de la version en service de `directory` (cf. `publish_version`), ou None
+    si aucune version complète n'y est publiée. Un artefact écrit avant le versionnage (en-tête
+    directement dans `directory`) est rendu tel quel.
+    """
+    try:
+        with open(os.path.join(directory, CURRENT_FILE), encoding="utf-8") as f:
+            version = f.read().strip()
+    except OSError:
+        return directory if os.path.exists(os.path.join(directory, HEADER_FILE)) else None
+    version_dir = os.path.join(directory, version)
+    return version_dir if version and os.path.exists(os.path.join(version_dir, HEADER_FILE)) else None
+
+
+def read_header(directory):
+    """Lit et valide l'en-tête d'un graphe sur disque (ValueError si format inconnu)."""
+    with open(os.path.join(directory, HEADER_FILE), encoding="utf-8") as f:
+        header = json.load(f)
+    if header.get("format") != GRAPH_FORMAT:
+        raise ValueError(f"Format de graphe inconnu : {header.get('format')}")
+    if header.get("version") != GRAPH_FORMAT_VERSION:
+        raise ValueError(f"Version de graphe {header.get('version')} incompatible (attendue : {GRAPH_FORMAT_VERSION})")
+    return header
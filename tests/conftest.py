@@ -0,0 +1,63 @@
+import os
+import shutil
+import sys
+
+import pandas as pd
+import pytest
+
+# Racine du dépôt dans le chemin d'import (paquet `app`)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Petit flux GTFS : 8 arrêts, 3 lignes (métro, bus, tram), services semaine / week-end,
+# une exception de calendrier (14 juillet 2025) et des courses après minuit (horaires > 24:00)
+FIXTURE_GTFS = os.path.join(os.path.dirname(__file__), "fixtures", "gtfs")
+ID_COLUMNS = ("agency_id", "route_id", "service_id", "trip_id", "stop_id", "from_stop_id", "to_stop_id")
+
+
+def read_fixture(table_name):
+    return pd.read_csv(os.path.join(FIXTURE_GTFS, f"{table_name}.txt"), dtype={c: str for c in ID_COLUMNS})
+
+
+@pytest.fixture(scope="session")
+def gtfs():
+    """Tables du flux de test, lues directement dans les fichiers (sans base)."""
+    return {
+        name: read_fixture(name)
+        for name in ("stops", "stop_times", "trips", "routes", "transfers", "calendar", "calendar_dates")
+    }
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """
+    Répertoire de données temporaire contenant le flux de test dans `datalake/` : base, datalake
+    colonnaire et artefacts de graphe y sont écrits à la place de `data/`.
+    """
+    from app.services import columnar_store, db_connector, db_initializer, graph_builder
+
+    shutil.copytree(FIXTURE_GTFS, tmp_path / "datalake")
+    (tmp_path / "databases").mkdir()
+    db_path = str(tmp_path / "databases" / "mobility.db")
+    monkeypatch.setattr(db_initializer, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(db_initializer, "DB_PATH", db_path)
+    monkeypatch.setattr(db_initializer, "STAGING_DB_PATH", db_path + ".staging")
+    monkeypatch.setattr(db_connector, "DB_PATH", db_path)
+    monkeypatch.setattr(columnar_store, "COLUMNAR_DIR", str(tmp_path / "datalake" / "columnar"))
+    monkeypatch.setattr(graph_builder, "GRAPH_CACHE_DIR", str(tmp_path / "graphs"))
+    monkeypatch.setattr(graph_builder, "GRAPH_PICKLE_DIR", str(tmp_path))
+    yield tmp_path
+    db_connector.close_connections()
+
+
+@pytest.fixture
+def congestion_model(data_dir, monkeypatch):
+    """Base de test chargée et petit modèle de congestion entraîné dessus (fichiers dans `data_dir`)."""
+    from app.services import congestion_handler, db_initializer
+
+    monkeypatch.setattr(congestion_handler, "CONGESTION_ANALYSIS_PATH", str(data_dir / "congestion_model.pkl"))
+    monkeypatch.setattr(congestion_handler, "CONGESTION_AUDIT_PATH", str(data_dir / "congested_stops_audit.csv"))
+    monkeypatch.setattr(congestion_handler, "_model_handle", {"signature": None, "model": None, "encoder": None,
+                                                              "metadata": None, "tables": {}})
+    assert db_initializer.init_db()
+    congestion_handler.train_congestion_model(n_estimators=5, n_jobs=1)
+    return data_dir
@@ -0,0 +1,42 @@
+import pytest
+
+from app import automatizer
+from app.services import data_loader, db_initializer, feed_updater, gtfs_downloader
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(feed_updater, "update_db", lambda archive=None: calls.append(("update", archive)) or True)
+    monkeypatch.setattr(db_initializer, "init_db", lambda archive=None: calls.append(("init", archive)) or True)
+    monkeypatch.setattr(gtfs_downloader, "archive_sha256", lambda path: "abc")
+    return calls
+
+
+def test_exits_on_download_failure(monkeypatch, calls):
+    monkeypatch.setattr(data_loader, "load_data_from_web", lambda **kwargs: None)
+    with pytest.raises(SystemExit) as exit_info:
+        automatizer.run()
+    assert exit_info.value.code == 1
+    assert calls == []
+
+
+def test_skips_unchanged_archive_already_loaded(monkeypatch, calls):
+    monkeypatch.setattr(data_loader, "load_data_from_web", lambda **kwargs: gtfs_downloader.UNCHANGED)
+    monkeypatch.setattr(db_initializer, "read_archive_hash", lambda: "abc")
+    automatizer.run()
+    assert calls == []
+
+
+def test_updates_unchanged_archive_not_yet_loaded(monkeypatch, calls):
+    monkeypatch.setattr(data_loader, "load_data_from_web", lambda **kwargs: gtfs_downloader.UNCHANGED)
+    monkeypatch.setattr(db_initializer, "read_archive_hash", lambda: "older")
+    automatizer.run()
+    assert calls == [("update", data_loader.ZIP_PATH)]
+
+
+def test_full_rebuild_ignores_archive_hash(monkeypatch, calls):
+    monkeypatch.setattr(data_loader, "load_data_from_web", lambda **kwargs: gtfs_downloader.UNCHANGED)
+    monkeypatch.setattr(db_initializer, "read_archive_hash", lambda: "abc")
+    automatizer.run(full=True)
+    assert calls == [("init", data_loader.ZIP_PATH)]
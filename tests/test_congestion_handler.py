@@ -0,0 +1,131 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services import columnar_store, congestion_handler, db_initializer
+from app.services.congestion_handler import (
+    CONGESTION_AUDIT_INTERVAL, TRAINING_FEATURES, build_traffic_features, load_congestion_model,
+    predict_congested_stops, predict_congestion_batch, prediction_table, train_congestion_model
+)
+from app.services.db_connector import get_connection
+from app.services.service_calendar import service_weekdays
+
+
+def test_model_reloaded_only_when_file_changes(congestion_model):
+    model, le = load_congestion_model()
+    assert load_congestion_model() == (model, le)
+    table = prediction_table(1)
+
+    # Même contenu réécrit avec une autre date de modification : le fichier est relu
+    path = congestion_handler.CONGESTION_ANALYSIS_PATH
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    reloaded, _ = load_congestion_model()
+    assert reloaded is not model
+    assert prediction_table(1) is not table
+
+    # Taille modifiée à date de modification identique : relu aussi
+    stat = os.stat(path)
+    with open(path, "ab") as f:
+        f.write(b"\0")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert load_congestion_model()[0] is not reloaded
+
+    os.remove(path)
+    assert load_congestion_model() is None and prediction_table(1) is None
+
+
+def test_prediction_table_matches_model(congestion_model):
+    model, le = load_congestion_model()
+    n = len(le.classes_)
+    for weekday in (1, 5):
+        table = prediction_table(weekday)
+        assert table.shape == (n, 24)
+        # Table calculée une fois par jour, puis servie telle quelle
+        assert prediction_table(weekday) is table
+        features = pd.DataFrame({"stop_id_enc": np.repeat(np.arange(n), 24), "hour": np.tile(np.arange(24), n),
+                                 "weekday": weekday})[TRAINING_FEATURES]
+        np.testing.assert_allclose(table, model.predict(features).reshape(n, 24))
+
+    stop_ids = [*le.classes_[:3], "inconnu"]
+    hours = [7, 8, 30, 8]
+    scores = predict_congestion_batch(stop_ids, hours, weekday=1)
+    np.testing.assert_allclose(scores, predict_congestion_batch(stop_ids, hours, weekday=1, use_table=False))
+    assert scores[0] == prediction_table(1)[0, 7] and scores[-1] == 0
+
+
+def in_memory_traffic(conn):
+    """Référence : stop_times lu en entier depuis la base, agrégé en une fois."""
+    stop_times = pd.read_sql("SELECT trip_id, stop_id, departure_time FROM stop_times", conn).dropna()
+    trips = pd.read_sql("SELECT trip_id, service_id FROM trips", conn)
+    weekdays = service_weekdays(pd.read_sql("SELECT * FROM calendar", conn),
+                                pd.read_sql("SELECT * FROM calendar_dates", conn))
+    frame = stop_times.merge(trips, on="trip_id").merge(weekdays, on="service_id")
+    raw_hour = frame["departure_time"].str.strip().str.split(":").str[0].astype(int)
+    frame["hour"] = raw_hour % 24
+    frame["weekday"] = (frame["weekday"] + raw_hour // 24) % 7
+    return frame.groupby(["stop_id", "hour", "weekday"]).size().rename("traffic").reset_index()
+
+
+def sorted_traffic(traffic):
+    traffic = traffic.astype({"stop_id": str, "hour": int, "weekday": int, "traffic": int})
+    return traffic.sort_values(["stop_id", "hour", "weekday"]).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("columnar", [True, False], ids=["parquet", "sqlite"])
+def test_streamed_training_matches_in_memory(congestion_model, monkeypatch, columnar):
+    if not columnar:
+        shutil.rmtree(columnar_store.COLUMNAR_DIR)
+    # Petits blocs, agrégats partiels fusionnés en cours de lecture
+    monkeypatch.setattr(congestion_handler, "TRAINING_COMPACT_EVERY", 2)
+    conn = get_connection()
+    try:
+        expected = sorted_traffic(in_memory_traffic(conn))
+        streamed = sorted_traffic(build_traffic_features(conn, chunk_size=7))
+    finally:
+        conn.close()
+    pd.testing.assert_frame_equal(streamed, expected)
+
+    # Même jeu d'entraînement, mêmes paramètres : même modèle
+    params = {"n_estimators": 5, "n_jobs": 1}
+    model, le = train_congestion_model(chunk_size=7, **params)
+    reference, reference_le = train_congestion_model(chunk_size=len(expected) * 100, **params)
+    np.testing.assert_array_equal(le.classes_, reference_le.classes_)
+    features = pd.DataFrame({"stop_id_enc": np.repeat(np.arange(len(le.classes_)), 24 * 7),
+                             "hour": np.tile(np.repeat(np.arange(24), 7), len(le.classes_)),
+                             "weekday": np.tile(np.arange(7), 24 * len(le.classes_))})[TRAINING_FEATURES]
+    np.testing.assert_array_equal(model.predict(features), reference.predict(features))
+
+
+def test_audit_sink_is_rate_limited(data_dir, monkeypatch):
+    assert db_initializer.init_db()
+    audit_path = str(data_dir / "audit.csv")
+    monkeypatch.setattr(congestion_handler, "CONGESTION_AUDIT_PATH", audit_path)
+    monkeypatch.setattr(congestion_handler, "_last_audit", {})
+    clock = [1000.0]
+    monkeypatch.setattr(congestion_handler.time, "monotonic", lambda: clock[0])
+
+    # Sans CONGESTION_AUDIT=1 (ni audit=True), rien n'est écrit
+    monkeypatch.delenv("CONGESTION_AUDIT", raising=False)
+    congested = predict_congested_stops(threshold=0, hour=8)
+    assert congested and not os.path.exists(audit_path)
+
+    monkeypatch.setenv("CONGESTION_AUDIT", "1")
+    assert predict_congested_stops(threshold=0, hour=8) == congested
+    audit = pd.read_csv(audit_path, dtype={"stop_id": str})
+    assert sorted(audit["stop_id"]) == sorted(congested) and set(audit["hour"]) == {8}
+
+    # Même requête dans l'intervalle : ignorée ; autre heure ou type de jour : journalisée
+    predict_congested_stops(threshold=0, hour=8)
+    predict_congested_stops(threshold=0, hour=8, audit=False)
+    assert len(pd.read_csv(audit_path)) == len(congested)
+    predict_congested_stops(threshold=0, hour=8, day_type="saturday")
+    assert set(pd.read_csv(audit_path)["day_type"]) == {"all", "saturday"}
+
+    written = len(pd.read_csv(audit_path))
+    clock[0] += CONGESTION_AUDIT_INTERVAL
+    predict_congested_stops(threshold=0, hour=8)
+    assert len(pd.read_csv(audit_path)) == written + len(congested)
@@ -0,0 +1,96 @@
+import os
+import shutil
+import sqlite3
+import threading
+
+import pytest
+
+from app.services import db_connector, db_initializer
+from app.services.db_connector import connection, connection_stats, get_connection, get_feed_summary
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "mobility.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE feed_meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("INSERT INTO feed_meta VALUES ('feed_hash', 'abc')")
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(db_connector, "DB_PATH", db_path)
+    yield db_path
+    db_connector.close_connections()
+
+
+def in_thread(function):
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(value=function()))
+    thread.start()
+    thread.join()
+    return result["value"]
+
+
+def test_missing_database_raises(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "absente.db")
+    monkeypatch.setattr(db_connector, "DB_PATH", db_path)
+    with pytest.raises(sqlite3.OperationalError, match="introuvable"):
+        get_connection()
+    with pytest.raises(sqlite3.OperationalError):
+        with connection():
+            pass
+    assert not os.path.exists(db_path)
+    assert db_connector.get_feed_hash() == "empty"
+
+
+def test_readers_are_reused_across_threads(database):
+    def borrow():
+        conn = get_connection()
+        conn.execute("SELECT 1").fetchone()
+        conn.close()
+        return conn
+
+    before = connection_stats()
+    # Un rerun Streamlit = un nouveau thread : la connexion rendue par le précédent est réutilisée
+    first, second = in_thread(borrow), in_thread(borrow)
+    assert first is second
+    stats = connection_stats()
+    assert stats["opened"] - before["opened"] == 1
+    assert stats["reused"] - before["reused"] == 1
+
+
+def test_pool_is_bounded(database):
+    borrowed = [get_connection() for _ in range(db_connector.READER_POOL_SIZE + 2)]
+    assert len({id(conn) for conn in borrowed}) == len(borrowed)
+    for conn in borrowed:
+        conn.close()
+    assert len(db_connector._idle_readers) == db_connector.READER_POOL_SIZE
+    # Les connexions en trop sont réellement fermées
+    with pytest.raises(sqlite3.ProgrammingError):
+        borrowed[-1].execute("SELECT 1")
+
+
+def test_reader_reopened_after_database_replaced(database, tmp_path):
+    with connection() as conn:
+        assert db_connector._read_feed_hash(conn) == "abc"
+
+    replacement = str(tmp_path / "nouvelle.db")
+    shutil.copy(database, replacement)
+    new = sqlite3.connect(replacement)
+    new.execute("UPDATE feed_meta SET value = 'def'")
+    new.commit()
+    new.close()
+    os.replace(replacement, database)
+
+    before = connection_stats()["replaced"]
+    assert db_connector.get_feed_hash() == "def"
+    assert connection_stats()["replaced"] == before + 1
+
+
+def test_initialize_db_reads_hash_from_writer(data_dir):
+    assert db_initializer.init_db()
+    with connection(write=True) as conn:
+        conn.execute("DROP TABLE feed_summary")
+    db_connector.initialize_db()
+    summary = get_feed_summary()
+    assert summary["feed_hash"] == db_connector.get_feed_hash()
+    assert summary["stops"] == 8
@@ -0,0 +1,31 @@
+import sqlite3
+
+from app.services import db_initializer
+
+
+def test_analytics_cube_matches_group_by(data_dir):
+    assert db_initializer.init_db()
+    conn = sqlite3.connect(db_initializer.DB_PATH)
+    try:
+        # Le flux de test contient des courses après minuit (horaires > 24:00)
+        assert conn.execute("SELECT MAX(departure_hour) FROM stop_times").fetchone()[0] >= 24
+        expected = conn.execute("""
+            SELECT r.route_id, r.route_long_name, r.route_type, st.stop_id, s.stop_name,
+                   st.departure_hour % 24, COUNT(*)
+            FROM stop_times st
+            JOIN stops s ON st.stop_id = s.stop_id
+            JOIN trips t ON t.trip_id = st.trip_id
+            JOIN routes r ON r.route_id = t.route_id
+            WHERE st.departure_hour IS NOT NULL
+            GROUP BY r.route_id, st.stop_id, st.departure_hour % 24
+        """).fetchall()
+        cube = conn.execute("SELECT route_id, route_long_name, route_type, stop_id, stop_name, hour, departures "
+                            "FROM analytics_cube").fetchall()
+        assert sorted(cube) == sorted(expected)
+
+        # Mêmes heures 0-23 et mêmes totaux que l'agrégat stop_hour_traffic (tous services)
+        by_stop_hour = "SELECT stop_id, hour, SUM(departures) FROM {} {} GROUP BY stop_id, hour"
+        assert (sorted(conn.execute(by_stop_hour.format("analytics_cube", "")))
+                == sorted(conn.execute(by_stop_hour.format("stop_hour_traffic", "WHERE day_type = 'all'"))))
+    finally:
+        conn.close()
@@ -0,0 +1,114 @@
+import sqlite3
+import threading
+
+import pandas as pd
+import pytest
+
+from app.services import event_log
+from app.services.event_log import EventLog, new_result_id
+
+
+def itinerary(result_id=None):
+    return {"result_id": result_id or new_result_id(), "departure_time": "08:00", "arrival_time": "08:30",
+            "duration": 30, "start_name": "Nation", "end_name": "Opéra", "congestion_avoidance": True}
+
+
+def stored_totals(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        count, co2 = conn.execute("SELECT COUNT(*), COALESCE(SUM(co2_total), 0) FROM itinerary_events").fetchone()
+    finally:
+        conn.close()
+    return {"itineraries": count, "co2_total_g": co2}
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(event_log, "LEGACY_EMISSION_LOG", str(tmp_path / "emission_log.csv"))
+    return str(tmp_path / "databases" / "events.db")
+
+
+@pytest.fixture
+def open_log(db_path):
+    logs = []
+
+    def open_log():
+        # Pas d'écriture périodique : les lots sont écrits par les appels explicites à flush()
+        logs.append(EventLog(db_path, flush_interval=3600))
+        return logs[-1]
+
+    yield open_log
+    for log in logs:
+        log.close()
+
+
+def test_events_deduplicated_by_result_id(db_path, open_log):
+    log = open_log()
+    first, second = itinerary(), itinerary()
+    # Réaffichage de la page : même résultat en attente deux fois
+    log.log_itinerary(first, 120.0)
+    log.log_itinerary(first, 120.0)
+    log.log_itinerary(second, 80.5)
+    assert log.flush() == 2
+    # Déjà écrit : ignoré, le cumul n'est pas modifié
+    log.log_itinerary(first, 120.0)
+    assert log.flush() == 0
+
+    # Autre processus (autre instance) qui journalise le même résultat
+    other = open_log()
+    other.log_itinerary(second, 80.5)
+    assert other.flush() == 0
+    assert log.totals() == other.totals() == {"itineraries": 2, "co2_total_g": 200.5}
+    assert stored_totals(db_path) == log.totals()
+
+
+def test_totals_imported_once_from_legacy_csv(db_path, open_log):
+    # L'ancien journal écrivait chaque itinéraire deux fois
+    pd.DataFrame({"co2_total": [100.0, 100.0, 50.0, 50.0], "duration": [20, 20, 10, 10]}).to_csv(
+        event_log.LEGACY_EMISSION_LOG, index=False)
+    log = open_log()
+    assert log.totals() == {"itineraries": 2, "co2_total_g": 150.0}
+
+    log.log_itinerary(itinerary(), 25.0)
+    log.flush()
+    # Base existante : le cumul n'est pas réimporté à l'ouverture suivante
+    assert open_log().totals() == {"itineraries": 3, "co2_total_g": 175.0}
+
+
+def test_unreadable_legacy_csv_starts_from_zero(db_path, open_log):
+    with open(event_log.LEGACY_EMISSION_LOG, "w", encoding="utf-8") as f:
+        f.write("date,duration\n2025-07-15,20\n")
+    assert open_log().totals() == {"itineraries": 0, "co2_total_g": 0.0}
+
+
+def test_concurrent_writers_under_wal(db_path, open_log):
+    logs = [open_log(), open_log()]
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    # Lecture en cours pendant les écritures : WAL ne la bloque pas et elle voit un instantané stable
+    conn.execute("BEGIN")
+    snapshot = conn.execute("SELECT itineraries FROM event_totals").fetchone()[0]
+
+    shared = [new_result_id() for _ in range(50)]
+    inserted = []
+
+    def write(log, own):
+        for i, result_id in enumerate(shared + own, start=1):
+            log.log_itinerary(itinerary(result_id), 10.0)
+            if i % 10 == 0:
+                inserted.append(log.flush())
+        inserted.append(log.flush())
+
+    threads = [threading.Thread(target=write, args=(log, [new_result_id() for _ in range(30)])) for log in logs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert conn.execute("SELECT itineraries FROM event_totals").fetchone()[0] == snapshot
+    conn.rollback()
+    conn.close()
+
+    # Chaque itinéraire compté une seule fois, cumul cohérent avec la table des événements
+    assert sum(inserted) == 50 + 2 * 30
+    assert logs[0].totals() == stored_totals(db_path) == {"itineraries": 110, "co2_total_g": 1100.0}
@@ -0,0 +1,40 @@
+import gzip
+import os
+
+import pandas as pd
+import pytest
+
+from app.services import export_service
+from app.services.export_service import available_formats, download_link, export_frames, export_url
+
+
+@pytest.fixture(autouse=True)
+def export_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(export_service, "EXPORT_DIR", str(tmp_path / "exports"))
+    return tmp_path / "exports"
+
+
+def frames():
+    yield pd.DataFrame({"stop_id": ["S1", "S2"], "hour": [8, 9], "traffic": [1.5, 2.0]})
+    yield pd.DataFrame({"stop_id": ["S3"], "hour": [None], "traffic": [3.0]})
+
+
+@pytest.mark.parametrize("fmt", available_formats())
+def test_export_round_trip(export_dir, fmt):
+    path = export_frames(frames(), fmt, basename="test")
+    assert os.path.dirname(path) == str(export_dir)
+    if fmt == "csv.gz":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            exported = pd.read_csv(f)
+    else:
+        exported = pd.read_parquet(path)
+    assert exported["stop_id"].tolist() == ["S1", "S2", "S3"]
+    assert exported["hour"].isna().tolist() == [False, False, True]
+
+
+def test_download_link_points_to_static_file(export_dir):
+    path = export_frames(frames(), "csv.gz", basename="test")
+    url = export_url(path)
+    assert url == f"{export_service.EXPORT_URL}/{os.path.basename(path)}"
+    assert f'href="{url}"' in download_link(path, "stats.csv.gz")
+    assert 'download="stats.csv.gz"' in download_link(path, "stats.csv.gz")
@@ -0,0 +1,146 @@
+import base64
+import hashlib
+import io
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.services import gtfs_downloader
+
+
+def make_archive(rows):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("stops.txt", "stop_id\n" + "\n".join(f"S{i}" for i in range(rows)))
+    return buffer.getvalue()
+
+
+class FeedServer:
+    """Serveur HTTP local imitant la publication de l'archive GTFS (ETag, Range / If-Range, 304)."""
+
+    def __init__(self):
+        self.body = make_archive(20_000)
+        self.etag = '"v1"'
+        self.digest = None
+        self.cuts = 0  # réponses interrompues après un tiers du corps
+        self.requests = []
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                body = server.body
+                server.requests.append({k: self.headers[k] for k in ("If-None-Match", "Range", "If-Range")
+                                        if self.headers[k]})
+                if self.headers["If-None-Match"] == server.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                start = 0
+                if self.headers["Range"] and self.headers["If-Range"] == server.etag:
+                    start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+                else:
+                    self.send_response(200)
+                self.send_header("ETag", server.etag)
+                if server.digest:
+                    self.send_header("Digest", f"sha-256={server.digest}")
+                self.send_header("Content-Length", str(len(body) - start))
+                self.end_headers()
+                if server.cuts:
+                    server.cuts -= 1
+                    self.wfile.write(body[start:start + (len(body) - start) // 3])
+                    self.wfile.flush()
+                    self.connection.shutdown(2)
+                    return
+                self.wfile.write(body[start:])
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/gtfs.zip"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(gtfs_downloader, "RETRY_DELAY", 0)
+    monkeypatch.setattr(gtfs_downloader, "CHUNK_SIZE", 4096)
+    monkeypatch.delenv("GTFS_SHA256", raising=False)
+    feed = FeedServer()
+    yield feed
+    feed.close()
+
+
+def test_download_then_unchanged(server, tmp_path):
+    dest = str(tmp_path / "feed.zip")
+    status, meta = gtfs_downloader.download_gtfs(server.url, dest)
+    assert status == gtfs_downloader.DOWNLOADED
+    assert meta["sha256"] == hashlib.sha256(server.body).hexdigest()
+    assert gtfs_downloader.archive_sha256(dest) == meta["sha256"]
+
+    status, _ = gtfs_downloader.download_gtfs(server.url, dest)
+    assert status == gtfs_downloader.UNCHANGED
+    assert server.requests[-1] == {"If-None-Match": '"v1"'}
+
+
+def test_resume_after_interruption(server, tmp_path):
+    dest = str(tmp_path / "feed.zip")
+    server.cuts = 2
+    progress = []
+    status, meta = gtfs_downloader.download_gtfs(server.url, dest, progress=lambda done, total: progress.append(done))
+    assert status == gtfs_downloader.DOWNLOADED
+    assert all("Range" in request and request["If-Range"] == '"v1"' for request in server.requests[1:])
+    assert len(server.requests) == 3
+    assert progress[-1] == len(server.body)
+    with open(dest, "rb") as f:
+        assert f.read() == server.body
+    assert not (tmp_path / "feed.zip.part").exists()
+
+
+def test_new_version_is_downloaded(server, tmp_path):
+    dest = str(tmp_path / "feed.zip")
+    gtfs_downloader.download_gtfs(server.url, dest)
+    server.body, server.etag = make_archive(10), '"v2"'
+    status, meta = gtfs_downloader.download_gtfs(server.url, dest)
+    assert status == gtfs_downloader.DOWNLOADED
+    assert meta["etag"] == '"v2"'
+
+
+def test_checksum_mismatch_keeps_previous_archive(server, tmp_path):
+    dest = str(tmp_path / "feed.zip")
+    gtfs_downloader.download_gtfs(server.url, dest)
+    previous = server.body
+    server.body, server.etag = make_archive(10), '"v2"'
+    server.digest = base64.b64encode(b"x" * 32).decode()
+    with pytest.raises(ValueError):
+        gtfs_downloader.download_gtfs(server.url, dest)
+    with pytest.raises(ValueError):
+        gtfs_downloader.download_gtfs(server.url, dest, expected_sha256="00" * 32)
+    with open(dest, "rb") as f:
+        assert f.read() == previous
+
+    server.digest = base64.b64encode(hashlib.sha256(server.body).digest()).decode()
+    assert gtfs_downloader.download_gtfs(server.url, dest)[0] == gtfs_downloader.DOWNLOADED
+
+
+def test_corrupt_archive_is_rejected(server, tmp_path):
+    dest = str(tmp_path / "feed.zip")
+    server.body = b"PK" + b"\0" * 500
+    with pytest.raises(ValueError):
+        gtfs_downloader.download_gtfs(server.url, dest)
+    assert not (tmp_path / "feed.zip").exists()
+
+
+def test_gives_up_after_max_attempts(server, tmp_path):
+    server.cuts = 10
+    with pytest.raises(gtfs_downloader.RETRYABLE_ERRORS):
+        gtfs_downloader.download_gtfs(server.url, str(tmp_path / "feed.zip"), max_attempts=2)
@@ -0,0 +1,45 @@
+import os
+import threading
+
+from app.services.heatmap_builder import (
+    HEATMAP_DAY_TYPES, build_heatmap_artifact, heatmap_version, open_heatmap_artifact
+)
+from app.services.transit_graph import CURRENT_FILE, VERSION_PREFIX, current_version
+
+
+def test_republish_keeps_readers_consistent(congestion_model):
+    directory = str(congestion_model / "heatmaps")
+    build_heatmap_artifact(directory, min_traffic=0)
+    first = open_heatmap_artifact(directory)
+    assert first.day_types == list(HEATMAP_DAY_TYPES)
+    expected = first.hours_frame("weekday", range(24))
+    assert len(expected) > 0
+
+    # Republications concurrentes : le répertoire désigne toujours une version complète
+    errors = []
+    stop = threading.Event()
+
+    def read():
+        while not stop.is_set():
+            artifact = open_heatmap_artifact(directory)
+            if artifact is None or len(artifact.hours_frame("weekday", range(24))) != len(expected):
+                errors.append(artifact)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    try:
+        for _ in range(3):
+            build_heatmap_artifact(directory, min_traffic=0)
+    finally:
+        stop.set()
+        reader.join()
+    assert not errors
+
+    # L'artefact ouvert avant les remplacements reste lisible ; seules deux versions subsistent
+    assert len(first.hours_frame("weekday", range(24))) == len(expected)
+    assert heatmap_version(directory) != first.header["built_at"]
+    versions = [name for name in os.listdir(directory) if name.startswith(VERSION_PREFIX)]
+    assert len(versions) == 2 and os.path.basename(current_version(directory)) in versions
+
+    os.remove(os.path.join(directory, CURRENT_FILE))
+    assert open_heatmap_artifact(directory) is None and heatmap_version(directory) is None
@@ -0,0 +1,173 @@
+import os
+import shutil
+import sqlite3
+import zipfile
+
+import pandas as pd
+import pytest
+
+from app.services import columnar_store, db_connector, db_initializer, gtfs_downloader
+from app.services.feed_updater import update_db
+
+# Valeurs qui dépendent de l'heure du chargement, pas du contenu du flux
+VOLATILE_COLUMNS = {"loaded_at"}
+VOLATILE_META_KEYS = {"loaded_at"}
+
+
+def dump_database(db_path):
+    """Contenu complet de la base (schéma des tables, lignes triées), hors horodatages."""
+    conn = sqlite3.connect(db_path)
+    try:
+        dump = {}
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        for table in tables:
+            columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')
+                       if row[1] not in VOLATILE_COLUMNS]
+            selected = ", ".join(f'"{column}"' for column in columns)
+            rows = conn.execute(f'SELECT {selected} FROM "{table}"').fetchall()
+            if table == "feed_meta":
+                rows = [row for row in rows if row[0] not in VOLATILE_META_KEYS]
+            dump[table] = (columns, sorted(rows, key=repr))
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        return dump, indexes
+    finally:
+        conn.close()
+
+
+def dump_columnar(tables):
+    return {table: columnar_store.read_table(table).to_pandas() for table in tables}
+
+
+def edit_feed(datalake):
+    """Modifications d'un flux à l'autre : arrêt renommé, course supprimée, course ajoutée, correspondance modifiée."""
+    def path(name):
+        return os.path.join(datalake, f"{name}.txt")
+
+    stops = pd.read_csv(path("stops"), dtype=str)
+    stops.loc[stops["stop_id"] == "S5", "stop_name"] = "Pigalle - Abbesses"
+    stops.to_csv(path("stops"), index=False)
+
+    trips = pd.read_csv(path("trips"), dtype=str)
+    stop_times = pd.read_csv(path("stop_times"), dtype=str)
+    removed = trips["trip_id"].iloc[3]
+    trips = trips[trips["trip_id"] != removed]
+    stop_times = stop_times[stop_times["trip_id"] != removed]
+    trips = pd.concat([trips, pd.DataFrame([{"route_id": "T3", "service_id": "WE", "trip_id": "T3-WE-extra",
+                                             "direction_id": "0"}])])
+    added = pd.DataFrame({
+        "trip_id": "T3-WE-extra",
+        "arrival_time": ["23:50:00", "23:53:00", "23:56:00"],
+        "departure_time": ["23:50:00", "23:53:30", "23:56:00"],
+        "stop_id": ["S4", "S8", "S7"],
+        "stop_sequence": ["1", "2", "3"],
+    })
+    trips.to_csv(path("trips"), index=False)
+    pd.concat([stop_times, added]).to_csv(path("stop_times"), index=False)
+
+    transfers = pd.read_csv(path("transfers"), dtype=str)
+    transfers.loc[transfers["from_stop_id"] == "S7", "min_transfer_time"] = "300"
+    transfers.to_csv(path("transfers"), index=False)
+
+
+def test_incremental_update_matches_full_load(data_dir):
+    datalake = str(data_dir / "datalake")
+    assert db_initializer.init_db()
+    before, _ = dump_database(db_initializer.DB_PATH)
+
+    edit_feed(datalake)
+    assert update_db(workers=1)
+    updated, updated_indexes = dump_database(db_initializer.DB_PATH)
+    updated_columnar = dump_columnar(db_initializer.gtfs_sources())
+    assert updated["feed_meta"] != before["feed_meta"]
+
+    # Reconstruction complète des mêmes fichiers, base et datalake colonnaire repartant de zéro
+    db_connector.close_connections()
+    os.remove(db_initializer.DB_PATH)
+    shutil.rmtree(columnar_store.COLUMNAR_DIR)
+    assert db_initializer.init_db()
+    rebuilt, rebuilt_indexes = dump_database(db_initializer.DB_PATH)
+
+    assert updated.keys() == rebuilt.keys()
+    for table in rebuilt:
+        assert updated[table] == rebuilt[table], table
+    assert updated_indexes == rebuilt_indexes
+    for table, frame in dump_columnar(db_initializer.gtfs_sources()).items():
+        pd.testing.assert_frame_equal(updated_columnar[table], frame)
+
+
+def test_unchanged_feed_is_a_no_op(data_dir):
+    assert db_initializer.init_db()
+    before = os.stat(db_initializer.DB_PATH).st_ino
+    loaded, _ = dump_database(db_initializer.DB_PATH)
+    assert update_db(workers=1)
+    # Aucune nouvelle base publiée : même fichier, même contenu
+    assert os.stat(db_initializer.DB_PATH).st_ino == before
+    assert dump_database(db_initializer.DB_PATH)[0] == loaded
+
+
+def assert_summary_matches_counts():
+    summary = db_connector.get_feed_summary()
+    conn = sqlite3.connect(db_initializer.DB_PATH)
+    try:
+        counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in db_initializer.SUMMARY_TABLES}
+        feed_hash = conn.execute("SELECT value FROM feed_meta WHERE key = 'feed_hash'").fetchone()[0]
+    finally:
+        conn.close()
+    assert {table: summary[table] for table in counts} == counts
+    assert summary["feed_hash"] == feed_hash
+    return counts
+
+
+def test_feed_summary_matches_counts(data_dir):
+    datalake = str(data_dir / "datalake")
+    assert db_initializer.init_db()
+    loaded = assert_summary_matches_counts()
+
+    # Mise à jour incrémentale qui change les comptages : une course et une correspondance en moins
+    edit_feed(datalake)
+    removed = {"trips": pd.read_csv(os.path.join(datalake, "trips.txt"), dtype=str)["trip_id"].iloc[0],
+               "transfers": "S3"}
+    for table, column, key in (("trips", "trip_id", "trips"), ("stop_times", "trip_id", "trips"),
+                               ("transfers", "from_stop_id", "transfers")):
+        frame = pd.read_csv(os.path.join(datalake, f"{table}.txt"), dtype=str)
+        frame[frame[column] != removed[key]].to_csv(os.path.join(datalake, f"{table}.txt"), index=False)
+    assert update_db(workers=1)
+    updated = assert_summary_matches_counts()
+    assert updated["trips"] < loaded["trips"] and updated["transfers"] < loaded["transfers"]
+
+
+def write_archive(data_dir):
+    archive = str(data_dir / "gtfs.zip")
+    with zipfile.ZipFile(archive, "w") as z:
+        for name in os.listdir(data_dir / "datalake"):
+            if name.endswith(".txt"):
+                z.write(data_dir / "datalake" / name, name)
+    return archive
+
+
+def test_unchanged_archive_recorded_in_place(data_dir):
+    archive = write_archive(data_dir)
+    assert db_initializer.init_db()
+    inode = os.stat(db_initializer.DB_PATH).st_ino
+    # Même contenu lu depuis l'archive : seule l'empreinte d'archive est enregistrée, sans republication
+    assert update_db(workers=1, archive=archive)
+    assert db_initializer.read_archive_hash() == gtfs_downloader.archive_sha256(archive)
+    assert os.stat(db_initializer.DB_PATH).st_ino == inode
+
+    modified = os.stat(db_initializer.DB_PATH).st_mtime_ns
+    assert update_db(workers=1, archive=archive)
+    assert os.stat(db_initializer.DB_PATH).st_mtime_ns == modified
+
+
+@pytest.mark.parametrize("bulk", [True, False])
+def test_archive_load_matches_datalake(data_dir, bulk):
+    archive = write_archive(data_dir)
+
+    assert db_initializer.init_db(bulk=bulk)
+    from_files, _ = dump_database(db_initializer.DB_PATH)
+    assert db_initializer.init_db(bulk=bulk, archive=archive)
+    from_archive, _ = dump_database(db_initializer.DB_PATH)
+    from_archive["feed_meta"] = (from_archive["feed_meta"][0],
+                                 [row for row in from_archive["feed_meta"][1] if row[0] != "archive_sha256"])
+    assert from_archive == from_files
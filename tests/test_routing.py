@@ -0,0 +1,134 @@
+import itertools
+import math
+
+import networkx as nx
+import pandas as pd
+import pytest
+
+from app.services.contraction import (
+    ContractionHierarchy, graph_signature, hierarchy_dir, load_or_build_hierarchy, open_hierarchy
+)
+from app.services.graph_builder import collapse_edges, compute_transfer_edges, compute_trip_edges
+from app.services.route_finder import (
+    MIN_EDGE_SECONDS, CostOverlay, _heuristic, edge_costs, estimate_max_speed, find_best_path_with_cost
+)
+from app.services.transit_graph import TransitGraph
+
+COST_MODELS = [(1.0, 0.02), (0.5, 1.0)]
+
+
+@pytest.fixture(scope="module")
+def edges(gtfs):
+    return collapse_edges(compute_trip_edges(gtfs["stop_times"], gtfs["trips"], gtfs["routes"]),
+                          compute_transfer_edges(gtfs["transfers"]))
+
+
+@pytest.fixture(scope="module")
+def graph(gtfs, edges):
+    return TransitGraph.from_edges(edges, stops=gtfs["stops"])
+
+
+def path_cost(G, path, alpha, beta):
+    """Coût recalculé le long du chemin (arête la moins chère entre deux arrêts consécutifs)."""
+    costs = edge_costs(G, alpha, beta)
+    total = 0.0
+    for u, v in zip(path[:-1], path[1:]):
+        i, j = G.index_of(u), G.index_of(v)
+        total += min(c for s, t, c in zip(G.sources, G.targets, costs) if s == i and t == j)
+    return total
+
+
+@pytest.mark.parametrize("alpha,beta", COST_MODELS)
+def test_searches_agree_with_dijkstra(graph, alpha, beta):
+    hierarchy = ContractionHierarchy.build(graph, alpha, beta)
+    stop_ids = [str(s) for s in graph.stop_ids]
+    reachable = 0
+    for start, end in itertools.product(stop_ids, repeat=2):
+        expected_path, expected = find_best_path_with_cost(graph, start, end, alpha, beta)
+        for method in ("astar", "bidirectional", "ch"):
+            path, cost = find_best_path_with_cost(graph, start, end, alpha, beta, method=method, hierarchy=hierarchy)
+            assert cost == pytest.approx(expected), (method, start, end)
+            if path is None:
+                assert expected_path is None
+                continue
+            assert (path[0], path[-1]) == (start, end)
+            assert path_cost(graph, path, alpha, beta) == pytest.approx(cost), (method, start, end)
+        reachable += not math.isinf(expected)
+    # Le réseau de test est connexe hors de quelques terminus : la comparaison porte sur de vrais trajets
+    assert reachable > len(stop_ids) ** 2 // 2
+
+
+def networkx_graph(edges):
+    G = nx.DiGraph()
+    for row in edges.itertuples():
+        G.add_edge(row.from_stop, row.to_stop, weight=row.weight, line=row.line, mode=row.mode)
+    return G
+
+
+@pytest.mark.parametrize("overlay", [CostOverlay.from_stops(["S3"], factor=3),
+                                     CostOverlay(edge_factors={("S6", "S3"): 3})], ids=["arrêt", "arête"])
+def test_overlay_changes_path(gtfs, edges, graph, overlay):
+    coords = gtfs["stops"].set_index("stop_id")[["stop_lat", "stop_lon"]].apply(tuple, axis=1).to_dict()
+    direct = ["S2", "S6", "S3", "S4", "S8"]
+    detour = ["S2", "S6", "S7", "S8"]
+    for G in (graph, networkx_graph(edges)):
+        base_path, base_cost = find_best_path_with_cost(G, "S2", "S8")
+        assert base_path == direct
+        for method in ("dijkstra", "astar", "bidirectional"):
+            path, cost = find_best_path_with_cost(G, "S2", "S8", method=method, coords=coords, overlay=overlay)
+            assert path == detour, (type(G).__name__, method)
+            # Le détour ne touche pas l'arrêt pénalisé : son coût est celui du graphe sans pénalité
+            assert cost == pytest.approx(path_cost(graph, detour, 1.0, 0.02)) and cost > base_cost
+        # Le graphe partagé n'est pas modifié
+        assert find_best_path_with_cost(G, "S2", "S8") == (base_path, base_cost)
+
+
+def test_unknown_stop(graph):
+    hierarchy = ContractionHierarchy.build(graph)
+    for method in ("dijkstra", "astar", "bidirectional", "ch"):
+        assert find_best_path_with_cost(graph, "S1", "inconnu", method=method, hierarchy=hierarchy) == (None, math.inf)
+
+
+def test_astar_bound_with_zero_weight_edge(gtfs, edges):
+    # Deux arrêts éloignés desservis au même horaire (horaires à la minute) : arête de poids nul
+    zero = pd.DataFrame([{"from_stop": "S1", "to_stop": "S7", "weight": 0, "line": "Z", "mode": "Métro"}])
+    with_zero = pd.concat([edges, zero], ignore_index=True)
+    coords = gtfs["stops"].set_index("stop_id")[["stop_lat", "stop_lon"]].apply(tuple, axis=1).to_dict()
+    compact = TransitGraph.from_edges(with_zero, stops=gtfs["stops"])
+    nx_graph = networkx_graph(with_zero)
+
+    for G in (compact, nx_graph):
+        max_speed = estimate_max_speed(G, coords)
+        assert 0 < max_speed < math.inf
+        # L'heuristique n'est pas annulée : A* ne dégénère pas en Dijkstra
+        target = G.index_of("S7") if G is compact else "S7"
+        source = G.index_of("S5") if G is compact else "S5"
+        assert _heuristic(G, target, 1.0, coords, max_speed)(source) > 0
+        for start, end in itertools.product(sorted(coords), repeat=2):
+            _, expected = find_best_path_with_cost(G, start, end)
+            _, cost = find_best_path_with_cost(G, start, end, method="astar", coords=coords, max_speed=max_speed)
+            assert cost == pytest.approx(expected), (start, end)
+
+    # L'arête de poids nul coûte le temps plancher dans toutes les recherches
+    _, cost = find_best_path_with_cost(compact, "S1", "S7", beta=0.0)
+    assert cost == MIN_EDGE_SECONDS
+
+
+def test_hierarchy_bound_to_graph_and_cost_model(tmp_path, graph):
+    graph_dir = str(tmp_path / "graph")
+    graph.save(graph_dir, metadata={"key": "k1", "feed_hash": "flux-1"})
+    built = load_or_build_hierarchy(graph_dir, graph)
+    assert open_hierarchy(graph_dir, graph) is not None
+    directory = hierarchy_dir(graph_dir)
+    with pytest.raises(ValueError):
+        ContractionHierarchy.load(directory, graph.stop_ids, 0.5, 1.0, graph_signature(graph_dir))
+
+    # Même nombre d'arrêts, autre flux : la hiérarchie n'est plus servie, puis reconstruite
+    graph.save(graph_dir, metadata={"key": "k2", "feed_hash": "flux-2"})
+    assert open_hierarchy(graph_dir, graph) is None
+    with pytest.raises(ValueError):
+        ContractionHierarchy.load(directory, graph.stop_ids, 1.0, 0.02, graph_signature(graph_dir))
+    rebuilt = load_or_build_hierarchy(graph_dir, graph)
+    assert rebuilt is not built
+    assert open_hierarchy(graph_dir, graph) is not None
+    assert rebuilt.query("S1", "S4") == built.query("S1", "S4")
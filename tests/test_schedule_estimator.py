@@ -0,0 +1,34 @@
+from datetime import datetime
+
+import pytest
+
+from app.services import db_initializer
+from app.services.db_connector import connection
+from app.services.graph_builder import build_transit_graph
+from app.services.schedule_estimator import NEXT_HOP_SQL, estimate_schedule
+
+
+@pytest.fixture
+def loaded(data_dir, gtfs):
+    assert db_initializer.init_db()
+    G, _, _ = build_transit_graph(gtfs["stops"], gtfs["stop_times"], gtfs["trips"], gtfs["routes"],
+                                  gtfs["transfers"], feed_hash="fixture")
+    return G
+
+
+def test_schedule_along_path(loaded):
+    # Métro 1 (S1 → S2 → S6), puis correspondance à pied S6 → S3 (transfers.txt : 180 s)
+    schedule = estimate_schedule(["S1", "S2", "S6", "S3"], datetime(2025, 7, 15, 7, 30), loaded)
+    assert [step["from_stop"] for step in schedule] == ["S1", "S2", "S6", "S3"]
+    assert [step["duration_min"] for step in schedule] == [2, 2, 3, 0]
+    assert [step["route_name"] for step in schedule[:2]] == ["1", "1"]
+    assert [step["mode"] for step in schedule[:3]] == ["Métro", "Métro", "Correspondance"]
+    assert schedule[0]["stop_name"] == "Gare Nord" and schedule[-1]["stop_name"] == "Bastille"
+    assert schedule[-1]["arrival_dt"] == datetime(2025, 7, 15, 7, 37)
+
+
+def test_next_hop_uses_stop_index(loaded):
+    with connection() as conn:
+        plan = " ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {NEXT_HOP_SQL}", ("S1", 0, "S2")))
+    assert "idx_stop_times_stop_departure" in plan
+    assert "SCAN a" not in plan and "SCAN b" not in plan
@@ -0,0 +1,101 @@
+import itertools
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services.connection_scan import ConnectionTimetable, csa_profile_query, csa_query
+from app.services.raptor import RaptorTimetable, raptor_query
+
+DEPARTURES = [
+    datetime(2025, 7, 15, 7, 45),   # mardi
+    datetime(2025, 7, 15, 23, 20),  # mardi soir : courses après minuit (horaires > 24:00), relations sans dernier départ
+    datetime(2025, 7, 16, 0, 5),    # après minuit : courses de la veille encore en circulation
+    datetime(2025, 7, 19, 9, 0),    # samedi
+    datetime(2025, 7, 14, 10, 0),   # lundi férié : service du week-end (calendar_dates)
+    datetime(2025, 7, 15, 0, 40),   # nuit : attente des premières courses du matin
+]
+
+
+@pytest.fixture(scope="module")
+def timetables(gtfs):
+    raptor = RaptorTimetable.build(gtfs["stop_times"], gtfs["trips"], gtfs["routes"], gtfs["calendar"],
+                                   gtfs["calendar_dates"], gtfs["transfers"])
+    csa = ConnectionTimetable.build(gtfs["stop_times"], gtfs["trips"], gtfs["calendar"], gtfs["calendar_dates"],
+                                    gtfs["transfers"])
+    return raptor, csa
+
+
+def check_legs(journey, origin, destination, departure_dt):
+    legs = journey["legs"]
+    assert (legs[0]["from_stop"], legs[-1]["to_stop"]) == (origin, destination)
+    assert journey["departure"] >= departure_dt
+    for leg, next_leg in zip(legs[:-1], legs[1:]):
+        assert leg["to_stop"] == next_leg["from_stop"]
+        assert leg["arrival"] <= next_leg["departure"]
+
+
+@pytest.mark.parametrize("departure_dt", DEPARTURES, ids=lambda dt: dt.strftime("%a-%H%M"))
+def test_raptor_matches_csa(gtfs, timetables, departure_dt):
+    raptor, csa = timetables
+    stop_ids = gtfs["stops"]["stop_id"].tolist()
+    found = 0
+    for origin, destination in itertools.permutations(stop_ids, 2):
+        journeys = raptor_query(raptor, origin, destination, departure_dt)
+        scanned = csa_query(csa, origin, destination, departure_dt)
+        assert bool(journeys) == (scanned is not None), (origin, destination)
+        if not journeys:
+            continue
+        found += 1
+        assert journeys[-1]["arrival"] == scanned["arrival"], (origin, destination)
+        check_legs(journeys[-1], origin, destination, departure_dt)
+        check_legs(scanned, origin, destination, departure_dt)
+    assert found > 0
+
+
+def test_calendar_exception(timetables):
+    raptor, _ = timetables
+    # Le 14 juillet, les courses de semaine sont supprimées : premier métro du service week-end (08:05)
+    holiday = raptor_query(raptor, "S1", "S2", datetime(2025, 7, 14, 6, 0))
+    weekday = raptor_query(raptor, "S1", "S2", datetime(2025, 7, 15, 6, 0))
+    assert holiday[-1]["legs"][0]["departure"] == datetime(2025, 7, 14, 8, 5)
+    assert weekday[-1]["legs"][0]["departure"] < datetime(2025, 7, 15, 8, 0)
+
+
+@pytest.mark.parametrize("window", [(datetime(2025, 7, 15, 7, 0), datetime(2025, 7, 15, 10, 0)),
+                                    (datetime(2025, 7, 19, 8, 0), datetime(2025, 7, 19, 23, 30))],
+                         ids=["mardi", "samedi"])
+def test_profile_matches_csa(gtfs, timetables, window):
+    _, csa = timetables
+    window_start, window_end = window
+    stop_ids = gtfs["stops"]["stop_id"].tolist()
+    entries = 0
+    for origin, destination in itertools.permutations(stop_ids, 2):
+        profile = csa_profile_query(csa, origin, destination, window_start, window_end)
+        departures = [entry["departure"] for entry in profile]
+        arrivals = [entry["arrival"] for entry in profile]
+        # Profil de Pareto : départs et arrivées strictement croissants
+        assert departures == sorted(set(departures)) and arrivals == sorted(set(arrivals)), (origin, destination)
+
+        for entry in profile:
+            assert window_start <= entry["departure"] <= window_end
+            assert csa_query(csa, origin, destination, entry["departure"])["arrival"] == entry["arrival"]
+            # Partir une seconde plus tard fait arriver plus tard : l'entrée n'est pas dominée
+            later = csa_query(csa, origin, destination, entry["departure"] + timedelta(seconds=1))
+            assert later is None or later["arrival"] > entry["arrival"], (origin, destination, entry)
+        entries += len(profile)
+
+        # Tout départ de la fenêtre : le profil donne l'arrivée au plus tôt, sauf si elle
+        # s'obtient aussi en partant après la fenêtre (ou à pied)
+        after_window = csa_query(csa, origin, destination, window_end + timedelta(seconds=1))
+        t = window_start
+        while t <= window_end:
+            journey = csa_query(csa, origin, destination, t)
+            expected = min((entry["arrival"] for entry in profile if entry["departure"] >= t), default=None)
+            if journey is None:
+                assert expected is None
+            elif expected != journey["arrival"]:
+                walk_only = all(leg["type"] == "walk" for leg in journey["legs"])
+                assert walk_only or (after_window and after_window["arrival"] == journey["arrival"]), \
+                    (origin, destination, t)
+            t += timedelta(minutes=10)
+    assert entries > 0
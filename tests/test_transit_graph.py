@@ -0,0 +1,100 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from app.services import db_initializer, graph_builder
+from app.services.graph_builder import (
+    build_graph, build_transit_graph, collapse_edges, compute_transfer_edges, compute_trip_edges,
+    load_transit_graph, save_transit_graph
+)
+from app.services.transit_graph import ARRAY_NAMES, CURRENT_FILE, VERSION_PREFIX, TransitGraph, current_version
+
+
+@pytest.fixture
+def compact(gtfs):
+    edges = collapse_edges(compute_trip_edges(gtfs["stop_times"], gtfs["trips"], gtfs["routes"]),
+                           compute_transfer_edges(gtfs["transfers"]))
+    stops = gtfs["stops"]
+    name_to_id = stops.drop_duplicates("stop_name").set_index("stop_name")["stop_id"].to_dict()
+    id_to_name = stops.set_index("stop_id")["stop_name"].to_dict()
+    return TransitGraph.from_edges(edges, stops=stops), name_to_id, id_to_name
+
+
+def test_round_trip(tmp_path, compact):
+    G, name_to_id, id_to_name = compact
+    directory = str(tmp_path / "graph")
+    save_transit_graph(G, name_to_id, id_to_name, directory, metadata={"key": "test"})
+
+    loaded, loaded_name_to_id, loaded_id_to_name = load_transit_graph(directory)
+    for name in ARRAY_NAMES:
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(G, name))
+    assert isinstance(loaded.targets, np.memmap)
+    assert (loaded.lines, loaded.modes) == (G.lines, G.modes)
+    assert loaded_name_to_id == name_to_id
+    assert loaded_id_to_name == id_to_name
+    assert sorted(loaded.edges(data=True)) == sorted(G.edges(data=True))
+
+
+def test_matches_networkx_graph(data_dir, gtfs, compact):
+    tables = (gtfs["stops"], gtfs["stop_times"], gtfs["trips"], gtfs["routes"], gtfs["transfers"])
+    nx_graph, _, _ = build_graph(*tables, key=graph_builder.graph_cache_key("fixture"))
+    G, _, _ = build_transit_graph(*tables, feed_hash="fixture")
+    assert G.number_of_edges() == nx_graph.number_of_edges()
+    for u, v, data in nx_graph.edges(data=True):
+        edge = G.get_edge_data(u, v)
+        assert (edge["weight"], edge["line"], edge["mode"]) == (data["weight"], data["line"], data["mode"])
+
+    # Seconde construction : artefact et graphe sérialisé relus depuis le cache
+    assert os.path.exists(graph_builder.graph_pickle_path(graph_builder.graph_cache_key("fixture")))
+    assert build_transit_graph(*tables, feed_hash="fixture")[0].number_of_edges() == G.number_of_edges()
+
+
+def test_save_switches_versions(tmp_path, compact):
+    G, name_to_id, id_to_name = compact
+    directory = str(tmp_path / "graph")
+    save_transit_graph(G, name_to_id, id_to_name, directory)
+    first, _, _ = load_transit_graph(directory)
+    first_version = current_version(directory)
+
+    for _ in range(2):
+        save_transit_graph(G, name_to_id, id_to_name, directory)
+    assert current_version(directory) != first_version
+    versions = [name for name in os.listdir(directory) if name.startswith(VERSION_PREFIX)]
+    assert len(versions) == 2 and os.path.basename(first_version) not in versions
+    # Un graphe ouvert avant le remplacement reste lisible
+    assert sorted(first.edges(data=True)) == sorted(G.edges(data=True))
+
+    os.remove(os.path.join(directory, CURRENT_FILE))
+    assert load_transit_graph(directory) is None
+
+
+def test_artifact_listing_ignores_temporary_entries(data_dir, gtfs):
+    tables = (gtfs["stops"], gtfs["stop_times"], gtfs["trips"], gtfs["routes"], gtfs["transfers"])
+    build_transit_graph(*tables, feed_hash="fixture")
+    key = graph_builder.graph_cache_key("fixture")
+    for name in (f"{key}.tmp-123", f"{key}.old-123", "notakey"):
+        os.makedirs(os.path.join(graph_builder.GRAPH_CACHE_DIR, name))
+    assert graph_builder.list_graph_artifacts() == [key]
+
+
+def test_build_graph_without_key_writes_nothing(data_dir, gtfs):
+    tables = (gtfs["stops"], gtfs["stop_times"], gtfs["trips"], gtfs["routes"], gtfs["transfers"])
+    G, _, _ = build_graph(*tables)
+    assert G.number_of_edges() > 0
+    assert not [name for name in os.listdir(data_dir) if name.endswith(".pkl")]
+
+
+def test_resolve_prunes_other_graph_pickles(data_dir, monkeypatch):
+    monkeypatch.setitem(graph_builder._serving, "key", None)
+    assert db_initializer.init_db()
+    key = graph_builder.graph_cache_key(graph_builder.get_feed_hash(graph_builder.GRAPH_INPUT_TABLES))
+    for name in ("graphe_transport.pkl", "graphe_transport-0123456789abcdef.pkl",
+                 os.path.basename(graph_builder.graph_pickle_path(key))):
+        with open(data_dir / name, "wb") as f:
+            pickle.dump(None, f)
+
+    assert graph_builder.resolve_graph_artifact() == graph_builder.graph_artifact_dir(key)
+    remaining = sorted(name for name in os.listdir(data_dir) if name.endswith(".pkl"))
+    assert remaining == [os.path.basename(graph_builder.graph_pickle_path(key))]